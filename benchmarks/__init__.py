@@ -0,0 +1 @@
+"""Benchmark harness: local BrightSky stand-in, synthetic data and timed scenarios"""
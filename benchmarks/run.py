@@ -0,0 +1,277 @@
+"""
+Timed pipeline scenarios against the local BrightSky stand-in.
+
+Each scenario runs in its own subprocess on a scratch database, so peak RSS is
+measured per scenario. Scenarios run in pipeline order and build on each
+other's output. Results (seconds, rows, rows/sec, peak RSS) are written to JSON.
+
+Usage:
+    python -m benchmarks.run --scale berlin
+    python -m benchmarks.run --scale germany --latency-ms 20 --error-rate 0.01
+    python -m benchmarks.run --scale multi-year --scenarios observations dbt_build
+    python -m benchmarks.run --scale germany --scenarios init_db stations sharded_ingest --workers 4
+    python -m benchmarks.run --scenarios import_times
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = PROJECT_ROOT / "benchmarks" / "results"
+
+SCENARIOS = ("import_times", "init_db", "stations", "postal_codes", "observations", "forecasts", "dbt_build", "interpolation", "rollups")
+# Ingests observations + forecasts through the spool instead; run it in their place
+OPTIONAL_SCENARIOS = ("sharded_ingest",)
+
+
+@dataclass(frozen=True)
+class Scale:
+    stations: int
+    postal_codes: int
+    lookback_days: int
+    forecast_days: int = 10
+    radius_deg: float = 0.3
+    postal_prefixes: Tuple[str, ...] = ("10", "12", "13")
+    regions: int = 1  # postal prefixes split round-robin into this many regions
+
+
+SCALES: Dict[str, Scale] = {
+    "berlin": Scale(stations=20, postal_codes=190, lookback_days=30),
+    "germany": Scale(
+        stations=500, postal_codes=8200, lookback_days=30, radius_deg=4.0,
+        postal_prefixes=tuple("0123456789"), regions=10,
+    ),
+    "multi-year": Scale(stations=20, postal_codes=190, lookback_days=3 * 365),
+}
+
+
+def bench_regions(scale: Scale) -> Dict[str, Dict]:
+    """CUSTOM_REGIONS for a scale: every region covers the whole stub station set."""
+    center_lat, center_lon = 52.52, 13.40  # StubConfig defaults
+    return {
+        f"bench-{i}": {
+            "center_lat": center_lat,
+            "center_lon": center_lon,
+            "max_distance_m": int(scale.radius_deg * 111000 * 1.5),
+            "postal_prefixes": list(scale.postal_prefixes[i::scale.regions]),
+        }
+        for i in range(scale.regions)
+    }
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _count(table: str) -> int:
+    from common import db
+
+    with db.session("benchmark_count") as conn:
+        return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+def import_time(module: str) -> Dict:
+    """`python -X importtime` summary of importing `module` in a fresh interpreter."""
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+    startup_s = time.perf_counter() - started
+    if proc.returncode != 0:
+        return {"module": module, "status": "error", "error": proc.stderr.strip().splitlines()[-1]}
+
+    total_us, packages = 0, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():  # column header
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        total_us += int(self_us)
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])[:5]
+    return {
+        "module": module,
+        "status": "ok",
+        "import_ms": round(total_us / 1000, 1),
+        "startup_s": round(startup_s, 3),
+        "heaviest_ms": {package: round(us / 1000, 1) for package, us in heaviest},
+    }
+
+
+def run_scenario(name: str) -> Dict:
+    """Run one scenario in this process (configured through the environment)."""
+    started = time.perf_counter()
+    rows = None
+    status = "ok"
+    imports = None
+
+    if name == "import_times":
+        # Cold start of each CLI stage, and of the Prefect tasks module for comparison
+        from orchestration.cli import STAGES
+        modules = {"cli": "orchestration.cli", **{stage: module for stage, (module, _, _) in STAGES.items()},
+                   "prefect_tasks": "orchestration.tasks"}
+        imports = {stage: import_time(module) for stage, module in modules.items()}
+        rows = len(imports)
+    elif name == "init_db":
+        from common.init_db import init_database
+        init_database()
+    elif name == "stations":
+        from ingestion.stations import StationDiscovery
+        StationDiscovery().run()
+        rows = _count("raw.weather_stations")
+    elif name == "postal_codes":
+        from ingestion.postal_codes import main as ingest_postal_codes
+        ingest_postal_codes(force=True)
+        rows = _count("raw.postal_codes")
+    elif name == "observations":
+        from ingestion.observations import ObservationsIngestion
+        rows = ObservationsIngestion().run()
+    elif name == "forecasts":
+        from ingestion.forecasts import ForecastsIngestion
+        rows = ForecastsIngestion().run()
+    elif name == "sharded_ingest":
+        from ingestion.spool import run_sharded
+        rows = sum(run_sharded().values())
+    elif name == "dbt_build":
+        from processing.station_mapping import StationLocationMapping
+        StationLocationMapping().run(force=True)
+        from orchestration.dbt_runner import ensure_deps, run_dbt
+        ensure_deps()
+        started = time.perf_counter()  # time the dbt build itself
+        try:
+            run_dbt(full_refresh=True)
+        except RuntimeError as e:
+            status = "failed"
+            print(e, file=sys.stderr)
+        run_results = PROJECT_ROOT / "transform" / "target" / "run_results.json"
+        if run_results.exists():
+            rows = len(json.loads(run_results.read_text()).get("results", []))
+    elif name == "interpolation":
+        from processing.interpolation import SpatialInterpolation
+        rows = SpatialInterpolation().run()
+    elif name == "rollups":
+        from processing.rollups import Rollups
+        rows = Rollups().run()
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+
+    seconds = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "status": status,
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "rows_per_s": round(rows / seconds, 1) if rows and name not in ("dbt_build", "import_times") else None,
+        "peak_rss_mb": max(_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN)),
+        **({"imports": imports} if imports is not None else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather pipeline benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="berlin")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS + OPTIONAL_SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--stations", type=int, help="Override the scale's station count")
+    parser.add_argument("--postal-codes", type=int, help="Override the scale's postal code count")
+    parser.add_argument("--lookback-days", type=int, help="Override the scale's observation history")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stub response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub responses that are 503s")
+    parser.add_argument("--workers", type=int, default=2, help="Fetch worker processes per dataset (sharded_ingest)")
+    parser.add_argument("--rate-limit", type=int, default=0, help="API_RATE_LIMIT for the run (0 = unlimited)")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary one)")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<scale>-<time>.json)")
+    parser.add_argument("--child", choices=SCENARIOS + OPTIONAL_SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child)))
+        return
+
+    scale = SCALES[args.scale]
+    overrides = {
+        "stations": args.stations, "postal_codes": args.postal_codes, "lookback_days": args.lookback_days,
+    }
+    scale = Scale(**{**asdict(scale), **{k: v for k, v in overrides.items() if v is not None}})
+
+    from benchmarks.stub_server import StubConfig, StubServer
+    stub = StubServer(StubConfig(
+        stations=scale.stations, postal_codes=scale.postal_codes, postal_prefixes=scale.postal_prefixes,
+        radius_deg=scale.radius_deg, latency_ms=args.latency_ms, error_rate=args.error_rate,
+    )).start()
+
+    regions = bench_regions(scale)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="weather-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(PROJECT_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "DUCKDB_PATH": str(workdir / "bench.db"),
+        "BRIGHTSKY_API_URL": stub.url,
+        "POSTAL_CODES_URL": stub.archive_url,
+        "POSTAL_CODES_CACHE_DIR": str(workdir / "cache"),
+        "CUSTOM_REGIONS": json.dumps(regions),
+        "REGIONS": json.dumps(sorted(regions)),
+        "HTTP_CACHE_ENABLED": "false",
+        "API_RATE_LIMIT": str(args.rate_limit),
+        "OBSERVATION_LOOKBACK_DAYS": str(scale.lookback_days),
+        "FORECAST_HORIZON_DAYS": str(scale.forecast_days),
+        "ARCHIVE_DIR": str(workdir / "archive"),
+        "SPOOL_DIR": str(workdir / "spool"),
+        "INGEST_WORKERS": str(args.workers),
+        "LOG_LEVEL": "WARNING",
+    }
+
+    print(f"🚀 Benchmark '{args.scale}' {asdict(scale)} in {workdir}")
+    results = []
+    for name in args.scenarios:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--child", name],
+            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            result = {"scenario": name, "status": "error", "error": "\n".join(proc.stderr.strip().splitlines()[-3:])}
+        else:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"  {name:<14} {result.get('status'):<7} {result.get('seconds', '-')}s "
+              f"rows={result.get('rows')} rows/s={result.get('rows_per_s')} peak={result.get('peak_rss_mb')}MB")
+        for stage, imported in result.get("imports", {}).items():
+            if imported["status"] != "ok":
+                print(f"    {stage:<16} error: {imported['error']}")
+                continue
+            heaviest = ", ".join(f"{package} {ms}ms" for package, ms in imported["heaviest_ms"].items())
+            print(f"    {stage:<16} {imported['import_ms']:>8}ms imports, {imported['startup_s']}s start-up ({heaviest})")
+
+    stub.stop()
+    report = {
+        "scale": args.scale,
+        "params": {**asdict(scale), "latency_ms": args.latency_ms, "error_rate": args.error_rate,
+                   "rate_limit": args.rate_limit, "workers": args.workers},
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "stub": {"requests": stub.requests, "injected_errors": stub.errors},
+        "db_size_mb": round(os.path.getsize(env["DUCKDB_PATH"]) / 1e6, 2) if os.path.exists(env["DUCKDB_PATH"]) else None,
+        "results": results,
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{args.scale}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
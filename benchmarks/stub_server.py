@@ -0,0 +1,157 @@
+"""
+Local stand-in for the BrightSky API.
+
+Serves `/sources`, `/weather` and the postal code release archive from
+`benchmarks.synthetic`, with configurable latency and error rate, so the
+ingestion code can run (and be timed) without api.brightsky.dev.
+
+Usage:
+    python -m benchmarks.stub_server --stations 50 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import synthetic
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PATH = "/postal_codes/{release}/postleitzahlen.geojson.br"
+
+
+@dataclass
+class StubConfig:
+    stations: int = 20
+    postal_codes: int = 190
+    postal_prefixes: Tuple[str, ...] = ("10", "12", "13")
+    center_lat: float = 52.52
+    center_lon: float = 13.40
+    radius_deg: float = 0.3
+    latency_ms: float = 0.0
+    error_rate: float = 0.0  # share of requests answered with a 503
+    seed: int = 0
+
+
+class StubServer:
+    """BrightSky stand-in running on a background thread."""
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._sources = json.dumps({"sources": synthetic.stations(
+            config.stations, config.center_lat, config.center_lon, config.radius_deg
+        )}).encode()
+        self._archive = synthetic.postal_code_archive(
+            config.postal_codes, config.postal_prefixes,
+            config.center_lat, config.center_lon, config.radius_deg,
+        )
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def archive_url(self) -> str:
+        return self.url + ARCHIVE_PATH
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.config.error_rate
+            self.errors += fail
+        return fail
+
+    def _weather(self, params) -> bytes:
+        wmo_station_id = params.get("wmo_station_id")
+        station = int(wmo_station_id) - synthetic.WMO_ID_BASE if wmo_station_id else 0
+        start = datetime.fromisoformat(params["date"]).astimezone(timezone.utc)
+        end = datetime.fromisoformat(params.get("last_date", params["date"])).astimezone(timezone.utc)
+        records = synthetic.weather(station, start, end, self.config.seed)
+        return json.dumps({"weather": records, "sources": []}).encode()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if stub.config.latency_ms:
+                    time.sleep(stub.config.latency_ms / 1000)
+                if stub._fail():
+                    self._send(503, b'{"error": "injected failure"}')
+                    return
+
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == "/sources":
+                    self._send(200, stub._sources)
+                elif url.path == "/weather":
+                    self._send(200, stub._weather(params))
+                elif url.path.startswith("/postal_codes/"):
+                    self._send(200, stub._archive, "application/octet-stream")
+                else:
+                    self._send(404, b'{"error": "not found"}')
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BrightSky stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--stations", type=int, default=StubConfig.stations)
+    parser.add_argument("--postal-codes", type=int, default=StubConfig.postal_codes)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        stations=args.stations, postal_codes=args.postal_codes,
+        latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed,
+    )
+    stub = StubServer(config, args.host, args.port)
+    print(f"✅ BrightSky stub at {stub.url} (archive: {stub.archive_url})")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
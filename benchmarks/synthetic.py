@@ -0,0 +1,127 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+Everything is derived from a seed, station index and hour, so repeated runs
+(and repeated requests for the same window) see identical values.
+"""
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Sequence
+
+import brotli
+
+STATION_ID_BASE = 100000
+WMO_ID_BASE = 10000
+CONDITIONS = ("dry", "dry", "dry", "rain", "fog", "snow")
+ICONS = ("clear-day", "partly-cloudy-day", "cloudy", "rain", "fog", "snow")
+
+
+def _offset(i: int, n: int, radius_deg: float):
+    """Spread n points on a sunflower spiral within radius_deg of the center."""
+    r = radius_deg * math.sqrt((i + 0.5) / n)
+    theta = i * 2.399963229728653  # golden angle
+    return r * math.cos(theta), r * math.sin(theta)
+
+
+def stations(n: int, center_lat: float, center_lon: float, radius_deg: float) -> List[Dict]:
+    """BrightSky /sources records: one synop and one forecast source per WMO station."""
+    sources = []
+    for i in range(n):
+        dlat, dlon = _offset(i, n, radius_deg)
+        for k, observation_type in enumerate(("synop", "forecast")):
+            sources.append({
+                "id": STATION_ID_BASE + 2 * i + k,
+                "dwd_station_id": f"{i:05d}",
+                "wmo_station_id": str(WMO_ID_BASE + i),
+                "station_name": f"Synthetic {i}",
+                "observation_type": observation_type,
+                "lat": round(center_lat + dlat, 5),
+                "lon": round(center_lon + dlon, 5),
+                "height": 40.0,
+                "first_record": "2000-01-01T00:00:00+00:00",
+                "last_record": "2099-01-01T00:00:00+00:00",
+                "distance": round(math.hypot(dlat, dlon) * 111000, 1),
+            })
+    return sources
+
+
+def weather(station: int, start: datetime, end: datetime, seed: int = 0) -> List[Dict]:
+    """BrightSky /weather records for every hour in [start, end]."""
+    records = []
+    t = start.replace(minute=0, second=0, microsecond=0)
+    while t <= end:
+        h = int(t.timestamp() // 3600)
+        phase = 2 * math.pi * (h % 24) / 24
+        noise = ((h * 2654435761 + station * 40503 + seed) % 1000) / 1000
+        records.append({
+            "timestamp": t.isoformat(),
+            "source_id": station,
+            "precipitation": round(max(0.0, noise - 0.8) * 5, 1),
+            "pressure_msl": round(1013 + 10 * math.sin(h / 97), 1),
+            "sunshine": round(max(0.0, math.sin(phase)) * 60, 1),
+            "temperature": round(10 + 8 * math.sin(phase - 2) + 4 * noise, 1),
+            "wind_direction": (h * 7 + station * 13) % 360,
+            "wind_speed": round(5 + 10 * noise, 1),
+            "cloud_cover": int(noise * 100),
+            "dew_point": round(5 + 3 * noise, 1),
+            "relative_humidity": 50 + int(noise * 50),
+            "visibility": 10000 + int(noise * 30000),
+            "wind_gust_direction": (h * 11 + station) % 360,
+            "wind_gust_speed": round(10 + 15 * noise, 1),
+            "condition": CONDITIONS[(h + station) % len(CONDITIONS)],
+            "precipitation_probability": None,
+            "precipitation_probability_6h": None,
+            "solar": round(max(0.0, math.sin(phase)) * 0.5, 3),
+            "icon": ICONS[(h + station) % len(ICONS)],
+            "fallback_source_ids": {"cloud_cover": station + 1},
+        })
+        t += timedelta(hours=1)
+    return records
+
+
+def _postal_codes(n: int, prefixes: Sequence[str]) -> Iterator[str]:
+    """n distinct 5-digit codes starting with one of `prefixes`, round-robin."""
+    counters = {p: 0 for p in prefixes}
+    emitted = 0
+    while emitted < n:
+        progressed = False
+        for p in prefixes:
+            suffix_len = 5 - len(p)
+            if counters[p] < 10 ** suffix_len and emitted < n:
+                yield f"{p}{counters[p]:0{suffix_len}d}"
+                counters[p] += 1
+                emitted += 1
+                progressed = True
+        if not progressed:
+            raise ValueError(f"Cannot make {n} postal codes from prefixes {prefixes}")
+
+
+def postal_code_archive(
+    n: int, prefixes: Sequence[str], center_lat: float, center_lon: float,
+    radius_deg: float, decoys: int = None,
+) -> bytes:
+    """
+    Brotli-compressed GeoJSON in the layout of the postleitzahlen release:
+    `n` square areas with matching codes plus `decoys` (default n) that the
+    loader's prefix filter has to skip.
+    """
+    decoy_prefixes = [d for d in "0123456789" if not any(p.startswith(d) for p in prefixes)]
+    decoys = (n if decoys is None else decoys) if decoy_prefixes else 0
+    codes = list(_postal_codes(n, prefixes))
+    if decoys:
+        codes += list(_postal_codes(decoys, decoy_prefixes))
+    half = radius_deg / max(math.sqrt(len(codes)), 1)
+
+    features = []
+    for i, plz in enumerate(codes):
+        dlat, dlon = _offset(i, len(codes), radius_deg)
+        lat, lon = center_lat + dlat, center_lon + dlon
+        ring = [[lon - half, lat - half], [lon + half, lat - half], [lon + half, lat + half],
+                [lon - half, lat + half], [lon - half, lat - half]]
+        features.append({
+            "type": "Feature",
+            "properties": {"postcode": plz},
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        })
+    return brotli.compress(json.dumps({"type": "FeatureCollection", "features": features}).encode(), quality=5)
@@ -0,0 +1,186 @@
+"""
+Parquet archive tier for raw history.
+
+Closed months of raw observations and forecasts are moved out of DuckDB into
+Hive-partitioned, zstd-compressed Parquet under `archive_dir`:
+
+    <archive_dir>/<dataset>/year=YYYY/month=M/station_id=X/*.parquet
+
+The dbt staging models union the hot tables with these files (see
+transform/macros/archive.sql). Each archive run adds a file per partition it
+touches and then merges the partitions that already held files (late rows
+for an archived month), so the committed archive holds every key once and
+staging only deduplicates where it overlaps the hot tables. `compact_archive`
+merges partitions that have accumulated several files back into one, keeping
+the newest copy of every key.
+"""
+import logging
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from common.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ArchiveDataset:
+    table: str
+    time_column: str
+    key: Tuple[str, ...]  # unique within a station partition
+    order_by: str  # newest copy of a key wins on compaction
+
+
+DATASETS: Dict[str, ArchiveDataset] = {
+    "weather_observations": ArchiveDataset(
+        "raw.weather_observations", "timestamp", ("timestamp",), "ingested_at"
+    ),
+    "weather_forecasts": ArchiveDataset(
+        "raw.weather_forecasts", "forecast_timestamp", ("forecast_timestamp", "issued_at"), "issued_at"
+    ),
+    "weather_forecasts_latest": ArchiveDataset(
+        "raw.weather_forecasts_latest", "forecast_timestamp", ("forecast_timestamp",), "issued_at"
+    ),
+}
+
+
+def archive_cutoff(now: datetime = None, hot_months: int = None) -> datetime:
+    """First instant that stays hot: the start of the month `hot_months` before the current one."""
+    if hot_months is None:
+        hot_months = settings.archive_hot_months
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    months = now.year * 12 + (now.month - 1) - hot_months
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def archived_files(name: str, start: datetime, end: datetime, archive_dir: str = None) -> List[Path]:
+    """Parquet files of dataset `name` in the months overlapping [start, end)."""
+    root = Path(archive_dir or settings.archive_dir) / name
+    files = []
+    year, month = start.year, start.month
+    while datetime(year, month, 1) < end:
+        files.extend(sorted((root / f"year={year}" / f"month={month}").glob("station_id=*/*.parquet")))
+        year, month = year + month // 12, month % 12 + 1
+    return files
+
+
+def archive_closed_periods(conn, now: datetime = None, hot_months: int = None, archive_dir: str = None) -> Dict[str, int]:
+    """
+    Move rows older than `archive_cutoff` from each raw table to Parquet.
+
+    Copy and delete run in one transaction, so a failed run leaves the rows in
+    DuckDB; files written by a run that failed to commit only duplicate hot
+    keys, which staging resolves until the next run moves the rows and merges
+    the partition. Returns rows moved per dataset.
+    """
+    cutoff = archive_cutoff(now, hot_months)
+    root = Path(archive_dir or settings.archive_dir)
+    moved = {}
+
+    for name, ds in DATASETS.items():
+        partitions = [
+            root / name / f"year={year}" / f"month={month}" / f"station_id={station_id}"
+            for year, month, station_id in conn.execute(f"""
+                SELECT DISTINCT year({ds.time_column}), month({ds.time_column}), station_id
+                FROM {ds.table}
+                WHERE {ds.time_column} < $cutoff
+            """, {"cutoff": cutoff}).fetchall()
+        ]
+        conn.begin()
+        try:
+            count = conn.execute(
+                f"SELECT count(*) FROM {ds.table} WHERE {ds.time_column} < $cutoff", {"cutoff": cutoff}
+            ).fetchone()[0]
+            if count:
+                (root / name).mkdir(parents=True, exist_ok=True)
+                conn.execute(f"""
+                    COPY (
+                        SELECT *, year({ds.time_column}) AS year, month({ds.time_column}) AS month
+                        FROM {ds.table}
+                        WHERE {ds.time_column} < $cutoff
+                        ORDER BY station_id, {', '.join(ds.key)}
+                    ) TO '{root / name}' (
+                        FORMAT parquet,
+                        COMPRESSION zstd,
+                        PARTITION_BY (year, month, station_id),
+                        APPEND,
+                        FILENAME_PATTERN 'part_{{uuid}}'
+                    )
+                """, {"cutoff": cutoff})
+                conn.execute(f"DELETE FROM {ds.table} WHERE {ds.time_column} < $cutoff", {"cutoff": cutoff})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved[name] = count
+
+        # Keep one copy per key: merge what this run appended to existing partitions
+        for partition in partitions:
+            files = sorted(partition.glob("*.parquet"))
+            if len(files) > 1:
+                _merge_partition(conn, ds, partition, files)
+
+    conn.execute("CHECKPOINT")
+    print(f"✅ Archived rows before {cutoff:%Y-%m-%d}: {moved}")
+    return moved
+
+
+def compact_archive(conn, min_files: int = None, archive_dir: str = None) -> int:
+    """
+    Merge every partition holding at least `min_files` files into a single file.
+
+    The merged file is written under a temporary name and renamed into place
+    before the originals are removed. Returns the number of partitions merged.
+    """
+    if min_files is None:
+        min_files = settings.archive_compact_min_files
+    root = Path(archive_dir or settings.archive_dir)
+    merged = 0
+
+    for name, ds in DATASETS.items():
+        for partition in sorted((root / name).glob("year=*/month=*/station_id=*")):
+            files = sorted(partition.glob("*.parquet"))
+            if len(files) < max(min_files, 2):
+                continue
+            _merge_partition(conn, ds, partition, files)
+            merged += 1
+
+    print(f"✅ Compacted {merged} archive partitions")
+    return merged
+
+
+def _merge_partition(conn, ds: ArchiveDataset, partition: Path, files: List[Path]):
+    """Replace `files` of one partition with a single file holding the newest copy of every key."""
+    target = partition / f"compact_{uuid.uuid4().hex}.parquet"
+    tmp = partition / (target.name + ".tmp")
+    file_list = ", ".join(f"'{f}'" for f in files)
+    conn.execute(f"""
+        COPY (
+            SELECT *
+            FROM read_parquet([{file_list}], hive_partitioning = false, union_by_name = true)
+            QUALIFY row_number() OVER (PARTITION BY {', '.join(ds.key)} ORDER BY {ds.order_by} DESC) = 1
+            ORDER BY {', '.join(ds.key)}
+        ) TO '{tmp}' (FORMAT parquet, COMPRESSION zstd)
+    """)
+    os.replace(tmp, target)
+    for f in files:
+        f.unlink()
+
+
+def drop_archived_months(name: str, before: datetime, archive_dir: str = None) -> int:
+    """Delete the archived months of dataset `name` that end on or before `before`. Returns months dropped."""
+    root = Path(archive_dir or settings.archive_dir) / name
+    dropped = 0
+    for month_dir in sorted(root.glob("year=*/month=*")):
+        year = int(month_dir.parent.name.split("=")[1])
+        month = int(month_dir.name.split("=")[1])
+        month_end = datetime(year + month // 12, month % 12 + 1, 1)
+        if month_end <= before:
+            shutil.rmtree(month_dir)
+            dropped += 1
+    return dropped
@@ -1,6 +1,6 @@
 import os
 import logging
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
@@ -9,27 +9,105 @@ class Settings(BaseSettings):
     
     @model_validator(mode='after')
     def resolve_paths(self):
-        # Ensure absolute path based on project root
-        if not os.path.isabs(self.duckdb_path):
-            root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            self.duckdb_path = os.path.join(root_dir, self.duckdb_path)
+        # Ensure absolute paths based on project root
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for field in ("duckdb_path", "http_cache_path", "postal_codes_cache_dir", "archive_dir", "serving_snapshot_path", "metrics_dir", "spool_dir", "export_dir"):
+            path = getattr(self, field)
+            if not os.path.isabs(path):
+                setattr(self, field, os.path.join(root_dir, path))
         return self
 
+    # DuckDB (common/db.py)
+    duckdb_memory_limit: str = ""  # e.g. "4GB"; empty = DuckDB's default (80% of RAM)
+    duckdb_threads: int = 0  # 0 = DuckDB's default (all cores)
+    duckdb_temp_directory: str = ""  # spill directory; empty = <database>.tmp
+    duckdb_checkpoint_threshold: str = "1GB"  # WAL size that forces a checkpoint mid-load
+    duckdb_extensions: Tuple[str, ...] = ("spatial",)  # loaded once per process
+
     brightsky_api_url: str = "https://api.brightsky.dev"
     log_level: str = "INFO"
     
     # API Config
-    api_rate_limit: int = 10
+    api_rate_limit: int = 10  # requests per second (token bucket)
+    api_max_concurrency: int = 8
+    api_max_retries: int = 4
+    api_backoff_factor: float = 0.5
+    api_timeout_s: int = 30
+
+    # HTTP Response Cache
+    http_cache_enabled: bool = True
+    http_cache_path: str = "data/http_cache.sqlite"
+    http_cache_max_bytes: int = 256 * 1024 * 1024
+    http_cache_ttls: Dict[str, int] = {"/sources": 6 * 3600, "/weather": 600}
+    http_cache_offline: bool = False  # Replay from cache only, never hit the API
     
+    # Regions (common/regions.py)
+    regions: Tuple[str, ...] = ("berlin",)  # region or group names to run
+    custom_regions: Dict[str, Dict] = {}  # name -> Region fields, added to the registry
+    station_active_since: str = "2025-09-01"  # stations without records since are ignored
+
     # Spatial Config
-    berlin_center_lat: float = 52.52
-    berlin_center_lon: float = 13.40
-    max_distance_m: int = 50000
-    berlin_postal_prefixes: Tuple[str, ...] = ("10", "12", "13")
+    postal_codes_release: str = "2025.12"
+    postal_codes_url: str = "https://github.com/yetzt/postleitzahlen/releases/download/{release}/postleitzahlen.geojson.br"
+    postal_codes_cache_dir: str = "data/cache"
+    station_map_k: int = 10  # nearest stations kept per postal code
     
     # Pipeline Config
+    station_refresh_hours: int = 24  # station metadata cadence (the flow runs every 15 min)
     observation_lookback_days: int = 30
     forecast_horizon_days: int = 10
+
+    # Historical Backfill (ingestion/backfill.py)
+    backfill_window_days: int = 7  # per-station request and checkpoint size
+
+    # Sharded Ingestion (ingestion/spool.py)
+    ingest_workers: int = 2  # fetch worker processes per dataset
+    spool_dir: str = "data/spool"
+    spool_batch_rows: int = 200_000  # rows per spool file
+    spool_max_pending_mb: int = 512  # workers pause while more than this awaits loading
+    spool_backpressure_timeout_s: int = 600
+    spool_load_max_files: int = 64  # files loaded per drain pass
+    spool_poll_s: float = 0.5
+
+    # dbt (orchestration/dbt_runner.py)
+    dbt_threads: int = 4  # models built in parallel
+
+    # Gap Filling (processing/gap_fill.py)
+    mart_schema: str = "main"  # schema dbt builds the marts in
+    gap_fill_max_interpolate_hours: int = 6  # longest interior gap interpolated
+    gap_fill_max_ffill_hours: int = 3  # longest gap forward-filled otherwise
+    gap_fill_block_hours: int = 720  # hours filled per pass, bounds memory after a full refresh
+
+    # Spatial Interpolation (processing/interpolation.py)
+    spatial_method: str = "idw"  # or "nearest": best-ranked reporting station, picked in dbt
+    idw_power: float = 2.0  # weight = 1 / distance ** power
+    idw_min_distance_m: float = 1000.0  # floor so a station at a centroid doesn't take all the weight
+    interpolation_block_hours: int = 168  # hours interpolated per sparse multiply
+
+    # Query Service (serving/)
+    serving_snapshot_path: str = "data/serving.duckdb"
+    serving_host: str = "0.0.0.0"
+    serving_port: int = 8081
+    serving_pool_size: int = 8
+    serving_cache_blocks: int = 50000  # (postal code, day) blocks kept in memory
+    serving_refresh_s: float = 2.0  # how often to check for a new snapshot
+
+    # Feature Export (serving/export.py)
+    export_dir: str = "data/export"  # Parquet days + mmap tensors for training jobs
+
+    # Forecast Vintages
+    forecast_vintage_keep_all_hours: int = 48
+    forecast_vintage_retention_days: int = 90  # 0 keeps thinned vintages forever
+
+    # Parquet Archive
+    archive_dir: str = "data/archive"
+    archive_hot_months: int = 1  # closed months kept in DuckDB besides the current one
+    archive_compact_min_files: int = 4
+    
+    # Run Metrics (common/metrics.py)
+    metrics_dir: str = "data/metrics"  # run reports, Prometheus textfile, profiles
+    profile_tasks: Tuple[str, ...] = ()  # stage names to profile, or ("*",) for all
+    profiler: str = "cprofile"  # or "pyinstrument" (if installed)
     
     # Schedule
     observation_schedule: str = "0 * * * *"
@@ -39,4 +117,29 @@ class Settings(BaseSettings):
         env_file = ".env"
         extra = "ignore"
 
-settings = Settings()
+_settings: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    """The process-wide Settings, built on first use."""
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
+
+
+class _LazySettings:
+    """
+    Stands in for the Settings instance until an attribute is read. Importing
+    a module costs no .env parsing or validation, and environment variables
+    set before the first read (CLI flags, benchmark harness) are honored.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+
+settings = _LazySettings()
@@ -0,0 +1,130 @@
+"""
+Shared DuckDB database per process.
+
+Components don't open the database file themselves:
+
+- `session()` (or `connect()`) hands out a cursor of one database instance
+  per file and process. The instance is opened once with the resource
+  limits from settings (`duckdb_memory_limit`, `duckdb_threads`,
+  `duckdb_temp_directory`) and the extensions in `duckdb_extensions` loaded
+  (installed only when LOAD fails), so no stage re-runs INSTALL/LOAD.
+- Automatic WAL checkpoints only happen past `duckdb_checkpoint_threshold`,
+  so a bulk load is not interrupted by checkpoints mid-stream. Bulk writers
+  pass `checkpoint=True` to checkpoint once after their load committed.
+- `release()` checkpoints and closes the instance, which frees the file
+  lock: before in-process dbt opens the file with its own configuration, and
+  at the end of a flow run.
+
+Opening the instance, each session (its queries) and each checkpoint are
+recorded as db_connect_seconds, db_session_seconds and db_checkpoint_seconds.
+
+DuckDB refuses a second instance of the same file with another
+configuration, so code in the pipeline process opens the database through
+this module (or calls release() first).
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import duckdb
+
+from common.config import settings
+from common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# absolute db path -> root connection of the process's database instance
+_databases: Dict[str, duckdb.DuckDBPyConnection] = {}
+_lock = threading.Lock()
+
+
+def _config() -> Dict[str, str]:
+    config = {"checkpoint_threshold": settings.duckdb_checkpoint_threshold}
+    if settings.duckdb_memory_limit:
+        config["memory_limit"] = settings.duckdb_memory_limit
+    if settings.duckdb_threads:
+        config["threads"] = settings.duckdb_threads
+    if settings.duckdb_temp_directory:
+        config["temp_directory"] = settings.duckdb_temp_directory
+    return config
+
+
+def _load_extension(conn, name: str):
+    try:
+        conn.execute(f"LOAD {name}")
+    except duckdb.Error:
+        logger.info(f"Installing DuckDB extension {name}...")
+        conn.execute(f"INSTALL {name}")
+        conn.execute(f"LOAD {name}")
+
+
+def database(db_path: str = None) -> duckdb.DuckDBPyConnection:
+    """Root connection of the process's instance of `db_path`, opened on first use."""
+    db_path = os.path.abspath(db_path or settings.duckdb_path)
+    with _lock:
+        root = _databases.get(db_path)
+        if root is None:
+            started = time.perf_counter()
+            root = duckdb.connect(db_path, config=_config())
+            for extension in settings.duckdb_extensions:
+                _load_extension(root, extension)
+            _databases[db_path] = root
+            seconds = time.perf_counter() - started
+            metrics.observe("db_connect_seconds", seconds)
+            logger.debug(f"Opened {db_path} in {seconds:.3f}s")
+        return root
+
+
+def connect(db_path: str = None) -> duckdb.DuckDBPyConnection:
+    """New cursor on the shared instance of `db_path`; close it when done."""
+    return database(db_path).cursor()
+
+
+@contextmanager
+def session(name: str, db_path: str = None, checkpoint: bool = False):
+    """
+    Cursor on the shared instance, closed on exit. With `checkpoint`, the WAL
+    is checkpointed after the block completed (not when it raised).
+    """
+    conn = connect(db_path)
+    started = time.perf_counter()
+    try:
+        yield conn
+    finally:
+        conn.close()
+        metrics.observe("db_session_seconds", time.perf_counter() - started, session=name)
+    if checkpoint:
+        run_checkpoint(name, db_path)
+
+
+def run_checkpoint(name: str, db_path: str = None) -> bool:
+    """Write the WAL into the database file. Returns False if DuckDB refused (e.g. an open transaction)."""
+    conn = connect(db_path)
+    started = time.perf_counter()
+    try:
+        conn.execute("CHECKPOINT")
+    except duckdb.Error as e:
+        logger.warning(f"Checkpoint after {name} skipped: {e}")
+        return False
+    finally:
+        conn.close()
+    seconds = time.perf_counter() - started
+    metrics.observe("db_checkpoint_seconds", seconds, session=name)
+    logger.info(f"Checkpoint after {name}: {seconds:.3f}s")
+    return True
+
+
+def release(db_path: str = None):
+    """Checkpoint and close the instance of `db_path` (all of them if None), freeing the file lock."""
+    with _lock:
+        paths = [os.path.abspath(db_path)] if db_path else list(_databases)
+        for path in paths:
+            root = _databases.pop(path, None)
+            if root is None:
+                continue
+            started = time.perf_counter()
+            root.close()  # checkpoints on close
+            metrics.observe("db_checkpoint_seconds", time.perf_counter() - started, session="release")
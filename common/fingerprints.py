@@ -0,0 +1,88 @@
+"""
+Stage fingerprints.
+
+`raw.stage_fingerprints` records a content hash per pipeline stage so a stage
+can tell whether its inputs changed since it last ran, and when it last did.
+"""
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+
+def _as_bytes(part) -> bytes:
+    if isinstance(part, bytes):
+        return part
+    if isinstance(part, str):
+        return part.encode()
+    if getattr(part, "dtype", None) is not None and part.dtype != object:
+        return part.tobytes()  # numeric NumPy array
+    if isinstance(part, (list, tuple)) or hasattr(part, "__array__"):
+        return repr([str(p) for p in part]).encode()
+    return repr(part).encode()
+
+
+def compute_fingerprint(*parts) -> str:
+    """Hash any mix of str/bytes/arrays/lists into a stable hex digest."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = _as_bytes(part)
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def files_fingerprint(root, patterns: Iterable[str]) -> str:
+    """Hash the relative paths and contents of the files under `root` matching `patterns`."""
+    root = Path(root)
+    paths = sorted({p for pattern in patterns for p in root.glob(pattern) if p.is_file()})
+    return compute_fingerprint(*(part for p in paths for part in (str(p.relative_to(root)), p.read_bytes())))
+
+
+def source_fingerprints(conn) -> Dict[str, str]:
+    """
+    Fingerprint per raw source table: row-count watermarks (rows written and the
+    latest timestamp) for the ingested datasets, the stage fingerprints of
+    every region (`<stage>:<region>`) for the reference tables.
+    """
+    watermarks = dict((dataset, (rows, last_ts)) for dataset, rows, last_ts in conn.execute("""
+        SELECT dataset, sum(row_count), max(last_timestamp)
+        FROM raw.ingestion_watermarks
+        GROUP BY dataset
+    """).fetchall())
+    stages = conn.execute(
+        "SELECT stage, fingerprint FROM raw.stage_fingerprints ORDER BY stage"
+    ).fetchall()
+
+    def region_stages(stage: str) -> list:
+        return [(name, fp) for name, fp in stages if name.startswith(f"{stage}:")]
+
+    return {
+        "weather_observations": compute_fingerprint(watermarks.get("observations")),
+        "weather_forecasts_latest": compute_fingerprint(watermarks.get("forecasts")),
+        "weather_stations": compute_fingerprint(region_stages("stations")),
+        "postal_codes": compute_fingerprint(region_stages("postal_codes")),
+        "station_location_map": compute_fingerprint(region_stages("station_location_map")),
+    }
+
+
+def get_fingerprint(conn, stage: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT fingerprint FROM raw.stage_fingerprints WHERE stage = ?", [stage]
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_fingerprint(conn, stage: str, fingerprint: str, row_count: int = None):
+    conn.execute("""
+        INSERT OR REPLACE INTO raw.stage_fingerprints (stage, fingerprint, row_count, updated_at)
+        VALUES (?, ?, ?, ?)
+    """, [stage, fingerprint, row_count, datetime.now(timezone.utc).replace(tzinfo=None)])
+
+
+def fingerprint_updated_at(conn, stage: str) -> Optional[datetime]:
+    """When `stage` last recorded its fingerprint (UTC-aware), or None."""
+    row = conn.execute(
+        "SELECT updated_at FROM raw.stage_fingerprints WHERE stage = ?", [stage]
+    ).fetchone()
+    return row[0].replace(tzinfo=timezone.utc) if row and row[0] else None
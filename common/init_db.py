@@ -2,38 +2,238 @@
 import duckdb
 from pathlib import Path
 
-
+from common import db
 from common.config import settings
+from common.fingerprints import compute_fingerprint, get_fingerprint, set_fingerprint
+
+STAGE = "init_db"
+
+# Value sets of the BrightSky `condition` and `icon` fields, stored as ENUMs.
+# Adding a label requires a migration (see common/migrations.py).
+WEATHER_CONDITIONS = ("dry", "fog", "rain", "sleet", "snow", "hail", "thunderstorm")
+WEATHER_ICONS = (
+    "clear-day", "clear-night", "partly-cloudy-day", "partly-cloudy-night", "cloudy",
+    "fog", "wind", "rain", "sleet", "snow", "hail", "thunderstorm",
+)
+ENUM_TYPES = {
+    "raw.weather_condition": WEATHER_CONDITIONS,
+    "raw.weather_icon": WEATHER_ICONS,
+}
+
+# Compact types: FLOAT for measurements, SMALLINT for directions (0-360),
+# UTINYINT for percentages, ENUMs for condition/icon
+OBSERVATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    timestamp TIMESTAMP NOT NULL,
+    station_id VARCHAR NOT NULL,
+    wmo_station_id VARCHAR,
+    source_id INTEGER,
+    precipitation FLOAT,
+    pressure_msl FLOAT,
+    sunshine FLOAT,
+    temperature FLOAT,
+    wind_direction SMALLINT,
+    wind_speed FLOAT,
+    cloud_cover UTINYINT,
+    dew_point FLOAT,
+    relative_humidity UTINYINT,
+    visibility INTEGER,
+    wind_gust_direction SMALLINT,
+    wind_gust_speed FLOAT,
+    condition raw.weather_condition,
+    precipitation_probability UTINYINT,
+    precipitation_probability_6h UTINYINT,
+    solar FLOAT,
+    icon raw.weather_icon,
+    fallback_source_ids VARCHAR,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (station_id, timestamp)
+)
+"""
+
+
+_FORECAST_COLUMNS = """
+    station_id VARCHAR NOT NULL,
+    wmo_station_id VARCHAR,
+    forecast_timestamp TIMESTAMP NOT NULL,
+    issued_at TIMESTAMP NOT NULL,
+    source_id INTEGER,
+    cloud_cover UTINYINT,
+    condition raw.weather_condition,
+    dew_point FLOAT,
+    icon raw.weather_icon,
+    precipitation FLOAT,
+    pressure_msl FLOAT,
+    relative_humidity UTINYINT,
+    sunshine FLOAT,
+    temperature FLOAT,
+    visibility INTEGER,
+    wind_direction SMALLINT,
+    wind_speed FLOAT,
+    wind_gust_direction SMALLINT,
+    wind_gust_speed FLOAT,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,"""
+
+# Every vintage whose values differ from the previous one for the same target hour
+FORECASTS_DDL = (
+    "CREATE TABLE IF NOT EXISTS {table} ("
+    + _FORECAST_COLUMNS
+    + "\n    PRIMARY KEY (station_id, forecast_timestamp, issued_at)\n)"
+)
+
+# Latest vintage per target hour, maintained alongside FORECASTS_DDL
+FORECASTS_LATEST_DDL = (
+    "CREATE TABLE IF NOT EXISTS {table} ("
+    + _FORECAST_COLUMNS
+    + "\n    PRIMARY KEY (station_id, forecast_timestamp)\n)"
+)
+
+# Canonical station id of each WMO station: every source of a WMO station
+# returns the same series, which is fetched, keyed and watermarked once under
+# this id (see assign_canonical_stations)
+CANONICAL_STATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS raw.canonical_stations (
+    wmo_station_id VARCHAR PRIMARY KEY,
+    station_id VARCHAR NOT NULL,
+    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Columns compared between vintages to decide whether a forecast row changed
+FORECAST_VALUE_COLUMNS = (
+    "source_id", "cloud_cover", "condition", "dew_point", "icon", "precipitation",
+    "pressure_msl", "relative_humidity", "sunshine", "temperature", "visibility",
+    "wind_direction", "wind_speed", "wind_gust_direction", "wind_gust_speed",
+)
+
+
+def has_column(conn, schema: str, table: str, column: str) -> bool:
+    return conn.execute("""
+        SELECT count(*) FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? AND column_name = ?
+    """, [schema, table, column]).fetchone()[0] > 0
+
+
+def has_primary_key(conn, schema: str, table: str) -> bool:
+    return conn.execute("""
+        SELECT count(*) FROM duckdb_constraints()
+        WHERE schema_name = ? AND table_name = ? AND constraint_type = 'PRIMARY KEY'
+    """, [schema, table]).fetchone()[0] > 0
+
+
+def create_enum_types(conn):
+    for name, values in ENUM_TYPES.items():
+        labels = ", ".join(f"'{v}'" for v in values)
+        conn.execute(f"CREATE TYPE IF NOT EXISTS {name} AS ENUM ({labels})")
+
+
+def insert_converted(conn, table: str, query: str):
+    """
+    Insert the rows of `query` into `table` by column name, converting each
+    column with TRY_CAST: out-of-range numbers and unknown ENUM labels become NULL.
+    """
+    schema, name = table.split(".")
+    target = dict(conn.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ?
+    """, [schema, name]).fetchall())
+    columns = [row[0] for row in conn.execute(f"DESCRIBE {query}").fetchall() if row[0] in target]
+    conn.execute(f"""
+        INSERT INTO {table} ({", ".join(f'"{c}"' for c in columns)})
+        SELECT {", ".join(f'TRY_CAST("{c}" AS {target[c]})' for c in columns)}
+        FROM ({query})
+    """)
+
+
+def assign_canonical_stations(conn, from_observations: bool = False):
+    """
+    Give WMO stations that have none a canonical station id: the lowest id
+    listing them. Assigned ids never move, so discovering a lower id later
+    does not re-key rows or orphan watermarks. With `from_observations`, WMO
+    stations that already have observations first keep the id of their latest
+    row (used when migrating and compacting existing tables).
+    """
+    if from_observations:
+        conn.execute("""
+            INSERT OR IGNORE INTO raw.canonical_stations (wmo_station_id, station_id)
+            SELECT wmo_station_id, arg_max(station_id, timestamp)
+            FROM raw.weather_observations
+            WHERE wmo_station_id IS NOT NULL AND station_id IS NOT NULL
+            GROUP BY wmo_station_id
+        """)
+    conn.execute("""
+        INSERT OR IGNORE INTO raw.canonical_stations (wmo_station_id, station_id)
+        SELECT wmo_station_id, min(id)
+        FROM raw.weather_stations
+        WHERE wmo_station_id IS NOT NULL
+        GROUP BY wmo_station_id
+    """)
+
+
+def seed_watermarks(conn):
+    """One-off backfill of watermarks from raw tables that predate them."""
+    for dataset, table, ts_column in (
+        ("observations", "raw.weather_observations", "timestamp"),
+        ("forecasts", "raw.weather_forecasts", "forecast_timestamp"),
+    ):
+        seeded = conn.execute(
+            "SELECT count(*) FROM raw.ingestion_watermarks WHERE dataset = ?", [dataset]
+        ).fetchone()[0]
+        if seeded:
+            continue
+        conn.execute(f"""
+            INSERT INTO raw.ingestion_watermarks (dataset, station_id, last_timestamp, last_run_at, row_count, temperature_rows)
+            SELECT ?, station_id, max({ts_column}), max(ingested_at), count(*), count(temperature)
+            FROM {table}
+            WHERE station_id IS NOT NULL
+            GROUP BY station_id
+        """, [dataset])
+
+
+def schema_fingerprint() -> str:
+    """Hash of the schema definition: this module and the migrations."""
+    from common import migrations
+    return compute_fingerprint(Path(__file__).read_bytes(), Path(migrations.__file__).read_bytes())
+
 
-def init_database(db_path: str = None):
-    """Initialize DuckDB with required extensions and schemas."""
+def is_initialized(db_path: str, fingerprint: str) -> bool:
+    """True when `db_path` was last initialized with the same schema definition."""
+    if not Path(db_path).exists():
+        return False
+    conn = db.connect(db_path)
+    try:
+        return get_fingerprint(conn, STAGE) == fingerprint
+    except duckdb.CatalogException:
+        return False  # predates raw.stage_fingerprints
+    finally:
+        conn.close()
+
+
+def init_database(db_path: str = None, force: bool = False):
+    """Initialize DuckDB with required extensions and schemas (skipped when already current)."""
     if db_path is None:
         db_path = settings.duckdb_path
     
+    fingerprint = schema_fingerprint()
+    if not force and is_initialized(db_path, fingerprint):
+        print(f"✅ DuckDB at {db_path} already initialized with the current schema, skipping.")
+        return
+    
     print(f"Initializing DuckDB at {db_path}")
     
     # Ensure directory exists
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
     
-    # Connect to DuckDB
-    conn = duckdb.connect(db_path)
+    # Connect to DuckDB (common/db.py installs and loads the extensions)
+    conn = db.connect(db_path)
     
     try:
-        # Install and load spatial extension
-        print("Installing spatial extension...")
-        conn.execute("INSTALL spatial")
-        conn.execute("LOAD spatial")
-        
-        # Install httpfs for remote file access (useful for postal codes)
-        print("Installing httpfs extension...")
-        conn.execute("INSTALL httpfs")
-        conn.execute("LOAD httpfs")
-        
         # Create schemas
         print("Creating schemas...")
         conn.execute("CREATE SCHEMA IF NOT EXISTS raw")
         conn.execute("CREATE SCHEMA IF NOT EXISTS staging")
         conn.execute("CREATE SCHEMA IF NOT EXISTS analytics")
+        create_enum_types(conn)
         
         # Create raw tables
         print("Creating raw tables...")
@@ -44,6 +244,7 @@ def init_database(db_path: str = None):
                 plz VARCHAR(5) PRIMARY KEY,
                 geometry GEOMETRY,
                 name VARCHAR(255),
+                region VARCHAR,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -67,67 +268,86 @@ def init_database(db_path: str = None):
             )
         """)
         
-        # Weather observations table (Explicit Schema)
+        # Region membership of stations (a station can sit in several discovery circles)
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS raw.weather_observations (
-                timestamp TIMESTAMP,
-                station_id VARCHAR,
-                wmo_station_id VARCHAR,
-                source_id BIGINT,
-                precipitation DOUBLE,
-                pressure_msl DOUBLE,
-                sunshine DOUBLE,
-                temperature DOUBLE,
-                wind_direction BIGINT,
-                wind_speed DOUBLE,
-                cloud_cover BIGINT,
-                dew_point DOUBLE,
-                relative_humidity BIGINT,
-                visibility BIGINT,
-                wind_gust_direction BIGINT,
-                wind_gust_speed DOUBLE,
-                condition VARCHAR,
-                precipitation_probability BIGINT,
-                precipitation_probability_6h BIGINT,
-                solar DOUBLE,
-                icon VARCHAR,
-                fallback_source_ids VARCHAR,
-                ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS raw.region_stations (
+                region VARCHAR NOT NULL,
+                station_id VARCHAR NOT NULL,
+                PRIMARY KEY (region, station_id)
             )
         """)
         
-        # Weather forecasts table with version tracking
+        conn.execute(CANONICAL_STATIONS_DDL)
+        
+        # Weather observations table (Explicit Schema, keyed on station + timestamp)
+        conn.execute(OBSERVATIONS_DDL.format(table="raw.weather_observations"))
+        
+        # Weather forecasts: one row per (station, target hour, vintage) plus the latest vintage
+        conn.execute(FORECASTS_DDL.format(table="raw.weather_forecasts"))
+        conn.execute(FORECASTS_LATEST_DDL.format(table="raw.weather_forecasts_latest"))
+        
+        # Per-station ingestion state (replaces MAX(timestamp) scans)
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS raw.weather_forecasts (
-                id INTEGER PRIMARY KEY,
+            CREATE TABLE IF NOT EXISTS raw.ingestion_watermarks (
+                dataset VARCHAR NOT NULL,
                 station_id VARCHAR NOT NULL,
-                wmo_station_id VARCHAR,
-                forecast_timestamp TIMESTAMP NOT NULL,
-                source_id INTEGER,
-                cloud_cover DOUBLE,
-                condition VARCHAR,
-                dew_point DOUBLE,
-                icon VARCHAR,
-                precipitation DOUBLE,
-                pressure_msl DOUBLE,
-                relative_humidity DOUBLE,
-                sunshine DOUBLE,
-                temperature DOUBLE,
-                visibility DOUBLE,
-                wind_direction DOUBLE,
-                wind_speed DOUBLE,
-                wind_gust_direction DOUBLE,
-                wind_gust_speed DOUBLE,
-                ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_timestamp TIMESTAMP,
+                last_run_at TIMESTAMP,
+                row_count BIGINT DEFAULT 0,
+                temperature_rows BIGINT DEFAULT 0,
+                PRIMARY KEY (dataset, station_id)
+            )
+        """)
+        # Completed windows of historical backfills (ingestion.backfill), for resuming
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw.backfill_windows (
+                dataset VARCHAR NOT NULL,
+                station_id VARCHAR NOT NULL,
+                window_start TIMESTAMP NOT NULL,
+                fetched_from TIMESTAMP,
+                window_end TIMESTAMP NOT NULL,
+                row_count BIGINT,
+                completed_at TIMESTAMP,
+                PRIMARY KEY (dataset, station_id, window_start)
+            )
+        """)
+        # Spool files already loaded (ingestion.spool), for exactly-once loads
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw.spool_loads (
+                batch_id VARCHAR PRIMARY KEY,
+                dataset VARCHAR NOT NULL,
+                row_count BIGINT,
+                loaded_at TIMESTAMP
+            )
+        """)
+        # Content hashes of stage inputs, used to skip unchanged work
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw.stage_fingerprints (
+                stage VARCHAR PRIMARY KEY,
+                fingerprint VARCHAR NOT NULL,
+                row_count BIGINT,
+                updated_at TIMESTAMP
             )
         """)
         
-        # Create sequences for auto-incrementing IDs
-
+        # Precomputed postal code -> nearest stations mapping (processing.station_mapping)
         conn.execute("""
-            CREATE SEQUENCE IF NOT EXISTS raw.weather_forecasts_id_seq START 1
+            CREATE TABLE IF NOT EXISTS raw.station_location_map (
+                postal_code VARCHAR NOT NULL,
+                wmo_station_id VARCHAR NOT NULL,
+                dist DOUBLE,
+                station_rank INTEGER NOT NULL,
+                region VARCHAR,
+                PRIMARY KEY (postal_code, wmo_station_id)
+            )
         """)
         
+        # Bring databases created by earlier versions up to the current schema
+        from common.migrations import run_migrations
+        run_migrations(conn)
+        seed_watermarks(conn)
+        set_fingerprint(conn, STAGE, fingerprint)
+        
         print("✅ Database initialized successfully!")
         
         # Show created objects
@@ -151,9 +371,10 @@ def init_database(db_path: str = None):
         raise
     finally:
         conn.close()
+    db.run_checkpoint("init_db", db_path)
     
     print(f"\n✅ DuckDB ready at {db_path}")
 
 
 if __name__ == "__main__":
-    init_database()
+    init_database(force=True)
@@ -0,0 +1,194 @@
+"""
+One-off maintenance commands for existing DuckDB databases.
+
+Usage:
+    python -m common.maintenance compact-observations
+    python -m common.maintenance thin-forecast-vintages
+    python -m common.maintenance archive
+    python -m common.maintenance compact-archive
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from common.archive import archive_closed_periods, compact_archive, drop_archived_months
+from common import db
+from common.config import settings
+from common.init_db import (
+    FORECAST_VALUE_COLUMNS,
+    FORECASTS_DDL,
+    FORECASTS_LATEST_DDL,
+    OBSERVATIONS_DDL,
+    assign_canonical_stations,
+    insert_converted,
+    seed_watermarks,
+)
+
+
+def compact_observations(conn):
+    """
+    Deduplicate raw.weather_observations in place and add its natural key.
+
+    Rows are re-keyed to the canonical station id of their WMO station
+    (raw.canonical_stations, the one ingestion fetches under), so that one
+    (station_id, timestamp) row exists per WMO station and hour.
+    The latest ingested copy wins. Observation watermarks are rebuilt afterwards.
+    """
+    conn.begin()
+    try:
+        conn.execute("DROP TABLE IF EXISTS raw.weather_observations__compact")
+        conn.execute(OBSERVATIONS_DDL.format(table="raw.weather_observations__compact"))
+        assign_canonical_stations(conn, from_observations=True)
+        insert_converted(conn, "raw.weather_observations__compact", """
+            SELECT o.* REPLACE (coalesce(c.station_id, o.station_id) AS station_id)
+            FROM raw.weather_observations o
+            LEFT JOIN raw.canonical_stations c ON o.wmo_station_id = c.wmo_station_id
+            WHERE o.timestamp IS NOT NULL AND coalesce(c.station_id, o.station_id) IS NOT NULL
+            QUALIFY row_number() OVER (
+                PARTITION BY coalesce(c.station_id, o.station_id), o.timestamp
+                ORDER BY o.ingested_at DESC
+            ) = 1
+        """)
+        before = conn.execute("SELECT count(*) FROM raw.weather_observations").fetchone()[0]
+        after = conn.execute("SELECT count(*) FROM raw.weather_observations__compact").fetchone()[0]
+
+        conn.execute("DROP TABLE raw.weather_observations")
+        conn.execute("ALTER TABLE raw.weather_observations__compact RENAME TO weather_observations")
+        conn.execute("DELETE FROM raw.ingestion_watermarks WHERE dataset = 'observations'")
+        seed_watermarks(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"✅ Compacted raw.weather_observations: {before} -> {after} rows")
+    return before - after
+
+
+def migrate_forecast_vintages(conn):
+    """
+    Convert a legacy id-keyed raw.weather_forecasts into vintage storage.
+
+    Each legacy ingestion run becomes a vintage (issued_at = ingested_at); only
+    rows whose values differ from the previous vintage of the same target hour
+    are kept. raw.weather_forecasts_latest is rebuilt from the result.
+    """
+    changed = " OR ".join(
+        f"{c} IS DISTINCT FROM lag({c}) OVER w" for c in FORECAST_VALUE_COLUMNS
+    )
+    conn.begin()
+    try:
+        conn.execute("DROP TABLE IF EXISTS raw.weather_forecasts__vintages")
+        conn.execute(FORECASTS_DDL.format(table="raw.weather_forecasts__vintages"))
+        insert_converted(conn, "raw.weather_forecasts__vintages", f"""
+            WITH runs AS (
+                SELECT * EXCLUDE (id), ingested_at AS issued_at
+                FROM raw.weather_forecasts
+                WHERE ingested_at IS NOT NULL
+                QUALIFY row_number() OVER (
+                    PARTITION BY station_id, forecast_timestamp, ingested_at ORDER BY id DESC
+                ) = 1
+            )
+            SELECT * FROM runs
+            WINDOW w AS (PARTITION BY station_id, forecast_timestamp ORDER BY issued_at)
+            QUALIFY lag(issued_at) OVER w IS NULL OR {changed}
+        """)
+        before = conn.execute("SELECT count(*) FROM raw.weather_forecasts").fetchone()[0]
+        after = conn.execute("SELECT count(*) FROM raw.weather_forecasts__vintages").fetchone()[0]
+
+        conn.execute("DROP TABLE raw.weather_forecasts")
+        conn.execute("ALTER TABLE raw.weather_forecasts__vintages RENAME TO weather_forecasts")
+        conn.execute("DROP SEQUENCE IF EXISTS raw.weather_forecasts_id_seq")
+
+        conn.execute("DROP TABLE IF EXISTS raw.weather_forecasts_latest")
+        conn.execute(FORECASTS_LATEST_DDL.format(table="raw.weather_forecasts_latest"))
+        conn.execute("""
+            INSERT INTO raw.weather_forecasts_latest BY NAME
+            SELECT * FROM raw.weather_forecasts
+            QUALIFY row_number() OVER (
+                PARTITION BY station_id, forecast_timestamp ORDER BY issued_at DESC
+            ) = 1
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"✅ Migrated raw.weather_forecasts to vintages: {before} -> {after} rows")
+    return before - after
+
+
+def thin_forecast_vintages(conn, keep_all_hours: int = None, retention_days: int = None, now: datetime = None):
+    """
+    Apply the forecast vintage retention policy.
+
+    - every vintage issued within `keep_all_hours` is kept;
+    - older vintages are thinned to the last one issued per day;
+    - vintages older than `retention_days` are dropped (0 keeps them forever).
+
+    The latest vintage of each target hour is never removed. Retention also
+    applies to the archive: archived months of raw.weather_forecasts whose
+    target hours all precede the retention cutoff (so every vintage was issued
+    before it) are deleted; the latest vintages stay in the archive of
+    raw.weather_forecasts_latest.
+    """
+    if keep_all_hours is None:
+        keep_all_hours = settings.forecast_vintage_keep_all_hours
+    if retention_days is None:
+        retention_days = settings.forecast_vintage_retention_days
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).replace(tzinfo=None)
+
+    keep_all_cutoff = now - timedelta(hours=keep_all_hours)
+    retention_cutoff = now - timedelta(days=retention_days) if retention_days else datetime.min
+
+    before = conn.execute("SELECT count(*) FROM raw.weather_forecasts").fetchone()[0]
+    conn.execute("""
+        DELETE FROM raw.weather_forecasts
+        WHERE rowid IN (
+            SELECT f.rowid
+            FROM raw.weather_forecasts f
+            LEFT JOIN raw.weather_forecasts_latest l
+                ON f.station_id = l.station_id
+                AND f.forecast_timestamp = l.forecast_timestamp
+                AND f.issued_at = l.issued_at
+            WHERE f.issued_at < $keep_all_cutoff
+              AND l.station_id IS NULL
+            QUALIFY f.issued_at < $retention_cutoff
+                OR row_number() OVER (
+                    PARTITION BY f.station_id, f.forecast_timestamp, date_trunc('day', f.issued_at)
+                    ORDER BY f.issued_at DESC
+                ) > 1
+        )
+    """, {"keep_all_cutoff": keep_all_cutoff, "retention_cutoff": retention_cutoff})
+    after = conn.execute("SELECT count(*) FROM raw.weather_forecasts").fetchone()[0]
+    archived_months = drop_archived_months("weather_forecasts", retention_cutoff) if retention_days else 0
+
+    print(f"✅ Thinned forecast vintages: removed {before - after} rows and {archived_months} archived months")
+    return before - after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather pipeline database maintenance")
+    parser.add_argument(
+        "command",
+        choices=["compact-observations", "thin-forecast-vintages", "archive", "compact-archive"]
+    )
+    parser.add_argument("--db-path", default=settings.duckdb_path)
+    args = parser.parse_args()
+
+    conn = db.connect(args.db_path)
+    try:
+        if args.command == "compact-observations":
+            compact_observations(conn)
+        elif args.command == "thin-forecast-vintages":
+            thin_forecast_vintages(conn)
+        elif args.command == "archive":
+            archive_closed_periods(conn)
+        elif args.command == "compact-archive":
+            compact_archive(conn)
+        conn.execute("CHECKPOINT")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
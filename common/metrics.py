@@ -0,0 +1,402 @@
+"""
+Run instrumentation for the pipeline.
+
+A process-wide registry (`metrics`) collects counters, latency histograms,
+per-station ingestion timings, per-task durations with the peak RSS growth
+over the task, and dbt model timings. Worker processes (ingestion/spool.py)
+write their registry as a fragment that the parent merges, so the run report
+covers them too. At the end of a flow run it is written out as a JSON run
+report and a Prometheus textfile (for node_exporter's textfile collector).
+
+Tasks opt into profiling with `PROFILE_TASKS` (task names, or "*"); profiles
+are written next to the reports with cProfile, or pyinstrument when selected
+and installed.
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from common.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; chosen to cover both HTTP calls and whole tasks
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process right now (Linux), else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_mb() -> float:
+    """Process-lifetime peak RSS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps recent samples for quantiles."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_samples: int = 10000):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._samples: deque = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self._samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 6)
+
+    def state(self) -> Dict:
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "count": self.count,
+                "sum": self.sum, "samples": list(self._samples)}
+
+    def merge(self, state: Dict):
+        """Add a histogram serialized by state() (same buckets) to this one."""
+        self.counts = [a + b for a, b in zip(self.counts, state["counts"])]
+        self.count += state["count"]
+        self.sum += state["sum"]
+        self._samples.extend(state["samples"])
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(max(self._samples), 6) if self._samples else None,
+        }
+
+
+class _RssSampler:
+    """Samples RSS on a background thread to find the peak within a window."""
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.start = self.peak = current_rss_mb() or 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            rss = current_rss_mb()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+
+class MetricsRegistry:
+    """Thread-safe store for one pipeline run's measurements."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.counters: Dict[Tuple[str, LabelKey], float] = {}
+            self.histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+            self.stages: List[Dict] = []
+            self.stations: Dict[str, Dict[str, Dict]] = {}
+            self.dbt_models: List[Dict] = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record_station(self, dataset: str, station_id: str, **timings):
+        """Accumulate per-station figures (fetch_s, convert_s, rows, ...)."""
+        with self._lock:
+            entry = self.stations.setdefault(dataset, {}).setdefault(str(station_id), {})
+            for k, v in timings.items():
+                entry[k] = entry.get(k, 0) + v
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a task and record the peak RSS reached while it ran, as the growth
+        over the RSS at its start (what the task itself allocated) and absolute.
+        """
+        started = time.perf_counter()
+        status = "ok"
+        with _RssSampler() as sampler:
+            try:
+                yield
+            except BaseException:
+                status = "failed"
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                with self._lock:
+                    self.stages.append({
+                        "stage": name,
+                        "status": status,
+                        "seconds": round(seconds, 3),
+                        "peak_rss_delta_mb": round(sampler.peak - sampler.start, 1),
+                        "peak_rss_mb": round(sampler.peak, 1),
+                        "pid": os.getpid(),
+                    })
+                self.observe("stage_seconds", seconds, stage=name)
+
+    def record_dbt_results(self, run_results_path) -> List[Dict]:
+        """Load per-model execution times from dbt's target/run_results.json."""
+        path = Path(run_results_path)
+        if not path.exists():
+            return []
+        models = []
+        for result in json.loads(path.read_text()).get("results", []):
+            models.append({
+                "unique_id": result.get("unique_id"),
+                "status": result.get("status"),
+                "seconds": round(result.get("execution_time") or 0.0, 3),
+                "rows_affected": (result.get("adapter_response") or {}).get("rows_affected"),
+            })
+        models.sort(key=lambda m: m["seconds"], reverse=True)
+        with self._lock:
+            self.dbt_models = models
+        return models
+
+    def fragment(self) -> Dict:
+        """This registry's raw state, for merge() in another process."""
+        with self._lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, labels, h.state()] for (name, labels), h in self.histograms.items()],
+                "stages": list(self.stages),
+                "stations": self.stations,
+            }
+
+    def merge(self, fragment: Dict):
+        """Add a fragment() of another process's registry to this one."""
+        with self._lock:
+            for name, labels, value in fragment["counters"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, state in fragment["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(state["buckets"])
+                histogram.merge(state)
+            self.stages.extend(fragment["stages"])
+            for dataset, per_station in fragment["stations"].items():
+                for sid, figures in per_station.items():
+                    entry = self.stations.setdefault(dataset, {}).setdefault(sid, {})
+                    for k, v in figures.items():
+                        entry[k] = entry.get(k, 0) + v
+
+    def write_fragment(self, path):
+        """Write fragment() to `path` (write-then-rename) for the parent process."""
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.fragment(), default=str))
+        os.replace(tmp, path)
+
+    def merge_fragments(self, paths) -> int:
+        """Merge and delete the fragment files in `paths` that exist. Returns the number merged."""
+        merged = 0
+        for path in map(Path, paths):
+            if not path.exists():
+                continue
+            self.merge(json.loads(path.read_text()))
+            path.unlink()
+            merged += 1
+        return merged
+
+    def report(self) -> Dict:
+        with self._lock:
+            stations = {}
+            for dataset, per_station in self.stations.items():
+                stations[dataset] = {}
+                for sid, v in per_station.items():
+                    seconds = v.get("fetch_s", 0) + v.get("convert_s", 0)
+                    stations[dataset][sid] = {
+                        **{k: round(x, 4) if isinstance(x, float) else x for k, x in v.items()},
+                        "rows_per_s": round(v.get("rows", 0) / seconds, 1) if seconds else None,
+                    }
+            return {
+                "started_at": self.started_at.isoformat(),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "max_rss_mb": round(max_rss_mb(), 1),
+                "stages": list(self.stages),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **h.summary()}
+                    for (name, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0])
+                ],
+                "stations": stations,
+                "dbt_models": list(self.dbt_models),
+            }
+
+    def prometheus_text(self, prefix: str = "weather_pipeline") -> str:
+        def fmt(labels: LabelKey, extra: Tuple = ()) -> str:
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = ",".join(f'{k}="{str(v)}"'.replace("\n", " ") for k, v in pairs)
+            return "{" + escaped + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{prefix}_{name}{fmt(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                    if n != name:
+                        continue
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{prefix}_{name}_bucket{fmt(labels, (('le', bound),))} {count}")
+                    lines.append(f"{prefix}_{name}_bucket{fmt(labels, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{prefix}_{name}_sum{fmt(labels)} {h.sum}")
+                    lines.append(f"{prefix}_{name}_count{fmt(labels)} {h.count}")
+            lines.append(f"# TYPE {prefix}_stage_peak_rss_delta_mb gauge")
+            for s in self.stages:
+                lines.append(f'{prefix}_stage_peak_rss_delta_mb{{stage="{s["stage"]}"}} {s["peak_rss_delta_mb"]}')
+            lines.append(f"# TYPE {prefix}_stage_peak_rss_mb gauge")
+            for s in self.stages:
+                lines.append(f'{prefix}_stage_peak_rss_mb{{stage="{s["stage"]}"}} {s["peak_rss_mb"]}')
+            lines.append(f"# TYPE {prefix}_dbt_model_seconds gauge")
+            for m in self.dbt_models:
+                lines.append(f'{prefix}_dbt_model_seconds{{model="{m["unique_id"]}"}} {m["seconds"]}')
+            lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+            lines.append(f"{prefix}_last_run_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, metrics_dir: str = None) -> Path:
+        """Write the JSON run report and the Prometheus textfile. Returns the report path."""
+        out = Path(metrics_dir or settings.metrics_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        report_path = out / f"run-{self.started_at:%Y%m%dT%H%M%S}.json"
+        report_path.write_text(json.dumps(self.report(), indent=2, default=str))
+
+        # Write-then-rename so the textfile collector never reads a partial file
+        prom_path = out / "weather_pipeline.prom"
+        tmp = prom_path.with_suffix(".prom.tmp")
+        tmp.write_text(self.prometheus_text())
+        os.replace(tmp, prom_path)
+
+        logger.info(f"✅ Run report written to {report_path}")
+        return report_path
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def profiled(name: str):
+    """Profile the block if `name` is listed in settings.profile_tasks (or "*")."""
+    if name not in settings.profile_tasks and "*" not in settings.profile_tasks:
+        yield
+        return
+
+    out = Path(settings.metrics_dir) / "profiles"
+    out.mkdir(parents=True, exist_ok=True)
+    stamp = f"{datetime.now():%Y%m%dT%H%M%S}"
+
+    if settings.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = out / f"{name}-{stamp}.html"
+                path.write_text(profiler.output_html())
+                logger.info(f"Profile written to {path}")
+            return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = out / f"{name}-{stamp}.prof"
+        profiler.dump_stats(str(path))
+        logger.info(f"Profile written to {path} (view with `python -m pstats` or snakeviz)")
+
+
+def instrumented(name: str):
+    """Decorator: record a stage (duration, peak RSS) and apply the opt-in profiler."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(name), profiled(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,187 @@
+"""
+Versioned schema migrations for the raw tables.
+
+Every migration is idempotent and recorded in raw.schema_migrations once it
+has run, so `run_migrations` only applies pending versions. A fresh database
+created from the current DDL passes through each of them as a no-op.
+
+Usage:
+    python -m common.migrations [--db-path PATH]
+"""
+import argparse
+
+from common import db
+from common.config import settings
+from common.init_db import (
+    CANONICAL_STATIONS_DDL,
+    FORECASTS_DDL,
+    FORECASTS_LATEST_DDL,
+    OBSERVATIONS_DDL,
+    assign_canonical_stations,
+    create_enum_types,
+    has_column,
+    has_primary_key,
+    insert_converted,
+)
+
+
+def _column_types(conn, table: str) -> list:
+    schema, name = table.split(".")
+    return conn.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ?
+        ORDER BY ordinal_position
+    """, [schema, name]).fetchall()
+
+
+def rebuild_table(conn, table: str, ddl: str) -> bool:
+    """
+    Recreate `table` from `ddl` if its column types differ, converting rows in place.
+    Returns True when the table was rebuilt.
+    """
+    staging = f"{table}__migrate"
+    conn.begin()
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        conn.execute(ddl.format(table=staging))
+        if _column_types(conn, staging) == _column_types(conn, table):
+            conn.execute(f"DROP TABLE {staging}")
+            conn.commit()
+            return False
+
+        insert_converted(conn, staging, f"SELECT * FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {staging} RENAME TO {table.split('.')[1]}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"✅ Rebuilt {table} with the current column types")
+    return True
+
+
+def _observations_natural_key(conn):
+    if not has_primary_key(conn, "raw", "weather_observations"):
+        from common.maintenance import compact_observations
+        compact_observations(conn)
+
+
+def _forecast_vintages(conn):
+    if has_column(conn, "raw", "weather_forecasts", "id"):
+        from common.maintenance import migrate_forecast_vintages
+        migrate_forecast_vintages(conn)
+
+
+def _compact_column_types(conn):
+    create_enum_types(conn)
+    rebuild_table(conn, "raw.weather_observations", OBSERVATIONS_DDL)
+    rebuild_table(conn, "raw.weather_forecasts", FORECASTS_DDL)
+    rebuild_table(conn, "raw.weather_forecasts_latest", FORECASTS_LATEST_DDL)
+
+
+def _region_columns(conn):
+    # Everything loaded before the region registry belongs to the Berlin region
+    for table in ("raw.postal_codes", "raw.station_location_map"):
+        schema, name = table.split(".")
+        if not has_column(conn, schema, name, "region"):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN region VARCHAR")
+            conn.execute(f"UPDATE {table} SET region = 'berlin' WHERE region IS NULL")
+    conn.execute("""
+        INSERT OR IGNORE INTO raw.region_stations (region, station_id)
+        SELECT 'berlin', id FROM raw.weather_stations
+    """)
+
+
+def _canonical_stations(conn):
+    # Pin the ids observations are stored under; re-key WMO stations stored
+    # under several ids (the lowest id moved when discovery added a station)
+    conn.execute(CANONICAL_STATIONS_DDL)
+    assign_canonical_stations(conn, from_observations=True)
+    split = conn.execute("""
+        SELECT count(*) FROM (
+            SELECT wmo_station_id FROM raw.weather_observations
+            WHERE wmo_station_id IS NOT NULL
+            GROUP BY wmo_station_id
+            HAVING count(DISTINCT station_id) > 1
+        )
+    """).fetchone()[0]
+    if split:
+        from common.maintenance import compact_observations
+        compact_observations(conn)
+
+
+def _watermark_temperature_rows(conn):
+    # Lets the station map find stations with temperature data without scanning the raw tables
+    if has_column(conn, "raw", "ingestion_watermarks", "temperature_rows"):
+        return
+    conn.execute("ALTER TABLE raw.ingestion_watermarks ADD COLUMN temperature_rows BIGINT DEFAULT 0")
+    for dataset, table in (("observations", "raw.weather_observations"), ("forecasts", "raw.weather_forecasts")):
+        conn.execute(f"""
+            UPDATE raw.ingestion_watermarks w
+            SET temperature_rows = t.temperature_rows
+            FROM (SELECT station_id, count(temperature) AS temperature_rows FROM {table} GROUP BY station_id) t
+            WHERE w.dataset = ? AND w.station_id = t.station_id
+        """, [dataset])
+
+
+def _backfill_fetched_from(conn):
+    # Windows checkpointed before this were always fetched from their grid start
+    if has_column(conn, "raw", "backfill_windows", "fetched_from"):
+        return
+    conn.execute("ALTER TABLE raw.backfill_windows ADD COLUMN fetched_from TIMESTAMP")
+    conn.execute("UPDATE raw.backfill_windows SET fetched_from = window_start")
+
+
+# (version, name, function) in the order they must be applied
+MIGRATIONS = [
+    (1, "observations_natural_key", _observations_natural_key),
+    (2, "forecast_vintages", _forecast_vintages),
+    (3, "compact_column_types", _compact_column_types),
+    (4, "region_columns", _region_columns),
+    (5, "canonical_stations", _canonical_stations),
+    (6, "watermark_temperature_rows", _watermark_temperature_rows),
+    (7, "backfill_fetched_from", _backfill_fetched_from),
+]
+
+
+def run_migrations(conn) -> list:
+    """Apply pending migrations in version order. Returns the versions applied."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS raw.schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    applied = {row[0] for row in conn.execute("SELECT version FROM raw.schema_migrations").fetchall()}
+
+    ran = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {name}...")
+        migrate(conn)
+        conn.execute("INSERT INTO raw.schema_migrations (version, name) VALUES (?, ?)", [version, name])
+        ran.append(version)
+
+    if ran:
+        conn.execute("CHECKPOINT")
+        print(f"✅ Applied migrations {ran}")
+    return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--db-path", default=settings.duckdb_path)
+    args = parser.parse_args()
+
+    conn = db.connect(args.db_path)
+    try:
+        run_migrations(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
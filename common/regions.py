@@ -0,0 +1,107 @@
+"""
+Region registry.
+
+A region is an independent partition of the pipeline: a station discovery
+circle, the postal code prefixes it serves and the radius used to map its
+postal codes to stations. Stations, postal codes, the station map and the
+gap-fill stage are refreshed region by region, each with its own fingerprint
+and transaction, so a run only holds one region in memory and a region can be
+scheduled on its own (`--regions` / the flow's `regions` parameter).
+
+`settings.regions` names the active regions; `settings.custom_regions` adds or
+overrides entries (name -> Region fields), e.g.
+
+    REGIONS='["germany"]'
+    CUSTOM_REGIONS='{"potsdam": {"center_lat": 52.4, "center_lon": 13.06, "max_distance_m": 30000, "postal_prefixes": ["144"]}}'
+
+The discovery circle should reach past the region's postal area so postal
+codes near its border still see their nearest stations. The postal prefixes
+of active regions must not overlap: a postal code belongs to one region.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from common.config import settings
+
+
+@dataclass(frozen=True)
+class Region:
+    name: str
+    center_lat: float
+    center_lon: float
+    max_distance_m: int  # station discovery radius around the center
+    postal_prefixes: Tuple[str, ...]
+    station_map_radius_m: int = 15000  # postal code -> station search radius
+
+    def __post_init__(self):
+        # Custom regions come from JSON lists
+        object.__setattr__(self, "postal_prefixes", tuple(self.postal_prefixes))
+
+    def stage(self, stage: str) -> str:
+        """Fingerprint stage name of `stage` for this region."""
+        return f"{stage}:{self.name}"
+
+
+# Germany by postal zone (first digit of the postcode). Rural zones have
+# sparser stations, hence the wider mapping radius.
+_GERMANY = (
+    Region("de-0", 51.1, 12.6, 170000, ("0",), 25000),  # Saxony, southern Saxony-Anhalt, eastern Thuringia
+    Region("de-1", 53.0, 13.2, 200000, ("1",), 25000),  # Berlin, Brandenburg, Mecklenburg-Vorpommern
+    Region("de-2", 53.6, 9.6, 200000, ("2",), 25000),  # Hamburg, Bremen, Schleswig-Holstein, northern Lower Saxony
+    Region("de-3", 51.9, 10.2, 170000, ("3",), 25000),  # Hanover, Brunswick, Magdeburg, Kassel
+    Region("de-4", 51.6, 7.4, 150000, ("4",), 20000),  # Ruhr, Düsseldorf, Münster, Osnabrück
+    Region("de-5", 50.4, 7.1, 150000, ("5",), 20000),  # Cologne, Bonn, Aachen, Koblenz, Trier
+    Region("de-6", 49.8, 8.4, 150000, ("6",), 20000),  # Frankfurt, Mainz, Mannheim, Saarland
+    Region("de-7", 48.4, 8.9, 150000, ("7",), 20000),  # Stuttgart, Karlsruhe, Freiburg
+    Region("de-8", 48.0, 11.4, 150000, ("8",), 25000),  # Munich, Augsburg, Rosenheim
+    Region("de-9", 49.9, 11.1, 170000, ("9",), 25000),  # Nuremberg, Würzburg, Regensburg, Erfurt
+)
+
+REGIONS: Dict[str, Region] = {
+    region.name: region
+    for region in (Region("berlin", 52.52, 13.40, 50000, ("10", "12", "13")), *_GERMANY)
+}
+
+# Names that expand to several regions in `settings.regions`
+GROUPS: Dict[str, Tuple[str, ...]] = {
+    "germany": tuple(region.name for region in _GERMANY),
+}
+
+
+def registry() -> Dict[str, Region]:
+    """Built-in regions with `settings.custom_regions` added on top."""
+    regions = dict(REGIONS)
+    for name, fields in settings.custom_regions.items():
+        base = regions.get(name)
+        if base is not None:
+            fields = {
+                "center_lat": base.center_lat, "center_lon": base.center_lon,
+                "max_distance_m": base.max_distance_m, "postal_prefixes": base.postal_prefixes,
+                "station_map_radius_m": base.station_map_radius_m, **fields,
+            }
+        regions[name] = Region(name=name, **fields)
+    return regions
+
+
+def active_regions(names: Optional[Iterable[str]] = None) -> List[Region]:
+    """
+    Resolve region names (default `settings.regions`, groups expanded) to
+    Regions. Raises ValueError for unknown names or overlapping prefixes.
+    """
+    known = registry()
+    expanded = []
+    for name in (settings.regions if names is None else names):
+        for member in GROUPS.get(name, (name,)):
+            if member not in known:
+                raise ValueError(f"Unknown region '{member}'. Known: {', '.join(sorted(set(known) | set(GROUPS)))}")
+            if member not in expanded:
+                expanded.append(member)
+
+    regions = [known[name] for name in expanded]
+    for i, a in enumerate(regions):
+        for b in regions[i + 1:]:
+            overlap = [p for p in a.postal_prefixes for q in b.postal_prefixes if p.startswith(q) or q.startswith(p)]
+            if overlap:
+                raise ValueError(f"Regions '{a.name}' and '{b.name}' share postal prefixes {overlap}")
+    return regions
+
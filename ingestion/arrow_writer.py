@@ -0,0 +1,196 @@
+"""
+Arrow ingestion path for BrightSky `weather` arrays.
+
+Response bodies are parsed by pyarrow's JSON reader straight into Arrow
+columns (no Python object per record), converted with Arrow compute into
+typed record batches that match the raw table schemas in `common.init_db`,
+filtered, and accumulated across stations so a run appends everything in one
+transaction.
+"""
+import io
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+
+from common.init_db import FORECAST_VALUE_COLUMNS, WEATHER_CONDITIONS, WEATHER_ICONS
+
+# Measurement columns shared by observations and forecasts, typed as in init_db
+_MEASUREMENTS = [
+    ("source_id", pa.int32()),
+    ("precipitation", pa.float32()),
+    ("pressure_msl", pa.float32()),
+    ("sunshine", pa.float32()),
+    ("temperature", pa.float32()),
+    ("wind_direction", pa.int16()),
+    ("wind_speed", pa.float32()),
+    ("cloud_cover", pa.uint8()),
+    ("dew_point", pa.float32()),
+    ("relative_humidity", pa.uint8()),
+    ("visibility", pa.int32()),
+    ("wind_gust_direction", pa.int16()),
+    ("wind_gust_speed", pa.float32()),
+    ("condition", pa.string()),
+    ("precipitation_probability", pa.uint8()),
+    ("precipitation_probability_6h", pa.uint8()),
+    ("solar", pa.float32()),
+    ("icon", pa.string()),
+]
+
+OBSERVATION_SCHEMA = pa.schema(
+    [("timestamp", pa.timestamp("us")), ("station_id", pa.string()), ("wmo_station_id", pa.string())]
+    + _MEASUREMENTS
+    + [("fallback_source_ids", pa.string()), ("ingested_at", pa.timestamp("us"))]
+)
+
+FORECAST_SCHEMA = pa.schema(
+    [("forecast_timestamp", pa.timestamp("us")), ("station_id", pa.string()), ("wmo_station_id", pa.string())]
+    + [(name, dtype) for name, dtype in _MEASUREMENTS if name in FORECAST_VALUE_COLUMNS]
+    + [("ingested_at", pa.timestamp("us"))]
+)
+
+# Labels outside the ENUM types are stored as NULL rather than failing the insert
+_ENUM_LABELS = {
+    "condition": pa.array(WEATHER_CONDITIONS),
+    "icon": pa.array(WEATHER_ICONS),
+}
+
+# Weather parameters that `fallback_source_ids` can map to a fallback source id
+_FALLBACK_FIELDS = [name for name, _ in _MEASUREMENTS if name != "source_id"]
+
+# Shape of a BrightSky record on the wire: numbers as float64, timestamps as ISO strings
+_WIRE_TYPE = pa.struct(
+    [("timestamp", pa.string())]
+    + [(name, pa.float64() if dtype != pa.string() else dtype) for name, dtype in _MEASUREMENTS]
+    + [("fallback_source_ids", pa.struct([(name, pa.int64()) for name in _FALLBACK_FIELDS]))]
+)
+
+# Fields other than `weather` (e.g. `sources`) are skipped by the parser
+_PARSE_OPTIONS = pj.ParseOptions(
+    explicit_schema=pa.schema([("weather", pa.list_(_WIRE_TYPE))]),
+    unexpected_field_behavior="ignore",
+    newlines_in_values=True,
+)
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def parse_weather(body: bytes) -> pa.RecordBatch:
+    """The `weather` array of a BrightSky response body, as a record batch of `_WIRE_TYPE` fields."""
+    table = pj.read_json(io.BytesIO(body), parse_options=_PARSE_OPTIONS)
+    return pa.RecordBatch.from_struct_array(table.column("weather").combine_chunks().flatten())
+
+
+def _try_cast(values: pa.Array, dtype: pa.DataType) -> pa.Array:
+    """
+    Cast wire float64 values to `dtype` like the TRY_CAST of
+    `insert_converted`: integers are rounded half to even, and values outside
+    the type's range become NULL instead of wrapping around.
+    """
+    if pa.types.is_integer(dtype):
+        values = pc.round(values, round_mode="half_to_even")
+        bounds = np.iinfo(dtype.to_pandas_dtype())
+    elif pa.types.is_floating(dtype):
+        bounds = np.finfo(dtype.to_pandas_dtype())
+    else:
+        return pc.cast(values, dtype)
+    in_range = pc.and_(pc.greater_equal(values, float(bounds.min)), pc.less_equal(values, float(bounds.max)))
+    return pc.cast(pc.if_else(in_range, values, pa.scalar(None, type=values.type)), dtype, safe=False)
+
+
+def _json_objects(ids: pa.StructArray) -> pa.Array:
+    """`fallback_source_ids` as JSON object strings ('{"cloud_cover": 12}'), built with string kernels."""
+    pairs = [
+        # '"name": id, ' or "" when the parameter has no fallback; the last
+        # separator is trimmed below
+        pc.fill_null(
+            pc.binary_join_element_wise(f'"{name}": ', pc.cast(source_ids, pa.string()), ", ", ""), ""
+        )
+        for name, source_ids in zip(_FALLBACK_FIELDS, ids.flatten())
+    ]
+    body = pc.utf8_rtrim(pc.binary_join_element_wise(*pairs, ""), characters=", ")
+    objects = pc.binary_join_element_wise("{", body, "}", "")
+    return pc.if_else(ids.is_valid(), objects, pa.scalar(None, type=pa.string()))
+
+
+def decode_weather(
+    body: bytes,
+    schema: pa.Schema,
+    constants: Dict,
+    time_column: str = "timestamp",
+    after: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> pa.RecordBatch:
+    """
+    Decode the `weather` array of a BrightSky response body into a record
+    batch of `schema`.
+
+    `constants` fills per-station columns (station ids, ingested_at). Rows are
+    kept when `after < timestamp <= until` (either bound optional).
+    """
+    wire = parse_weather(body)
+    timestamps = pc.cast(
+        pc.cast(wire.column("timestamp"), pa.timestamp("us", tz="UTC")), pa.timestamp("us")
+    )
+
+    columns = []
+    for field in schema:
+        if field.name in constants:
+            value = constants[field.name]
+            if isinstance(value, datetime):
+                value = _naive_utc(value)
+            columns.append(pa.repeat(pa.scalar(value, type=field.type), wire.num_rows))
+        elif field.name == time_column:
+            columns.append(timestamps)
+        elif field.name == "fallback_source_ids":
+            columns.append(_json_objects(wire.column(field.name)))
+        elif field.name in _ENUM_LABELS:
+            labels = wire.column(field.name)
+            known = pc.is_in(labels, value_set=_ENUM_LABELS[field.name])
+            columns.append(pc.if_else(known, labels, pa.scalar(None, type=field.type)))
+        else:
+            columns.append(_try_cast(wire.column(field.name), field.type))
+    batch = pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    mask = None
+    if after is not None:
+        mask = pc.greater(timestamps, pa.scalar(_naive_utc(after), type=pa.timestamp("us")))
+    if until is not None:
+        upper = pc.less_equal(timestamps, pa.scalar(_naive_utc(until), type=pa.timestamp("us")))
+        mask = upper if mask is None else pc.and_(mask, upper)
+    if mask is not None:
+        batch = batch.filter(mask)
+    return batch
+
+
+class ArrowBatchWriter:
+    """Collects per-station batches for a single bulk append at the end of a run."""
+
+    def __init__(self, schema: pa.Schema, time_column: str):
+        self.schema = schema
+        self.time_column = time_column
+        self.batches: List[pa.RecordBatch] = []
+        # station_id -> (row_count, max timestamp)
+        self.stations: Dict[str, tuple] = {}
+
+    def add(self, station_id: str, batch: pa.RecordBatch) -> int:
+        if batch.num_rows == 0:
+            return 0
+        self.batches.append(batch)
+        last_ts = pc.max(batch.column(self.time_column)).as_py()
+        self.stations[station_id] = (batch.num_rows, last_ts)
+        return batch.num_rows
+
+    @property
+    def num_rows(self) -> int:
+        return sum(b.num_rows for b in self.batches)
+
+    def table(self) -> pa.Table:
+        return pa.Table.from_batches(self.batches, schema=self.schema)
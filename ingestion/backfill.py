@@ -0,0 +1,200 @@
+"""
+Resumable historical backfill of observations.
+
+Regular runs fetch `observation_lookback_days` per new station in one
+request. For longer history (e.g. years of training data) this splits the
+range into fixed windows of `backfill_window_days` per station:
+
+- windows are aligned to a global grid, so they are the same whatever range
+  a run asks for; the first one is only fetched from the requested start, and
+  its checkpoint records where the fetch began;
+- windows are fetched concurrently within the client's rate limit, with at
+  most `api_max_concurrency` in flight, so memory holds about one window per
+  worker;
+- each window is written together with its checkpoint in
+  raw.backfill_windows in one transaction; a rerun skips checkpointed
+  windows, so an interrupted or partly failed backfill resumes where it
+  stopped.
+
+Usage:
+    python -m ingestion.backfill --start 2022-01-01 [--end 2025-01-01] [--window-days 7] [--regions berlin]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+
+from common import db
+from common.config import settings
+from common.metrics import metrics
+from ingestion import brightsky_client
+from ingestion.arrow_writer import OBSERVATION_SCHEMA, decode_weather
+from ingestion.observations import ObservationsIngestion, _window_end
+from ingestion.watermarks import OBSERVATIONS
+
+logger = logging.getLogger(__name__)
+
+# Origin of the window grid (a Monday, so 7-day windows run Monday to Monday)
+GRID_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def windows(start: datetime, end: datetime, window_days: int) -> List[Tuple[datetime, datetime, datetime]]:
+    """
+    Grid-aligned windows covering (start, end] as (window_start, fetch_from,
+    window_end): rows in (fetch_from, window_end] are fetched, with fetch_from
+    clipped to start and window_end to end.
+    """
+    size = timedelta(days=window_days)
+    first = GRID_ORIGIN + size * ((start - GRID_ORIGIN) // size)
+    result = []
+    while first < end:
+        result.append((first, max(first, start), min(first + size, end)))
+        first += size
+    return result
+
+
+class ObservationsBackfill:
+    """Backfills raw.weather_observations window by window."""
+
+    def __init__(self, start: datetime, end: datetime = None, window_days: int = None,
+                 db_path: str = None, regions: Optional[Iterable[str]] = None):
+        self.db_path = db_path or settings.duckdb_path
+        self.start = start
+        self.end = end or _window_end(datetime.now(timezone.utc))
+        self.window_days = window_days or settings.backfill_window_days
+        self.ingestion = ObservationsIngestion(self.db_path, regions=regions)
+        logger.info(
+            f"Initialized ObservationsBackfill | {self.start:%Y-%m-%d} to {self.end:%Y-%m-%d %H:%M} "
+            f"in {self.window_days}-day windows | db: {self.db_path}"
+        )
+
+    def plan(self, conn) -> List[Dict]:
+        """Station windows of the range that have no checkpoint yet."""
+        stations = self.ingestion.plan(conn, self.end)
+        done = {
+            (station_id, window_start): (fetched_from, window_end)
+            for station_id, window_start, fetched_from, window_end in conn.execute("""
+                SELECT station_id, window_start, coalesce(fetched_from, window_start), window_end
+                FROM raw.backfill_windows
+                WHERE dataset = ?
+            """, [OBSERVATIONS]).fetchall()
+        }
+        grid = windows(self.start, self.end, self.window_days)
+        todo = []
+        for s in stations:
+            for window_start, fetch_from, window_end in grid:
+                completed = done.get((s['station_id'], _naive_utc(window_start)))
+                if (completed is not None and completed[0] <= _naive_utc(fetch_from)
+                        and completed[1] >= _naive_utc(window_end)):
+                    continue
+                todo.append({**s, 'window_start': window_start, 'fetch_from': fetch_from, 'window_end': window_end})
+        logger.info(
+            f"{len(stations)} stations x {len(grid)} windows, "
+            f"{len(stations) * len(grid) - len(todo)} already done, {len(todo)} to fetch"
+        )
+        return todo
+
+    def fetch(self, window: Dict, now_utc: datetime) -> pa.RecordBatch:
+        """Download and decode one station window."""
+        started = time.perf_counter()
+        body = brightsky_client.get_weather_body(
+            wmo_station_id=window['wmo_station_id'],
+            date=window['fetch_from'].isoformat(),
+            last_date=window['window_end'].isoformat()
+        )
+        fetched = time.perf_counter()
+        batch = decode_weather(
+            body,
+            OBSERVATION_SCHEMA,
+            constants={
+                'station_id': window['station_id'],
+                'wmo_station_id': window['wmo_station_id'],
+                'ingested_at': now_utc,
+            },
+            after=window['fetch_from'],
+            until=min(window['window_end'], now_utc)
+        )
+        metrics.record_station(
+            OBSERVATIONS, window['station_id'],
+            fetch_s=fetched - started, convert_s=time.perf_counter() - fetched, rows=batch.num_rows
+        )
+        return batch
+
+    def load(self, conn, window: Dict, batch: pa.RecordBatch, now_utc: datetime):
+        """Write one window and its checkpoint in one transaction."""
+        conn.begin()
+        try:
+            if batch.num_rows:
+                self.ingestion.load(conn, pa.Table.from_batches([batch]), now_utc)
+            conn.execute("""
+                INSERT OR REPLACE INTO raw.backfill_windows
+                    (dataset, station_id, window_start, fetched_from, window_end, row_count, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [
+                OBSERVATIONS, window['station_id'],
+                _naive_utc(window['window_start']), _naive_utc(window['fetch_from']), _naive_utc(window['window_end']),
+                batch.num_rows, _naive_utc(now_utc),
+            ])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def run(self) -> Dict[str, int]:
+        """Fetch and load every missing window. Returns window and row counts."""
+        with db.session("backfill", self.db_path, checkpoint=True) as conn:
+            now_utc = datetime.now(timezone.utc)
+            todo = self.plan(conn)
+            summary = {"windows": len(todo), "completed": 0, "failed": 0, "rows": 0}
+
+            results = brightsky_client.fetch_concurrently(
+                lambda w: self.fetch(w, now_utc), todo, max_in_flight=settings.api_max_concurrency
+            )
+            for window, batch, error in results:
+                if error is not None:
+                    summary["failed"] += 1
+                    logger.warning(
+                        f"Failed {window['station_name']} {window['window_start']:%Y-%m-%d}: {error}"
+                    )
+                    continue
+                insert_started = time.perf_counter()
+                self.load(conn, window, batch, now_utc)
+                metrics.observe("insert_seconds", time.perf_counter() - insert_started, dataset=OBSERVATIONS)
+                metrics.inc("ingest_rows_total", batch.num_rows, dataset=OBSERVATIONS)
+                summary["completed"] += 1
+                summary["rows"] += batch.num_rows
+                if summary["completed"] % 100 == 0:
+                    logger.info(f"Backfill progress: {summary['completed']}/{len(todo)} windows, {summary['rows']} rows")
+
+            if summary["failed"]:
+                logger.warning(f"{summary['failed']} windows failed; rerun the backfill to retry them")
+            logger.info(f"✅ Backfill complete: {summary}")
+            return summary
+
+
+def _parse_date(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def main():
+    logging.basicConfig(level=settings.log_level)
+    parser = argparse.ArgumentParser(description="Resumable windowed backfill of historical observations")
+    parser.add_argument("--start", type=_parse_date, required=True, help="First day (YYYY-MM-DD, UTC)")
+    parser.add_argument("--end", type=_parse_date, help="End (default: now)")
+    parser.add_argument("--window-days", type=int, default=settings.backfill_window_days)
+    parser.add_argument("--regions", nargs="+", help="Regions to backfill (default: settings.regions)")
+    args = parser.parse_args()
+    summary = ObservationsBackfill(args.start, args.end, args.window_days, regions=args.regions).run()
+    raise SystemExit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,232 @@
 """
 Shared BrightSky API client.
+
+All requests go through one pooled keep-alive session and a token-bucket
+limiter driven by `settings.api_rate_limit`. `fetch_concurrently` fans out
+per-station calls over a bounded thread pool. Responses are served from the
+persistent cache in `ingestion.http_cache` when fresh, and revalidated with
+conditional requests when stale. `/weather` windows that reach the current
+hour, whose data is still being updated, are always revalidated.
 """
+import json
 import logging
+import threading
+import time
 import requests
-from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
 from common.config import settings
+from common.metrics import metrics
+from ingestion.http_cache import CacheMiss, DiskResponseCache, ResponseCache, cache_key
 
 logger = logging.getLogger(__name__)
 
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second on average."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_limiter: Optional[TokenBucket] = None
+_cache: Optional[ResponseCache] = None
+
+
+def _get_session() -> requests.Session:
+    """Return the process-wide session, creating its connection pool on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.api_max_concurrency,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def _get_limiter() -> TokenBucket:
+    """Return the process-wide rate limiter, created on first use."""
+    global _limiter
+    with _session_lock:
+        if _limiter is None:
+            _limiter = TokenBucket(settings.api_rate_limit)
+    return _limiter
+
+
+def get_cache() -> ResponseCache:
+    """Return the process-wide response cache, opening it on first use."""
+    global _cache
+    with _session_lock:
+        if _cache is None:
+            if settings.http_cache_enabled:
+                _cache = DiskResponseCache(
+                    settings.http_cache_path,
+                    ttls=settings.http_cache_ttls,
+                    max_bytes=settings.http_cache_max_bytes,
+                    offline=settings.http_cache_offline,
+                )
+            else:
+                _cache = ResponseCache()
+    return _cache
+
+
+def set_cache(cache: ResponseCache):
+    """Swap the response cache (e.g. an offline replay store in tests)."""
+    global _cache
+    with _session_lock:
+        _cache = cache
+
+
+def cache_stats() -> Dict[str, int]:
+    return get_cache().stats()
+
+
+def _retry_delay(resp: Optional[requests.Response], attempt: int) -> float:
+    """Honour Retry-After when present, otherwise back off exponentially."""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return settings.api_backoff_factor * (2 ** attempt)
+
+
 def _make_request(endpoint: str, params: Dict) -> Dict:
+    return json.loads(_request_body(endpoint, params))
+
+
+def _request_body(endpoint: str, params: Dict, revalidate: bool = False) -> bytes:
+    """
+    Raw response body of an endpoint call, from the cache or the API. With
+    `revalidate`, a cached response is only served after a 304 (offline mode aside).
+    """
+    cache = get_cache()
+    key = cache_key(endpoint, params)
+    cached = cache.lookup(key)
+
+    if cached is not None and (cache.offline or (not revalidate and cache.is_fresh(endpoint, cached))):
+        cache.count("hits")
+        return cached.body
+    if cache.offline:
+        cache.count("misses")
+        raise CacheMiss(f"No cached response for {key}")
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
     url = f"{settings.brightsky_api_url}{endpoint}"
-    resp = requests.get(url, params=params, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+    session = _get_session()
+    limiter = _get_limiter()
+
+    for attempt in range(settings.api_max_retries + 1):
+        limiter.acquire()
+        if attempt:
+            metrics.inc("http_retries_total", endpoint=endpoint)
+        resp = None
+        started = time.perf_counter()
+        try:
+            resp = session.get(url, params=params, headers=headers, timeout=settings.api_timeout_s)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.observe("http_request_seconds", time.perf_counter() - started, endpoint=endpoint, status="error")
+            if attempt == settings.api_max_retries:
+                raise
+            logger.debug(f"{endpoint} attempt {attempt + 1} failed: {e}")
+        else:
+            metrics.observe("http_request_seconds", time.perf_counter() - started, endpoint=endpoint, status=resp.status_code)
+            if resp.status_code == 304 and cached is not None:
+                cache.count("revalidated")
+                cache.touch(key)
+                return cached.body
+            if resp.status_code not in RETRY_STATUS_CODES or attempt == settings.api_max_retries:
+                resp.raise_for_status()
+                cache.count("misses")
+                cache.store(
+                    key, endpoint, resp.content,
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                )
+                return resp.content
+            logger.debug(f"{endpoint} attempt {attempt + 1} got HTTP {resp.status_code}")
+        time.sleep(_retry_delay(resp, attempt))
+
+
+_END = object()
+
+
+def fetch_concurrently(
+    fn: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = None,
+    max_in_flight: int = None
+) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    Run `fn(item)` for every item on a bounded thread pool.
+
+    Yields `(item, result, error)` as each call completes so the caller can
+    write results while the remaining requests are still in flight.
+    `max_in_flight` bounds the calls submitted but not yet consumed (and so
+    the results held in memory); by default every item is submitted up front.
+    """
+    items = iter(items)
+    limit = max_in_flight or float("inf")
+    with ThreadPoolExecutor(max_workers=max_workers or settings.api_max_concurrency) as pool:
+        pending = {}
+
+        def submit():
+            while len(pending) < limit:
+                item = next(items, _END)
+                if item is _END:
+                    return
+                pending[pool.submit(fn, item)] = item
+
+        submit()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                submit()
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+
 
 def get_sources(lat: float, lon: float, max_dist: int = 50000) -> List[Dict]:
     logger.info(f"Fetching sources near ({lat}, {lon})")
     data = _make_request('/sources', {
-        'lat': lat, 
-        'lon': lon, 
+        'lat': lat,
+        'lon': lon,
         'max_dist': max_dist
     })
     return data.get('sources', [])
@@ -30,6 +238,17 @@ def get_weather(
     date: str = None,
     last_date: str = None
 ) -> Dict:
+    return json.loads(get_weather_body(wmo_station_id, lat, lon, date, last_date))
+
+
+def get_weather_body(
+    wmo_station_id: str = None,
+    lat: float = None,
+    lon: float = None,
+    date: str = None,
+    last_date: str = None
+) -> bytes:
+    """Undecoded `/weather` response, for ingestion.arrow_writer.decode_weather."""
     params = {}
     if wmo_station_id:
         params['wmo_station_id'] = wmo_station_id
@@ -41,5 +260,18 @@ def get_weather(
 
     if date: params['date'] = date
     if last_date: params['last_date'] = last_date
-    
-    return _make_request('/weather', params)
\ No newline at end of file
+
+    return _request_body('/weather', params, revalidate=_reaches_current_hour(date, last_date))
+
+
+def _parse_utc(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _reaches_current_hour(date: Optional[str], last_date: Optional[str]) -> bool:
+    """Whether a /weather window (BrightSky default: one day from `date`) ends after the current hour starts."""
+    if not date:
+        return True
+    end = _parse_utc(last_date) if last_date else _parse_utc(date) + timedelta(days=1)
+    return end > datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
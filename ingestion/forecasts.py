@@ -1,115 +1,169 @@
 """
 Weather forecasts ingestion pipeline.
 
-Fetches forecasts for the next N days and overrides existing future records.
+Fetches forecasts for the next N days and stores them as vintages: a row is
+written only when its values differ from the latest vintage of the same target
+hour, and raw.weather_forecasts_latest tracks the current value per hour.
+
+Like observations, a run is `plan` / `fetch` / `load`, which the sharded spool
+path (ingestion/spool.py) also calls separately.
 """
 import logging
-import duckdb
-import pandas as pd
+import time
+import pyarrow as pa
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from common import db
 from common.config import settings
+from common.metrics import metrics
+from common.regions import active_regions
+from common.init_db import FORECAST_VALUE_COLUMNS
 from ingestion import brightsky_client
+from ingestion.arrow_writer import FORECAST_SCHEMA, ArrowBatchWriter, decode_weather
+from ingestion.watermarks import FORECASTS, update_watermark
 
 
 logger = logging.getLogger(__name__)
 
+CHANGED_PREDICATE = " OR ".join(f"b.{c} IS DISTINCT FROM l.{c}" for c in FORECAST_VALUE_COLUMNS)
+
 class ForecastsIngestion:
-    
-    def __init__(self, db_path: str = None):
+
+    dataset = FORECASTS
+    schema = FORECAST_SCHEMA
+    time_column = 'forecast_timestamp'
+
+    def __init__(self, db_path: str = None, regions: Optional[Iterable[str]] = None):
         self.db_path = db_path or settings.duckdb_path
-        logger.info(f"Initialized ForecastsIngestion | db: {self.db_path}")
+        self.regions = [region.name for region in active_regions(regions)]
+        logger.info(f"Initialized ForecastsIngestion | db: {self.db_path} | regions: {self.regions}")
+
+    def plan(self, conn, now_utc: datetime) -> List[Dict]:
+        """One fetch plan per forecast station of the active regions."""
+        stations = conn.execute("""
+            SELECT id AS station_id, wmo_station_id, station_name, lat, lon
+            FROM raw.weather_stations
+            WHERE observation_type = 'forecast'
+              AND id IN (SELECT station_id FROM raw.region_stations WHERE list_contains(?, region))
+        """, [self.regions]).fetchdf().to_dict('records')
+        logger.info(f"Found {len(stations)} forecast stations")
+        return stations
+
+    def fetch(self, s: Dict, now_utc: datetime) -> pa.RecordBatch:
+        """Download and decode one station's forecast for the horizon."""
+        # Hour-aligned window keeps request params (and cache keys) stable within the hour
+        start_date = now_utc.replace(minute=0, second=0, microsecond=0)
+        end_date = start_date + timedelta(days=settings.forecast_horizon_days)
+
+        started = time.perf_counter()
+        if s['wmo_station_id']:
+            body = brightsky_client.get_weather_body(
+                wmo_station_id=s['wmo_station_id'],
+                date=start_date.isoformat(),
+                last_date=end_date.isoformat()
+            )
+        else:
+            body = brightsky_client.get_weather_body(
+                lat=s['lat'],
+                lon=s['lon'],
+                date=start_date.isoformat(),
+                last_date=end_date.isoformat()
+            )
+        fetched = time.perf_counter()
+        batch = decode_weather(
+            body,
+            FORECAST_SCHEMA,
+            constants={
+                'station_id': s['station_id'],
+                'wmo_station_id': s['wmo_station_id'],
+                'ingested_at': now_utc,
+            },
+            time_column='forecast_timestamp',
+            after=now_utc
+        )
+        metrics.record_station(
+            FORECASTS, s['station_id'],
+            fetch_s=fetched - started, convert_s=time.perf_counter() - fetched, rows=batch.num_rows
+        )
+        return batch
+
+    def load(self, conn, table: pa.Table, run_at: datetime) -> int:
+        """
+        Write rows whose values differ from the latest vintage and advance
+        watermarks. Call inside a transaction. Returns the changed row count.
+        """
+        conn.register('arrow_batch', table)
+        try:
+            conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE forecast_changes AS
+                SELECT b.*, b.ingested_at AS issued_at
+                FROM arrow_batch b
+                LEFT JOIN raw.weather_forecasts_latest l
+                    ON b.station_id = l.station_id
+                    AND b.forecast_timestamp = l.forecast_timestamp
+                WHERE l.station_id IS NULL OR {CHANGED_PREDICATE}
+            """)
+            stations = conn.execute(
+                "SELECT station_id, max(forecast_timestamp) FROM arrow_batch GROUP BY station_id"
+            ).fetchall()
+        finally:
+            conn.unregister('arrow_batch')
+
+        conn.execute("INSERT INTO raw.weather_forecasts BY NAME SELECT * FROM forecast_changes")
+        conn.execute("INSERT OR REPLACE INTO raw.weather_forecasts_latest BY NAME SELECT * FROM forecast_changes")
+
+        changes = {station_id: (count, temperature_rows) for station_id, count, temperature_rows in conn.execute(
+            "SELECT station_id, count(*), count(temperature) FROM forecast_changes GROUP BY station_id"
+        ).fetchall()}
+        conn.execute("DROP TABLE forecast_changes")
+
+        for station_id, last_ts in stations:
+            count, temperature_rows = changes.get(station_id, (0, 0))
+            update_watermark(
+                conn, FORECASTS, station_id,
+                last_timestamp=last_ts,
+                row_count=count,
+                run_at=run_at,
+                temperature_rows=temperature_rows
+            )
+        return sum(count for count, _ in changes.values())
 
     def run(self):
         logger.info("Starting Forecast Ingestion...")
-        conn = duckdb.connect(self.db_path)
-        
-        try:
-            stations = conn.execute("""
-                SELECT id AS station_id, wmo_station_id, station_name, lat, lon
-                FROM raw.weather_stations 
-                WHERE observation_type = 'forecast'
-            """).fetchdf().to_dict('records')
-            
-            logger.info(f"Found {len(stations)} forecast stations")
-            total_records = 0
-            
+        with db.session(FORECASTS, self.db_path, checkpoint=True) as conn:
             now_utc = datetime.now(timezone.utc)
-            end_date = now_utc + timedelta(days=settings.forecast_horizon_days)
-            
-            for s in stations:
-                station_id = s['station_id']
-                wmo_id = s['wmo_station_id']
-                name = s['station_name']
-                
-                try:
-                    if wmo_id:
-                        data = brightsky_client.get_weather(
-                            wmo_station_id=wmo_id, 
-                            date=now_utc.isoformat(), 
-                            last_date=end_date.isoformat()
-                        )
-                    else:
-                        data = brightsky_client.get_weather(
-                            lat=s['lat'], 
-                            lon=s['lon'], 
-                            date=now_utc.isoformat(), 
-                            last_date=end_date.isoformat()
-                        )
-                    
-                    records = data.get('weather', [])
-                    if not records:
-                        continue
-
-                    df = pd.DataFrame(records)
-                    df['timestamp'] = pd.to_datetime(df['timestamp'])
-                    
-                    df = df[df['timestamp'] > now_utc]
-                    
-                    if df.empty:
-                        continue
-
-                    df['station_id'] = station_id
-                    df['wmo_station_id'] = wmo_id
-                    df['ingested_at'] = now_utc
-                    df = df.rename(columns={'timestamp': 'forecast_timestamp'})
-                    
-                    conn.execute("DELETE FROM raw.weather_forecasts WHERE station_id = ? AND forecast_timestamp > ?", [station_id, now_utc])
-
-                    conn.register('df_batch', df)
-                    conn.execute("""
-                        INSERT INTO raw.weather_forecasts (
-                            id, station_id, wmo_station_id, forecast_timestamp,
-                            source_id, cloud_cover, condition, dew_point, icon,
-                            precipitation, pressure_msl, relative_humidity, sunshine,
-                            temperature, visibility, wind_direction, wind_speed,
-                            wind_gust_direction, wind_gust_speed, ingested_at
-                        ) 
-                        SELECT 
-                            nextval('raw.weather_forecasts_id_seq'),
-                            station_id, wmo_station_id, forecast_timestamp,
-                            source_id, cloud_cover, condition, dew_point, icon,
-                            precipitation, pressure_msl, relative_humidity, sunshine,
-                            temperature, visibility, wind_direction, wind_speed,
-                            wind_gust_direction, wind_gust_speed, ingested_at 
-                        FROM df_batch
-                    """)
-                    conn.unregister('df_batch')
-                    
-                    count = len(df)
-                    total_records += count
-                    
-                except Exception as e:
-                    logger.warning(f"Failed {name}: {e}")
+            stations = self.plan(conn, now_utc)
+
+            writer = ArrowBatchWriter(FORECAST_SCHEMA, time_column='forecast_timestamp')
+            for s, batch, error in brightsky_client.fetch_concurrently(lambda s: self.fetch(s, now_utc), stations):
+                if error is not None:
+                    logger.warning(f"Failed {s['station_name']}: {error}")
                     continue
-            
+                writer.add(s['station_id'], batch)
+
+            # Write only rows whose values differ from the latest vintage
+            total_records = 0
+            if writer.num_rows:
+                insert_started = time.perf_counter()
+                conn.begin()
+                try:
+                    total_records = self.load(conn, writer.table(), now_utc)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                # One transaction for all stations, so inserts are timed per dataset
+                metrics.observe("insert_seconds", time.perf_counter() - insert_started, dataset=FORECASTS)
+                metrics.inc("ingest_rows_total", total_records, dataset=FORECASTS)
+                logger.info(f"Fetched {writer.num_rows} forecast rows, {total_records} changed since the latest vintage")
+
             logger.info(f"✅ Ingestion Complete. Total new forecasts: {total_records}")
+            logger.info(f"HTTP cache: {brightsky_client.cache_stats()}")
             return total_records
-            
-        finally:
-            conn.close()
+
 
 def main():
     ForecastsIngestion().run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,156 @@
+"""
+Persistent response cache for the BrightSky client.
+
+Responses are stored on disk (SQLite) keyed on endpoint + params, served
+without a request while their per-endpoint TTL holds, and revalidated with
+ETag / Last-Modified once stale. The store is size-bounded with LRU eviction.
+With `offline=True` the cache acts as a replay store and never hits the network.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a request has no cached response."""
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+    def json(self) -> Dict:
+        return json.loads(self.body)
+
+
+def cache_key(endpoint: str, params: Dict) -> str:
+    """Stable key for an endpoint call, independent of param order."""
+    return endpoint + "?" + "&".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+class ResponseCache:
+    """No-op cache. Subclasses provide storage; counters are shared."""
+
+    offline = False
+
+    def __init__(self, ttls: Dict[str, int] = None):
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self._counter_lock = threading.Lock()
+
+    def count(self, counter: str):
+        """Increment a hit/miss counter from any thread."""
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def ttl_for(self, endpoint: str) -> int:
+        return self.ttls.get(endpoint, 0)
+
+    def is_fresh(self, endpoint: str, cached: CachedResponse) -> bool:
+        return time.time() - cached.stored_at < self.ttl_for(endpoint)
+
+    def lookup(self, key: str) -> Optional[CachedResponse]:
+        return None
+
+    def store(self, key: str, endpoint: str, body: bytes, etag: str = None, last_modified: str = None):
+        pass
+
+    def touch(self, key: str):
+        """Mark a cached entry as revalidated (304) and restart its TTL."""
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "evictions": self.evictions,
+        }
+
+
+class DiskResponseCache(ResponseCache):
+    """SQLite-backed cache with LRU eviction beyond `max_bytes`."""
+
+    def __init__(self, path: str, ttls: Dict[str, int] = None, max_bytes: int = 256 * 1024 * 1024, offline: bool = False):
+        super().__init__(ttls)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Spool fetch workers share the file across processes; wait out their writes
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def lookup(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(*row)
+
+    def store(self, key: str, endpoint: str, body: bytes, etag: str = None, last_modified: str = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO responses (key, endpoint, body, etag, last_modified, stored_at, last_access, size)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, endpoint, body, etag, last_modified, now, now, len(body))
+            )
+            self._evict()
+
+    def touch(self, key: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.count("evictions")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
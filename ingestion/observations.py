@@ -1,117 +1,168 @@
 """
 Weather observations ingestion pipeline.
+
+A run is three steps, also used separately by the sharded spool path
+(ingestion/spool.py): `plan` reads stations and watermarks, `fetch` downloads
+and decodes one station, and `load` writes a batch of decoded rows.
 """
 import logging
-import duckdb
-import pandas as pd
+import time
+import pyarrow as pa
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
 
+from common import db
 from common.config import settings
+from common.metrics import metrics
+from common.regions import active_regions
 from ingestion import brightsky_client
+from ingestion.arrow_writer import OBSERVATION_SCHEMA, ArrowBatchWriter, decode_weather
+from ingestion.watermarks import OBSERVATIONS, load_watermarks, update_watermark
 
 
 logger = logging.getLogger(__name__)
 
+
+def _window_end(now_utc: datetime) -> datetime:
+    # Hour-aligned upper bound keeps request params (and cache keys) stable within the hour
+    return now_utc.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
 class ObservationsIngestion:
-    
-    def __init__(self, db_path: str = None):
+
+    dataset = OBSERVATIONS
+    schema = OBSERVATION_SCHEMA
+    time_column = 'timestamp'
+
+    def __init__(self, db_path: str = None, regions: Optional[Iterable[str]] = None):
         self.db_path = db_path or settings.duckdb_path
-        logger.info(f"Initialized ObservationsIngestion | db: {self.db_path}")
+        self.regions = [region.name for region in active_regions(regions)]
+        logger.info(f"Initialized ObservationsIngestion | db: {self.db_path} | regions: {self.regions}")
+
+    def plan(self, conn, now_utc: datetime) -> List[Dict]:
+        """One fetch plan per station, resuming from its watermark."""
+        # One fetch per WMO station under its canonical station id
+        # (raw.canonical_stations, shared with compaction, the spool and the
+        # backfill). WMO stations listed by any active region are fetched.
+        stations = conn.execute("""
+            SELECT c.station_id, arg_min(s.station_name, s.id) AS station_name, s.wmo_station_id
+            FROM raw.weather_stations s
+            JOIN raw.canonical_stations c ON s.wmo_station_id = c.wmo_station_id
+            WHERE s.last_record >= ?
+            GROUP BY c.station_id, s.wmo_station_id
+            HAVING bool_or(s.id IN (SELECT station_id FROM raw.region_stations WHERE list_contains(?, region)))
+        """, [settings.station_active_since, self.regions]).fetchdf().to_dict('records')
+
+        # Determine constraints from the watermark table (one query for all stations)
+        watermarks = load_watermarks(conn, OBSERVATIONS)
+        plans = []
+        for s in stations:
+            last_ts = watermarks.get(s['station_id'])
+
+            if last_ts:
+                start_date = last_ts
+                mode = "Incremental"
+            else:
+                start_date = _window_end(now_utc) - timedelta(days=settings.observation_lookback_days)
+                mode = "Backfill"
+            plans.append({**s, 'last_ts': last_ts, 'start_date': start_date, 'mode': mode})
+        return plans
+
+    def fetch(self, plan: Dict, now_utc: datetime) -> pa.RecordBatch:
+        """Download and decode one station's new observations."""
+        started = time.perf_counter()
+        body = brightsky_client.get_weather_body(
+            wmo_station_id=plan['wmo_station_id'],
+            date=plan['start_date'].isoformat(),
+            last_date=_window_end(now_utc).isoformat()
+        )
+        fetched = time.perf_counter()
+        batch = decode_weather(
+            body,
+            OBSERVATION_SCHEMA,
+            constants={
+                'station_id': plan['station_id'],
+                'wmo_station_id': plan['wmo_station_id'],
+                'ingested_at': now_utc,
+            },
+            after=plan['last_ts'],
+            until=now_utc
+        )
+        metrics.record_station(
+            OBSERVATIONS, plan['station_id'],
+            fetch_s=fetched - started, convert_s=time.perf_counter() - fetched, rows=batch.num_rows
+        )
+        return batch
+
+    def load(self, conn, table: pa.Table, run_at: datetime) -> int:
+        """Upsert decoded rows and advance watermarks. Call inside a transaction."""
+        conn.register('arrow_batch', table)
+        try:
+            # Upsert on (station_id, timestamp): overlapping or retried fetches overwrite
+            conn.execute("""
+                INSERT OR REPLACE INTO raw.weather_observations BY NAME
+                SELECT * FROM arrow_batch
+                QUALIFY row_number() OVER (PARTITION BY station_id, timestamp) = 1
+            """)
+            stations = conn.execute(
+                "SELECT station_id, count(*), max(timestamp), count(temperature) FROM arrow_batch GROUP BY station_id"
+            ).fetchall()
+        finally:
+            conn.unregister('arrow_batch')
+        for station_id, count, last_ts, temperature_rows in stations:
+            update_watermark(
+                conn, OBSERVATIONS, station_id,
+                last_timestamp=last_ts,
+                row_count=count,
+                run_at=run_at,
+                temperature_rows=temperature_rows
+            )
+        return table.num_rows
 
     def run(self):
         logger.info("Starting Observations Ingestion...")
-        conn = duckdb.connect(self.db_path)
-        
-        try:
+        with db.session(OBSERVATIONS, self.db_path, checkpoint=True) as conn:
+            now_utc = datetime.now(timezone.utc)
+            # 1. Plan every station from the watermark table
             try:
-                stations_df = conn.execute("""
-                    SELECT id AS station_id, station_name, wmo_station_id 
-                    FROM raw.weather_stations 
-                    WHERE wmo_station_id IS NOT NULL AND last_record >= '2025-09-01'
-                """).fetchdf()
+                plans = self.plan(conn, now_utc)
             except Exception as e:
                 logger.error(f"Failed to query stations: {e}")
                 return
 
-            stations = stations_df.to_dict('records')
-            total_records = 0
-
-            for s in stations:
-                station_name = s['station_name']
-                wmo_id = s['wmo_station_id']
-                station_id = s['station_id']
-
-                # 1. Determine constraints
-                last_ts = self._get_last_timestamp(conn, station_id)
-                # DuckDB returns naive datetime for TIMESTAMP, so we enforce UTC
-                if last_ts and last_ts.tzinfo is None:
-                    last_ts = last_ts.replace(tzinfo=timezone.utc)
-                
-                now_utc = datetime.now(timezone.utc)
-                
-                if last_ts:
-                    start_date = last_ts
-                    mode = "Incremental"
-                else:
-                    start_date = now_utc - timedelta(days=settings.observation_lookback_days)
-                    mode = "Backfill"
+            # 2. Fetch and decode concurrently, accumulating Arrow batches
+            writer = ArrowBatchWriter(OBSERVATION_SCHEMA, time_column='timestamp')
+            for plan, batch, error in brightsky_client.fetch_concurrently(lambda p: self.fetch(p, now_utc), plans):
+                station_name = plan['station_name']
+                if error is not None:
+                    logger.warning(f"Failed {station_name}: {error}")
+                    continue
+                count = writer.add(plan['station_id'], batch)
+                if count:
+                    logger.info(f"[{station_name}] {plan['mode']}: +{count} records")
 
+            # 3. Append everything and advance watermarks in one transaction
+            total_records = writer.num_rows
+            if total_records:
+                insert_started = time.perf_counter()
+                conn.begin()
                 try:
-                    data = brightsky_client.get_weather(
-                        wmo_station_id=wmo_id,
-                        date=start_date.isoformat(),
-                        last_date=now_utc.isoformat()
-                    )
-                    
-                    weather_list = data.get('weather', [])
-                    if not weather_list:
-                        continue
-
-                    df_obs = pd.DataFrame(weather_list)
-                    
-                    df_obs['timestamp'] = pd.to_datetime(df_obs['timestamp'])
-                    
-                    if last_ts:
-                        df_obs = df_obs[df_obs['timestamp'] > last_ts]
-                    
-                    df_obs = df_obs[df_obs['timestamp'] <= now_utc]
-
-                    if df_obs.empty:
-                        continue
-                    df_obs['station_id'] = station_id 
-                    df_obs['wmo_station_id'] = wmo_id 
-                    if 'fallback_source_ids' in df_obs.columns:
-                         df_obs['fallback_source_ids'] = df_obs['fallback_source_ids'].astype(str)
-                    conn.register('df_batch', df_obs)
-                    conn.execute("INSERT INTO raw.weather_observations BY NAME SELECT * FROM df_batch")
-                    conn.unregister('df_batch')
-                    
-                    count = len(df_obs)
-                    total_records += count
-                    logger.info(f"[{station_name}] {mode}: +{count} records")
-                    
-                except Exception as e:
-                    logger.warning(f"Failed {station_name}: {e}")
-                    continue
-            
+                    self.load(conn, writer.table(), now_utc)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                # One transaction for all stations, so inserts are timed per dataset
+                metrics.observe("insert_seconds", time.perf_counter() - insert_started, dataset=OBSERVATIONS)
+                metrics.inc("ingest_rows_total", total_records, dataset=OBSERVATIONS)
+
             logger.info(f"✅ Ingestion Complete. Total new: {total_records}")
+            logger.info(f"HTTP cache: {brightsky_client.cache_stats()}")
             return total_records
 
-        finally:
-            conn.close()
-
-    def _get_last_timestamp(self, conn, station_id):
-        try:
-            res = conn.execute(
-                "SELECT MAX(timestamp) FROM raw.weather_observations WHERE station_id = ?", 
-                [station_id]
-            ).fetchone()
-            return res[0] if res else None
-        except Exception:
-            return None
 
 def main():
     ObservationsIngestion().run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,77 +1,195 @@
 """
 Postal code ingestion pipeline.
 
-Downloads German postal codes, filters for Berlin, and loads into DuckDB.
+Downloads German postal codes, filters them by the prefixes of each active
+region (see common/regions.py), and loads them into DuckDB.
+
+The release archive is streamed to a local cache keyed by release tag and
+verified by checksum, then decompressed and parsed incrementally so only one
+feature is held in memory at a time. Regions are loaded one at a time, each in
+its own transaction, so memory is bounded by the largest region; a region is
+skipped entirely when its release and prefixes are already loaded.
 """
+import hashlib
 import logging
-import json
-import duckdb
+import os
 import brotli
+import ijson
 import requests
-import geopandas as gpd
-from shapely.geometry import shape
+from pathlib import Path
+from typing import Iterable, Optional
 
+from common import db
 from common.config import settings
+from common.fingerprints import compute_fingerprint, get_fingerprint, set_fingerprint
+from common.regions import Region, active_regions
 
 logger = logging.getLogger(__name__)
 
-GEOJSON_URL = "https://github.com/yetzt/postleitzahlen/releases/download/2025.12/postleitzahlen.geojson.br"
-BERLIN_PREFIXES = settings.berlin_postal_prefixes
+STAGE = "postal_codes"
+CHUNK_SIZE = 1024 * 1024
+
+
+class BrotliStream:
+    """Read-only file-like object that decompresses a brotli file chunk by chunk."""
+
+    def __init__(self, fileobj, chunk_size: int = 64 * 1024):
+        self._src = fileobj
+        self._chunk_size = chunk_size
+        self._decompressor = brotli.Decompressor()
+        self._buffer = b""
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        """Decompress the next input chunk into the buffer; False at end of input."""
+        while self._pos >= len(self._buffer):
+            chunk = self._src.read(self._chunk_size)
+            if not chunk:
+                return False
+            self._buffer = self._decompressor.process(chunk)
+            self._pos = 0
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            parts = []
+            while self._fill():
+                parts.append(self._buffer[self._pos:])
+                self._pos = len(self._buffer)
+            return b"".join(parts)
+        if not self._fill():
+            return b""
+        out = self._buffer[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fetch_archive(url: str = None, release: str = None) -> Path:
+    """
+    Return the local path of the release archive, downloading it if needed.
+
+    Archives live in `postal_codes_cache_dir` as `<release>-<file>` with a
+    `.sha256` sidecar; a cached file whose checksum no longer matches is
+    downloaded again. `url` defaults to `postal_codes_url` for the release.
+    """
+    release = release or settings.postal_codes_release
+    url = url or settings.postal_codes_url.format(release=release)
+    cache_dir = Path(settings.postal_codes_cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    archive = cache_dir / f"{release}-{url.rsplit('/', 1)[-1]}"
+    checksum_file = archive.with_name(archive.name + ".sha256")
+
+    if archive.exists() and checksum_file.exists():
+        if _sha256(archive) == checksum_file.read_text().strip():
+            logger.info(f"Using cached archive {archive}")
+            return archive
+        logger.warning(f"Checksum mismatch for {archive}, downloading again")
+
+    logger.info(f"Downloading from {url}")
+    tmp = archive.with_name(archive.name + ".part")
+    digest = hashlib.sha256()
+    with requests.get(url, stream=True, timeout=settings.api_timeout_s) as resp:
+        resp.raise_for_status()
+        with open(tmp, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+    os.replace(tmp, archive)
+    checksum_file.write_text(digest.hexdigest())
+    return archive
+
+
+def iter_features(archive: Path, prefixes: tuple):
+    """Yield {plz, name, geometry} for features whose postcode matches `prefixes`."""
+    from shapely.geometry import shape
+    with open(archive, "rb") as f:
+        for feature in ijson.items(BrotliStream(f), "features.item", use_float=True):
+            plz = (feature.get('properties') or {}).get('postcode', '')
+            if plz.startswith(prefixes) and feature.get('geometry'):
+                yield {
+                    'plz': plz,
+                    'name': plz,
+                    'geometry': shape(feature['geometry'])
+                }
+
+
+def load_region(conn, archive: Path, region: Region, fingerprint: str) -> int:
+    """Replace the postal codes of `region` with those in `archive`. Returns the count loaded."""
+    # Filter for the region while parsing
+    features = list(iter_features(archive, region.postal_prefixes))
 
-def main():
-    logger.info("Starting Postal Code Ingestion...")
-    
-    logger.info(f"Downloading from {GEOJSON_URL}")
-    resp = requests.get(GEOJSON_URL, stream=True)
-    resp.raise_for_status()
-    
-    # Decompress on the fly
-    decompressed = brotli.decompress(resp.content)
-    data = json.loads(decompressed)
-    del decompressed # Free memory immediately
-
-    # Filter for Berlin
-    features = []
-    for f in data.get('features', []):
-        plz = f.get('properties', {}).get('postcode', '')
-        if plz.startswith(BERLIN_PREFIXES) and f.get('geometry'):
-            features.append({
-                'plz': plz,
-                'name': plz,
-                'geometry': shape(f['geometry'])
-            })
-    
     if not features:
-        logger.warning("No Berlin postal codes found.")
-        return
+        logger.warning(f"[{region.name}] No postal codes found for prefixes {region.postal_prefixes}.")
+        return 0
 
+    import geopandas as gpd  # only needed when a region is re-parsed
     gdf = gpd.GeoDataFrame(features, crs='EPSG:4326')
-    
+
     # Simple geometry fix (buffer 0 to fix self-intersections)
     gdf['geometry'] = gdf.geometry.buffer(0)
-    
+
     # Prepare for DuckDB (WKT)
     gdf['geometry_wkt'] = gdf.geometry.apply(lambda g: g.wkt)
-    
-    logger.info(f"Filtered to {len(gdf)} Berlin postal codes")
 
-    logger.info("Loading into DuckDB...")
-    conn = duckdb.connect(settings.duckdb_path)
+    logger.info(f"[{region.name}] Filtered to {len(gdf)} postal codes")
+
+    conn.begin()
     try:
-        conn.execute("INSTALL spatial; LOAD spatial;")
-        
-        conn.execute("DELETE FROM raw.postal_codes")
-        
         conn.register('df_source', gdf[['plz', 'name', 'geometry_wkt']])
+        # Also takes over codes another (no longer active) region loaded
+        conn.execute("""
+            DELETE FROM raw.postal_codes
+            WHERE region = ? OR plz IN (SELECT plz FROM df_source)
+        """, [region.name])
         conn.execute("""
-            INSERT INTO raw.postal_codes (plz, name, geometry)
-            SELECT plz, name, ST_GeomFromText(geometry_wkt) FROM df_source
-        """)
-        
-        logger.info(f"✅ Loaded {len(gdf)} postal codes.")
-        
-    finally:
-        conn.close()
+            INSERT INTO raw.postal_codes (plz, name, geometry, region)
+            SELECT plz, name, ST_GeomFromText(geometry_wkt), ? FROM df_source
+        """, [region.name])
+        conn.unregister('df_source')
+        set_fingerprint(conn, region.stage(STAGE), fingerprint, len(gdf))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(gdf)
+
+
+def main(force: bool = False, regions: Optional[Iterable[str]] = None):
+    logger.info("Starting Postal Code Ingestion...")
+
+    release = settings.postal_codes_release
+    regions = active_regions(regions)
+
+    with db.session(STAGE, checkpoint=True) as conn:
+        fingerprints = {
+            region.name: compute_fingerprint(release, ",".join(region.postal_prefixes))
+            for region in regions
+        }
+        stale = [
+            region for region in regions
+            if force or get_fingerprint(conn, region.stage(STAGE)) != fingerprints[region.name]
+        ]
+        if not stale:
+            logger.info(f"Postal codes for release {release} already loaded, skipping.")
+            return
+
+        archive = fetch_archive(release=release)
+
+        logger.info("Loading into DuckDB...")
+
+        # One parsing pass per region keeps only that region's shapes in memory
+        for region in stale:
+            loaded = load_region(conn, archive, region, fingerprints[region.name])
+            logger.info(f"✅ [{region.name}] Loaded {loaded} postal codes (release {release}).")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,368 @@
+"""
+Sharded ingestion through a Parquet spool.
+
+DuckDB takes one writer at a time, so ingestion is split into two roles:
+
+- Fetch workers (separate processes) each take the stations whose id hashes
+  to their shard, download and decode them, and publish decoded rows as
+  Parquet files in `settings.spool_dir/<dataset>/`. They never open DuckDB and
+  stop writing while too much data is waiting to be loaded (backpressure).
+- Each worker writes its metrics registry next to its done marker; the
+  parent merges them into its run report.
+- One loader drains the spool into DuckDB in bulk. Each file is a batch that
+  is loaded in one transaction together with its `raw.spool_loads` entry, so a
+  file that is still on disk after a crash is never loaded twice.
+
+A run starts by writing a plan per dataset (stations + watermarks), which the
+workers read instead of the database.
+
+Usage:
+    python -m ingestion.spool run --workers 4          # plan, fetch, load
+    python -m ingestion.spool fetch observations <run_id> --shard 0 --shards 4
+    python -m ingestion.spool load                      # drain leftovers
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import db
+from common.config import settings
+from common.metrics import metrics
+from ingestion import brightsky_client
+from ingestion.forecasts import ForecastsIngestion
+from ingestion.observations import ObservationsIngestion
+from ingestion.watermarks import FORECASTS, OBSERVATIONS
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+INGESTIONS = {
+    OBSERVATIONS: ObservationsIngestion,
+    FORECASTS: ForecastsIngestion,
+}
+
+
+def shard_of(station_id: str, shards: int) -> int:
+    """Stable station -> shard assignment (unlike hash(), same in every process)."""
+    return zlib.crc32(str(station_id).encode()) % shards
+
+
+def _dataset_dir(dataset: str) -> Path:
+    path = Path(settings.spool_dir) / dataset
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _plan_path(dataset: str, run_id: str) -> Path:
+    return _dataset_dir(dataset) / f"{run_id}.plan.parquet"
+
+
+def _done_path(dataset: str, run_id: str, shard: int) -> Path:
+    return _dataset_dir(dataset) / f"{run_id}-s{shard}.done"
+
+
+def _metrics_path(dataset: str, run_id: str, shard: int) -> Path:
+    return _dataset_dir(dataset) / f"{run_id}-s{shard}.metrics.json"
+
+
+def _batch_files(dataset: str) -> List[Path]:
+    # Names start with the run id, so sorting loads runs in the order they were planned
+    return sorted(_dataset_dir(dataset).glob("*.batch.parquet"))
+
+
+def pending_bytes(dataset: str) -> int:
+    total = 0
+    for path in _batch_files(dataset):
+        try:
+            total += path.stat().st_size
+        except FileNotFoundError:
+            pass  # loaded in the meantime
+    return total
+
+
+def write_plan(conn, dataset: str, now_utc: datetime = None, regions: Optional[Iterable[str]] = None) -> str:
+    """Snapshot the stations and watermarks of a run for the workers. Returns the run id."""
+    now_utc = now_utc or datetime.now(timezone.utc)
+    run_id = f"{now_utc:%Y%m%dT%H%M%S%f}"
+    plans = INGESTIONS[dataset](regions=regions).plan(conn, now_utc)
+    table = pa.Table.from_pylist(plans) if plans else pa.table({"station_id": pa.array([], pa.string())})
+    table = table.replace_schema_metadata({"run_at": now_utc.isoformat()})
+    path = _plan_path(dataset, run_id)
+    pq.write_table(table, path.with_suffix(".tmp"))
+    os.replace(path.with_suffix(".tmp"), path)
+    logger.info(f"Planned {dataset} run {run_id}: {len(plans)} stations")
+    return run_id
+
+
+def _read_plan(dataset: str, run_id: str) -> Tuple[List[Dict], datetime]:
+    table = pq.read_table(_plan_path(dataset, run_id))
+    run_at = datetime.fromisoformat(table.schema.metadata[b"run_at"].decode())
+    return table.to_pylist(), run_at
+
+
+class SpoolWriter:
+    """Buffers decoded batches of one shard and publishes them as spool files."""
+
+    def __init__(self, dataset: str, run_id: str, shard: int, schema: pa.Schema, run_at: datetime):
+        self.dataset = dataset
+        self.run_id = run_id
+        self.shard = shard
+        self.schema = schema
+        self.run_at = run_at
+        self.batches: List[pa.RecordBatch] = []
+        self.buffered_rows = 0
+        self.files = 0
+        self.rows = 0
+
+    def add(self, batch: pa.RecordBatch):
+        if batch.num_rows == 0:
+            return
+        self.batches.append(batch)
+        self.buffered_rows += batch.num_rows
+        if self.buffered_rows >= settings.spool_batch_rows:
+            self.flush()
+
+    def _wait_for_room(self):
+        limit = settings.spool_max_pending_mb * 1024 * 1024
+        deadline = time.monotonic() + settings.spool_backpressure_timeout_s
+        while pending_bytes(self.dataset) > limit:
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"{self.dataset} spool above {settings.spool_max_pending_mb} MB for "
+                    f"{settings.spool_backpressure_timeout_s}s; is the loader running?"
+                )
+            metrics.inc("spool_backpressure_waits_total", dataset=self.dataset)
+            time.sleep(0.5)
+
+    def flush(self):
+        if not self.batches:
+            return
+        self._wait_for_room()
+        table = pa.Table.from_batches(self.batches, schema=self.schema)
+        table = table.replace_schema_metadata({"run_at": self.run_at.isoformat()})
+        name = f"{self.run_id}-s{self.shard}-{self.files:05d}-{uuid.uuid4().hex[:8]}"
+        path = _dataset_dir(self.dataset) / f"{name}.batch.parquet"
+        tmp = path.with_name(f"{name}.tmp")
+        # Uncompressed: the files are short-lived and the loader reads them right away
+        pq.write_table(table, tmp, compression="none")
+        os.replace(tmp, path)
+        self.files += 1
+        self.rows += table.num_rows
+        self.batches, self.buffered_rows = [], 0
+
+
+def fetch_shard(dataset: str, run_id: str, shard: int, shards: int) -> int:
+    """Fetch one shard of a planned run into the spool. Returns rows spooled."""
+    plans, run_at = _read_plan(dataset, run_id)
+    plans = [p for p in plans if shard_of(p["station_id"], shards) == shard]
+    ingestion = INGESTIONS[dataset]()
+    writer = SpoolWriter(dataset, run_id, shard, ingestion.schema, run_at)
+
+    try:
+        with metrics.stage(f"fetch_{dataset}_s{shard}"):
+            for plan, batch, error in brightsky_client.fetch_concurrently(lambda p: ingestion.fetch(p, run_at), plans):
+                if error is not None:
+                    logger.warning(f"Failed {plan['station_name']}: {error}")
+                    continue
+                writer.add(batch)
+            writer.flush()
+    finally:
+        # Before the done marker, so the parent finds it once the shard is done
+        metrics.write_fragment(_metrics_path(dataset, run_id, shard))
+
+    _done_path(dataset, run_id, shard).touch()
+    logger.info(f"✅ {dataset} shard {shard}/{shards}: {len(plans)} stations, {writer.rows} rows in {writer.files} files")
+    return writer.rows
+
+
+class SpoolLoader:
+    """Single writer draining spool files into DuckDB."""
+
+    def __init__(self, datasets: Iterable[str] = tuple(INGESTIONS), db_path: str = None):
+        self.datasets = tuple(datasets)
+        self.db_path = db_path or settings.duckdb_path
+        self.loaded: Dict[str, int] = {dataset: 0 for dataset in self.datasets}
+        self.ingestions = {dataset: INGESTIONS[dataset](self.db_path) for dataset in self.datasets}
+
+    def _load_files(self, conn, dataset: str, files: List[Path]):
+        batch_ids = [f.name.split(".")[0] for f in files]
+        placeholders = ", ".join("?" for _ in batch_ids)
+        done = {row[0] for row in conn.execute(
+            f"SELECT batch_id FROM raw.spool_loads WHERE batch_id IN ({placeholders})", batch_ids
+        ).fetchall()}
+
+        # One transaction per run, so forecast vintages are compared in run order
+        by_run: Dict[str, List[Tuple[str, Path]]] = {}
+        for batch_id, path in zip(batch_ids, files):
+            if batch_id not in done:
+                by_run.setdefault(batch_id.split("-")[0], []).append((batch_id, path))
+
+        for run_id, batches in by_run.items():
+            tables = [pq.read_table(path) for _, path in batches]
+            run_at = datetime.fromisoformat(tables[0].schema.metadata[b"run_at"].decode())
+            table = pa.concat_tables([t.replace_schema_metadata(None) for t in tables])
+
+            started = time.perf_counter()
+            conn.begin()
+            try:
+                written = self.ingestions[dataset].load(conn, table, run_at)
+                conn.executemany(
+                    "INSERT INTO raw.spool_loads (batch_id, dataset, row_count, loaded_at) VALUES (?, ?, ?, ?)",
+                    [[batch_id, dataset, t.num_rows, datetime.now(timezone.utc).replace(tzinfo=None)]
+                     for (batch_id, _), t in zip(batches, tables)],
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            metrics.observe("insert_seconds", time.perf_counter() - started, dataset=dataset)
+            metrics.inc("ingest_rows_total", written, dataset=dataset)
+            self.loaded[dataset] += written
+            logger.info(f"[{dataset}] loaded {len(batches)} spool files ({table.num_rows} rows, {written} written)")
+
+        # Only after the commit: a file left behind by a crash here is skipped next time
+        for path in files:
+            path.unlink(missing_ok=True)
+
+    def drain_once(self, conn) -> int:
+        """Load whatever is spooled right now. Returns the number of files handled."""
+        handled = 0
+        for dataset in self.datasets:
+            files = _batch_files(dataset)[:settings.spool_load_max_files]
+            if files:
+                self._load_files(conn, dataset, files)
+                handled += len(files)
+        return handled
+
+    def run(self, wait_for: Optional[Dict[str, Tuple[str, int]]] = None, workers: List[subprocess.Popen] = ()) -> Dict[str, int]:
+        """
+        Drain the spool. With `wait_for` ({dataset: (run_id, shards)}), keep
+        draining until every shard has finished and its files are loaded.
+        """
+        with db.session("spool_load", self.db_path, checkpoint=True) as conn:
+            while True:
+                if self.drain_once(conn):
+                    continue
+                if not wait_for:
+                    break
+                finished = all(
+                    _done_path(dataset, run_id, shard).exists()
+                    for dataset, (run_id, shards) in wait_for.items()
+                    for shard in range(shards)
+                )
+                if finished:
+                    # Files published just before the last done marker
+                    if not self.drain_once(conn):
+                        break
+                    continue
+                failed = [w for w in workers if w.poll() not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f"{len(failed)} fetch worker(s) failed: {[w.args for w in failed]}")
+                time.sleep(settings.spool_poll_s)
+
+            conn.execute(
+                "DELETE FROM raw.spool_loads WHERE loaded_at < now()::TIMESTAMP - INTERVAL 7 DAY"
+            )
+
+        for dataset, (run_id, shards) in (wait_for or {}).items():
+            _plan_path(dataset, run_id).unlink(missing_ok=True)
+            for shard in range(shards):
+                _done_path(dataset, run_id, shard).unlink(missing_ok=True)
+        return self.loaded
+
+
+def _worker_env(processes: int) -> Dict[str, str]:
+    env = {**os.environ}
+    # The rate limit is per process; split it across the workers
+    if settings.api_rate_limit > 0:
+        env["API_RATE_LIMIT"] = str(max(1, settings.api_rate_limit // processes))
+    return env
+
+
+def run_sharded(
+    datasets: Iterable[str] = tuple(INGESTIONS), workers: int = None, db_path: str = None,
+    regions: Optional[Iterable[str]] = None,
+) -> Dict[str, int]:
+    """
+    Plan the stations of `regions` (default: all active), fetch with `workers`
+    processes per dataset, and load. Returns rows written per dataset.
+    """
+    datasets = tuple(datasets)
+    workers = workers or settings.ingest_workers
+    db_path = db_path or settings.duckdb_path
+
+    with db.session("spool_plan", db_path) as conn:
+        now_utc = datetime.now(timezone.utc)
+        run_ids = {dataset: write_plan(conn, dataset, now_utc, regions) for dataset in datasets}
+
+    env = _worker_env(workers * len(datasets))
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "ingestion.spool", "fetch", dataset, run_ids[dataset],
+             "--shard", str(shard), "--shards", str(workers)],
+            cwd=PROJECT_ROOT,
+            env=env,
+        )
+        for dataset in datasets
+        for shard in range(workers)
+    ]
+    try:
+        loaded = SpoolLoader(datasets, db_path).run(
+            wait_for={dataset: (run_ids[dataset], workers) for dataset in datasets}, workers=procs,
+        )
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+        # Worker HTTP, fetch and RSS figures, also for failed runs
+        metrics.merge_fragments(
+            _metrics_path(dataset, run_ids[dataset], shard) for dataset in datasets for shard in range(workers)
+        )
+
+    logger.info(f"✅ Sharded ingestion complete with {workers} worker(s) per dataset: {loaded}")
+    return loaded
+
+
+def main():
+    logging.basicConfig(level=settings.log_level)
+    parser = argparse.ArgumentParser(description="Sharded spool ingestion")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Plan, fetch with worker processes, and load")
+    run.add_argument("--workers", type=int, default=settings.ingest_workers, help="Worker processes per dataset")
+    run.add_argument("--datasets", nargs="+", choices=sorted(INGESTIONS), default=list(INGESTIONS))
+    run.add_argument("--regions", nargs="+", help="Regions to ingest (default: settings.regions)")
+
+    fetch = sub.add_parser("fetch", help="Fetch one shard of a planned run into the spool")
+    fetch.add_argument("dataset", choices=sorted(INGESTIONS))
+    fetch.add_argument("run_id")
+    fetch.add_argument("--shard", type=int, required=True)
+    fetch.add_argument("--shards", type=int, required=True)
+
+    load = sub.add_parser("load", help="Load spooled files into DuckDB")
+    load.add_argument("--datasets", nargs="+", choices=sorted(INGESTIONS), default=list(INGESTIONS))
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_sharded(args.datasets, args.workers, regions=args.regions)
+    elif args.command == "fetch":
+        fetch_shard(args.dataset, args.run_id, args.shard, args.shards)
+    else:
+        print(SpoolLoader(args.datasets).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,115 @@
 """
 Weather station discovery and loading (Simplified).
 
-Fetches all stations in the configured radius and loads them into DuckDB.
+Fetches all stations in the discovery circle of each active region (see
+common/regions.py) and loads them into DuckDB; raw.region_stations records
+which regions list a station. Station metadata changes rarely, so a region is
+refreshed at most every `station_refresh_hours`, and its stations are only
+rewritten when the fetched list differs from the one loaded.
 """
+import json
 import logging
-import duckdb
-import pandas as pd
-from typing import List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
 
+from common import db
 from common.config import settings
+from common.fingerprints import compute_fingerprint, fingerprint_updated_at, get_fingerprint, set_fingerprint
+from common.init_db import assign_canonical_stations
+from common.regions import Region, active_regions
 from ingestion import brightsky_client
 
 
 logger = logging.getLogger(__name__)
 
+STAGE = "stations"
+
 
 class StationDiscovery:
-    """Discovers and loads weather stations into DuckDB."""
-    
-    def __init__(self, db_path: str = None):
+    """Discovers and loads weather stations into DuckDB, region by region."""
+
+    def __init__(self, db_path: str = None, regions: Optional[Iterable[str]] = None):
         self.db_path = db_path or settings.duckdb_path
-        logger.info(f"Initialized StationDiscovery | db: {self.db_path}")
-    
-    def run(self):
-        """Execute the station discovery."""
-        logger.info("Fetching stations from API...")
-        
-        try:
-            stations = brightsky_client.get_sources(
-                lat=settings.berlin_center_lat,
-                lon=settings.berlin_center_lon,
-                max_dist=settings.max_distance_m
-            )
-            logger.info(f"Found {len(stations)} stations")
-            
-            if not stations:
-                logger.warning("No stations found.")
-                return
-
-            df = pd.DataFrame(stations)
-            
-            logger.info("Loading into DuckDB (raw.weather_stations)...")
-            
-            conn = duckdb.connect(self.db_path)
+        self.regions = active_regions(regions)
+        logger.info(f"Initialized StationDiscovery | db: {self.db_path} | regions: {[r.name for r in self.regions]}")
+
+    def run(self, force: bool = False) -> bool:
+        """Execute the station discovery. Returns True when raw.weather_stations changed."""
+        with db.session(STAGE, self.db_path) as conn:
             try:
-                conn.register('df_stations', df)
-                
-                conn.execute("DELETE FROM raw.weather_stations")
-                
-                conn.execute("INSERT INTO raw.weather_stations BY NAME SELECT * FROM df_stations")
-                
-                logger.info(f"✅ Stations loaded successfully: {len(df)} records")
-                
-            finally:
-                conn.close()
-                
-        except Exception as e:
-            logger.error(f"Failed to ingest stations: {e}")
+                changed = False
+                for region in self.regions:
+                    changed |= self.refresh_region(conn, region, force)
+                return changed
+
+            except Exception as e:
+                logger.error(f"Failed to ingest stations: {e}")
+                raise
+
+    def refresh_region(self, conn, region: Region, force: bool = False) -> bool:
+        """Refresh the stations of one region. Returns True when they changed."""
+        stage = region.stage(STAGE)
+        last_refresh = fingerprint_updated_at(conn, stage)
+        if not force and last_refresh is not None:
+            age = datetime.now(timezone.utc) - last_refresh
+            if age < timedelta(hours=settings.station_refresh_hours):
+                logger.info(f"[{region.name}] Stations refreshed {age.total_seconds() / 3600:.1f}h ago, skipping.")
+                return False
+
+        logger.info(f"[{region.name}] Fetching stations from API...")
+        stations = brightsky_client.get_sources(
+            lat=region.center_lat,
+            lon=region.center_lon,
+            max_dist=region.max_distance_m
+        )
+        logger.info(f"[{region.name}] Found {len(stations)} stations")
+
+        if not stations:
+            logger.warning(f"[{region.name}] No stations found.")
+            return False
+
+        fingerprint = compute_fingerprint(json.dumps(
+            sorted(stations, key=lambda s: str(s.get("id"))), sort_keys=True, default=str
+        ))
+        if not force and get_fingerprint(conn, stage) == fingerprint:
+            # Restart the refresh interval without rewriting the table
+            set_fingerprint(conn, stage, fingerprint, len(stations))
+            logger.info(f"[{region.name}] Station list unchanged, keeping raw.weather_stations")
+            return False
+
+        import pandas as pd  # only needed when the station list changed
+        df = pd.DataFrame(stations)
+
+        logger.info(f"[{region.name}] Loading into DuckDB (raw.weather_stations)...")
+        conn.begin()
+        try:
+            conn.register('df_stations', df)
+            # Stations shared with another region are upserted, not duplicated
+            conn.execute("INSERT OR REPLACE INTO raw.weather_stations BY NAME SELECT * FROM df_stations")
+            conn.execute("DELETE FROM raw.region_stations WHERE region = ?", [region.name])
+            conn.execute("""
+                INSERT INTO raw.region_stations (region, station_id)
+                SELECT DISTINCT ?, id FROM df_stations
+            """, [region.name])
+            conn.unregister('df_stations')
+            assign_canonical_stations(conn)
+            # Drop stations that no region lists any more
+            conn.execute("""
+                DELETE FROM raw.weather_stations
+                WHERE id NOT IN (SELECT station_id FROM raw.region_stations)
+            """)
+            set_fingerprint(conn, stage, fingerprint, len(df))
+            conn.commit()
+        except Exception:
+            conn.rollback()
             raise
 
+        logger.info(f"✅ [{region.name}] Stations loaded successfully: {len(df)} records")
+        return True
+
 def main():
     discovery = StationDiscovery()
-    discovery.run()
+    discovery.run(force=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,47 @@
+"""
+Ingestion watermarks.
+
+`raw.ingestion_watermarks` holds, per dataset and station, the latest timestamp
+ingested, when the station was last run, and how many rows (and rows with a
+temperature) have been written.
+It replaces per-station MAX(timestamp) scans of the raw tables: a run loads all
+watermarks in one query and advances them in the same transaction as its inserts.
+"""
+from datetime import datetime, timezone
+from typing import Dict
+
+OBSERVATIONS = "observations"
+FORECASTS = "forecasts"
+
+
+def _to_naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def load_watermarks(conn, dataset: str) -> Dict[str, datetime]:
+    """Return {station_id: last_timestamp (UTC-aware)} for a dataset."""
+    rows = conn.execute(
+        "SELECT station_id, last_timestamp FROM raw.ingestion_watermarks WHERE dataset = ?",
+        [dataset]
+    ).fetchall()
+    return {
+        station_id: ts.replace(tzinfo=timezone.utc)
+        for station_id, ts in rows
+        if ts is not None
+    }
+
+
+def update_watermark(conn, dataset: str, station_id: str, last_timestamp: datetime, row_count: int, run_at: datetime,
+                     temperature_rows: int = 0):
+    """Advance a station's watermark. Call inside the transaction that wrote the rows."""
+    conn.execute("""
+        INSERT INTO raw.ingestion_watermarks (dataset, station_id, last_timestamp, last_run_at, row_count, temperature_rows)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dataset, station_id) DO UPDATE SET
+            last_timestamp = greatest(last_timestamp, excluded.last_timestamp),
+            last_run_at = excluded.last_run_at,
+            row_count = row_count + excluded.row_count,
+            temperature_rows = temperature_rows + excluded.temperature_rows
+    """, [dataset, station_id, _to_naive_utc(last_timestamp), _to_naive_utc(run_at), row_count, temperature_rows])
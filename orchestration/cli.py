@@ -0,0 +1,145 @@
+"""
+Slim command line entry point with one subcommand per pipeline stage.
+
+    python -m orchestration.cli <stage> [--regions berlin ...] [--force]
+    python -m orchestration.cli flow          # the whole Prefect flow once
+
+Nothing from the pipeline is imported when this module loads: each
+subcommand imports only its stage's module, so a worker or a per-stage
+subprocess pays for just the libraries that stage uses (no Prefect, and
+e.g. `transform` never loads pandas or geopandas). Stages are recorded like
+the flow's tasks (duration, peak RSS, opt-in profiling) and the run report
+is written to `metrics_dir`.
+
+The benchmark's `import_times` scenario (`python -m benchmarks.run
+--scenarios import_times`) reports the import cost of every stage from
+`python -X importtime`.
+"""
+import argparse
+import logging
+import os
+import sys
+
+# stage -> (module it imports, metrics stage name as in orchestration/tasks.py, help)
+STAGES = {
+    "init-db": ("common.init_db", "init_db", "Create or migrate the database schema"),
+    "stations": ("ingestion.stations", "stations", "Refresh the stations of each region"),
+    "postal-codes": ("ingestion.postal_codes", "postal_codes", "Load the postal code areas of each region"),
+    "observations": ("ingestion.observations", "observations", "Ingest new observations"),
+    "forecasts": ("ingestion.forecasts", "forecasts", "Ingest new forecasts"),
+    "ingest": ("ingestion.spool", "ingest_sharded", "Ingest observations and forecasts with sharded fetch workers"),
+    "thin-vintages": ("common.maintenance", "thin_forecast_vintages", "Apply the forecast vintage retention policy"),
+    "archive": ("common.archive", "archive", "Archive closed months to Parquet and compact the archive"),
+    "map": ("processing.station_mapping", "station_mapping", "Rebuild the station <-> postal code map"),
+    "transform": ("orchestration.dbt_runner", "dbt_build", "Build the dbt models affected by new data"),
+    "interpolate": ("processing.interpolation", "interpolation", "Interpolate station values onto postal codes"),
+    "gap-fill": ("processing.gap_fill", "gap_fill", "Fill temporal gaps in the marts"),
+    "rollups": ("processing.rollups", "rollups", "Update the daily / weekly rollups of the marts"),
+    "snapshot": ("serving.snapshot", "publish_snapshot", "Publish the serving snapshot"),
+    "export": ("serving.export", "export_features", "Update the Parquet / tensor feature export"),
+    "flow": ("orchestration.flow", None, "Run the whole Prefect flow once"),
+}
+
+# Stages that take --regions / --force
+REGIONAL = ("stations", "postal-codes", "observations", "forecasts", "ingest", "map", "flow")
+FORCED = ("init-db", "stations", "postal-codes", "map", "transform")
+
+
+def run_stage(stage: str, regions=None, force: bool = False):
+    """Run one stage in this process and return its result."""
+    if stage == "init-db":
+        from common.init_db import init_database
+        return init_database(force=force)
+    if stage == "stations":
+        from ingestion.stations import StationDiscovery
+        return StationDiscovery(regions=regions).run(force=force)
+    if stage == "postal-codes":
+        from ingestion.postal_codes import main as ingest_postal_codes
+        return ingest_postal_codes(force=force, regions=regions)
+    if stage == "observations":
+        from ingestion.observations import ObservationsIngestion
+        return ObservationsIngestion(regions=regions).run()
+    if stage == "forecasts":
+        from ingestion.forecasts import ForecastsIngestion
+        return ForecastsIngestion(regions=regions).run()
+    if stage == "ingest":
+        from ingestion.spool import run_sharded
+        return run_sharded(regions=regions)
+    if stage == "thin-vintages":
+        from common import db
+        from common.maintenance import thin_forecast_vintages
+        with db.session("thin_forecast_vintages", checkpoint=True) as conn:
+            return thin_forecast_vintages(conn)
+    if stage == "archive":
+        from common import db
+        from common.archive import archive_closed_periods, compact_archive
+        with db.session("archive") as conn:  # archive_closed_periods checkpoints
+            moved = archive_closed_periods(conn)
+            compact_archive(conn)
+            return moved
+    if stage == "map":
+        from processing.station_mapping import StationLocationMapping
+        return StationLocationMapping(regions=regions).run(force=force)
+    if stage == "transform":
+        from orchestration.dbt_runner import run_dbt
+        return run_dbt(full_refresh=force)
+    if stage == "interpolate":
+        from processing.interpolation import SpatialInterpolation
+        return SpatialInterpolation().run()
+    if stage == "gap-fill":
+        from processing.gap_fill import GapFill
+        return GapFill().run()
+    if stage == "rollups":
+        from processing.rollups import Rollups
+        return Rollups().run()
+    if stage == "snapshot":
+        from serving.snapshot import publish_snapshot
+        return publish_snapshot()
+    if stage == "export":
+        from serving.export import FeatureExport
+        return FeatureExport().run()
+    if stage == "flow":
+        from orchestration.flow import weather_pipeline_flow
+        return weather_pipeline_flow(regions=regions)
+    raise ValueError(f"Unknown stage '{stage}'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m orchestration.cli", description="Run one pipeline stage")
+    parser.add_argument("--db-path", help="DuckDB file (default: DUCKDB_PATH / settings)")
+    sub = parser.add_subparsers(dest="stage", required=True, metavar="stage")
+    for stage, (_, _, help_text) in STAGES.items():
+        p = sub.add_parser(stage, help=help_text)
+        if stage in REGIONAL:
+            p.add_argument("--regions", nargs="+", help="Regions to process (default: settings.regions)")
+        if stage in FORCED:
+            p.add_argument("--force", action="store_true",
+                           help="Full refresh" if stage == "transform" else "Ignore fingerprints")
+    args = parser.parse_args(argv)
+
+    # Settings are built on first use, so this still takes effect
+    if args.db_path:
+        os.environ["DUCKDB_PATH"] = os.path.abspath(args.db_path)
+
+    from common import db
+    from common.config import settings
+    from common.metrics import instrumented, metrics
+    logging.basicConfig(level=settings.log_level)
+
+    if args.stage == "flow":
+        # The flow records its own stages and exports the run report
+        run_stage("flow", getattr(args, "regions", None))
+        return
+    try:
+        result = instrumented(STAGES[args.stage][1])(run_stage)(
+            args.stage, getattr(args, "regions", None), getattr(args, "force", False)
+        )
+        if result is not None:
+            print(f"✅ {args.stage}: {result}")
+    finally:
+        db.release()
+        metrics.export()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+In-process dbt runs for the transform step.
+
+dbt runs through its programmatic runner (`dbtRunner`) instead of a
+subprocess per command:
+
+- `dbt deps` only runs when packages.yml / package-lock.yml changed since the
+  packages were installed (stamped in dbt_packages/).
+- The parsed manifest is kept in memory between runs of a long-lived process
+  and handed back to the runner; otherwise dbt's partial parse reuses
+  target/partial_parse.msgpack.
+- Only the subgraph downstream of raw sources whose data changed is built
+  (e.g. just the observation lineage when only observations landed). Any
+  change to the dbt project builds everything.
+- Incremental builds set ARCHIVE_START to the first month the marts
+  recompute, so the staging views skip older archive partitions.
+"""
+import argparse
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+from common import db
+from common.archive import archive_cutoff
+from common.config import settings
+from common.init_db import has_column
+from common.fingerprints import compute_fingerprint, files_fingerprint, get_fingerprint, set_fingerprint, source_fingerprints
+from common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent / "transform"
+# Files of the dbt project that change what a build produces
+PROJECT_FILES = ("dbt_project.yml", "profiles.yml", "packages.yml", "package-lock.yml", "models/**/*", "macros/**/*", "seeds/**/*")
+PACKAGE_FILES = ("packages.yml", "package-lock.yml")
+DEPS_STAMP = PROJECT_DIR / "dbt_packages" / ".deps_fingerprint"
+
+PROJECT_STAGE = "dbt_project"
+SOURCE_STAGE = "dbt_source:{source}"
+
+# Raw table (hot and archived) -> (time column, incremental mart built from it)
+MART_SOURCES = {
+    "weather_observations": ("timestamp", "mart_hourly_observations_pcode"),
+    "weather_forecasts_latest": ("forecast_timestamp", "mart_hourly_forecasts_pcode"),
+}
+
+# (project fingerprint, manifest) of the last parse in this process
+_manifest_cache: Optional[tuple] = None
+
+
+def _runner(manifest=None):
+    from dbt.cli.main import dbtRunner
+    return dbtRunner(manifest=manifest)
+
+
+def _invoke(args: List[str], manifest=None):
+    command = args + ["--project-dir", str(PROJECT_DIR), "--profiles-dir", str(PROJECT_DIR)]
+    result = _runner(manifest).invoke(command)
+    if not result.success:
+        raise RuntimeError(f"dbt {args[0]} failed: {result.exception or 'see the dbt log above'}")
+    return result
+
+
+def ensure_deps() -> bool:
+    """Install dbt packages unless the installed set matches the package files. Returns True if installed."""
+    fingerprint = files_fingerprint(PROJECT_DIR, PACKAGE_FILES)
+    if DEPS_STAMP.exists() and DEPS_STAMP.read_text() == fingerprint:
+        return False
+    logger.info("Installing dbt dependencies...")
+    _invoke(["deps"])
+    DEPS_STAMP.parent.mkdir(parents=True, exist_ok=True)
+    DEPS_STAMP.write_text(fingerprint)
+    return True
+
+
+def _manifest(project_fingerprint: str):
+    """Parsed manifest for the current project, parsing only when it changed."""
+    global _manifest_cache
+    if _manifest_cache is None or _manifest_cache[0] != project_fingerprint:
+        with metrics.timer("dbt_parse_seconds"):
+            _manifest_cache = (project_fingerprint, _invoke(["parse"]).result)
+    return _manifest_cache[1]
+
+
+def model_env() -> Dict[str, str]:
+    """Settings the models read through env_var(); part of the project fingerprint."""
+    return {
+        "STATION_ACTIVE_SINCE": settings.station_active_since,
+        "SPATIAL_METHOD": settings.spatial_method,
+    }
+
+
+def plan_build(conn, full_refresh: bool = False) -> Dict:
+    """
+    Decide what to build: {"select": [...] or None for everything, "project": fp,
+    "sources": {source: fp}}. `select` is [] when nothing changed.
+    """
+    project = compute_fingerprint(files_fingerprint(PROJECT_DIR, PROJECT_FILES), sorted(model_env().items()))
+    sources = source_fingerprints(conn)
+    if full_refresh or get_fingerprint(conn, PROJECT_STAGE) != project:
+        return {"select": None, "project": project, "sources": sources}
+    changed = [
+        source for source, fingerprint in sources.items()
+        if get_fingerprint(conn, SOURCE_STAGE.format(source=source)) != fingerprint
+    ]
+    return {"select": [f"source:weather.{source}+" for source in changed], "project": project, "sources": sources}
+
+
+def archive_start(conn) -> str:
+    """
+    First month (YYYY-MM-DD) an incremental build recomputes: that of the
+    earliest hour ingested after a mart's `ingested_through`, hot or archived
+    (late rows can be archived before the build), less a day for
+    `mart_lookback_hours`. '' (the whole archive) when a mart is not built yet.
+    """
+    first = None
+    for source, (time_column, mart) in MART_SOURCES.items():
+        if not has_column(conn, settings.mart_schema, mart, "ingested_through"):
+            return ""
+        through = conn.execute(f"SELECT max(ingested_through) FROM {settings.mart_schema}.{mart}").fetchone()[0]
+        if through is None:
+            return ""
+        queries = [f"SELECT min({time_column}) FROM raw.{source} WHERE ingested_at > $through"]
+        archived = os.path.join(settings.archive_dir, source, "*", "*", "*", "*.parquet")
+        if conn.execute("SELECT count(*) FROM glob(?)", [archived]).fetchone()[0]:
+            # Row group statistics on ingested_at skip most of the files' data
+            queries.append(
+                f"SELECT min({time_column}) FROM read_parquet('{archived}', union_by_name = true) "
+                f"WHERE ingested_at > $through"
+            )
+        start = conn.execute(f"SELECT min(m) FROM ({' UNION ALL '.join(queries)}) t(m)", {"through": through}).fetchone()[0]
+        if start is not None and (first is None or start < first):
+            first = start
+    # Nothing new: no archived month is needed
+    first = first - timedelta(days=1) if first is not None else archive_cutoff()
+    return f"{first:%Y-%m-01}"
+
+
+def run_dbt(full_refresh: bool = False, db_path: str = None) -> bool:
+    """Build the marts affected by new data. Returns False when nothing needed building."""
+    db_path = db_path or settings.duckdb_path
+    with db.session("dbt_plan", db_path) as conn:
+        plan = plan_build(conn, full_refresh)
+        if full_refresh:
+            # The rebuilt marts may lack days the rollups still hold
+            from processing.rollups import drop_rollups
+            drop_rollups(conn)
+        start = "" if full_refresh or plan["select"] == [] else archive_start(conn)
+
+    if plan["select"] == []:
+        logger.info("No new raw rows and no dbt project changes, skipping dbt build.")
+        return False
+
+    # dbt-duckdb opens the file with its own configuration; checkpoint and free it first
+    db.release(db_path)
+
+    # The profile and staging models read these; set before parsing
+    os.environ["DUCKDB_PATH"] = db_path
+    os.environ["ARCHIVE_DIR"] = settings.archive_dir
+    os.environ["ARCHIVE_START"] = start
+    os.environ.update(model_env())
+
+    ensure_deps()
+    manifest = _manifest(compute_fingerprint(plan["project"], db_path, settings.archive_dir))
+
+    args = ["build", "--threads", str(settings.dbt_threads)]
+    if plan["select"] is not None:
+        args += ["--select", *plan["select"]]
+    if full_refresh:
+        args.append("--full-refresh")
+    logger.info(f"Running dbt {' '.join(args)}")
+    try:
+        _invoke(args, manifest)
+    finally:
+        # Per-model timings (written even when some models fail)
+        models = metrics.record_dbt_results(PROJECT_DIR / "target" / "run_results.json")
+        if models:
+            slowest = ", ".join(f"{m['unique_id'].split('.')[-1]} {m['seconds']}s" for m in models[:5])
+            logger.info(f"Slowest dbt nodes: {slowest}")
+
+    # Recorded only after a successful build, so a failed one is retried next run
+    with db.session("dbt_fingerprints", db_path) as conn:
+        for source, fingerprint in plan["sources"].items():
+            set_fingerprint(conn, SOURCE_STAGE.format(source=source), fingerprint)
+        set_fingerprint(conn, PROJECT_STAGE, plan["project"], len(models))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the dbt models affected by new raw data")
+    parser.add_argument("--full-refresh", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.log_level)
+    run_dbt(full_refresh=args.full_refresh)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,96 @@
+from typing import List, Optional
 from prefect import flow
+from common import db
+from common.metrics import metrics
 from orchestration.tasks import (
     task_init_db,
     task_ingest_stations,
     task_ingest_postal_codes,
-    task_ingest_observations,
-    task_ingest_forecasts,
-    task_transform_data
+    task_ingest_sharded,
+    task_thin_forecast_vintages,
+    task_archive_raw,
+    task_map_stations,
+    task_transform_data,
+    task_interpolate,
+    task_fill_gaps,
+    task_update_rollups,
+    task_publish_snapshot,
+    task_export_features
 )
 
 @flow(name="Weather Pipeline", log_prints=True)
-def weather_pipeline_flow():
+def weather_pipeline_flow(regions: Optional[List[str]] = None):
     """
     Main orchestration flow for the Weather Pipeline.
+
+    `regions` restricts the run to some regions of the registry
+    (common/regions.py), e.g. to schedule regions as separate deployments;
+    by default every region in `settings.regions` is processed. Each region
+    is refreshed, mapped and gap-filled as its own partition.
     
     Steps:
-    0. Initialize Database (Idempotent)
-    1. Ingest Stations (ensures we have latest metadata)
-    2. Ingest Observations & Forecasts (Parallel)
-    3. Run dbt transformations (Dependent on ingestion)
+    0. Initialize Database (skipped when the schema is current)
+    1. Ingest Stations (refreshed every `station_refresh_hours`) and postal codes
+       (reloaded only for a new release)
+    2. Ingest Observations & Forecasts (sharded fetch workers, one loader), then thin old forecast vintages
+       and move closed months to the Parquet archive
+    3. Rebuild the station <-> postal code map when its inputs changed
+    4. Run dbt transformations when raw data or the dbt project changed, interpolate
+       station values onto postal codes (IDW), then fill mart gaps
+    5. Publish the marts to the query service
+
+    Every run writes a metrics report (stage timings, peak RSS, HTTP latency,
+    dbt model timings) to `settings.metrics_dir`.
     """
     print("🚀 Starting Weather Pipeline execution...")
+    metrics.reset()
     
-    # 0. Initialize DB (Auto-heal for fresh containers)
-    task_init_db()
+    try:
+        # 0. Initialize DB (Auto-heal for fresh containers)
+        task_init_db()
 
-    # 1. Stations (Sequential, required for others)
-    # We verify stations first to ensure referential integrity
-    task_ingest_stations()
-    task_ingest_postal_codes()
+        # 1. Stations (Sequential, required for others)
+        # We verify stations first to ensure referential integrity
+        task_ingest_stations(regions)
+        task_ingest_postal_codes(regions)
+    
+        # 2. Ingest Data (Parallel)
+        # Fetch workers run as separate processes; a single loader is the only DuckDB writer
+        loaded = task_ingest_sharded(regions)
+        obs_count = loaded["observations"]
+        fcst_count = loaded["forecasts"]
     
-    # 2. Ingest Data (Parallel)
-    # Prefect runs tasks in parallel by default if they don't depend on each other
-    obs_future = task_ingest_observations.submit()
-    fcst_future = task_ingest_forecasts.submit()
+        print(f"📊 Pipeline Summary: Ingested {obs_count} observations and {fcst_count} forecasts.")
     
-    # Wait for completion before transformation
-    obs_count = obs_future.result()
-    fcst_count = fcst_future.result()
+        # Retention for forecast vintages (after the forecast write has committed)
+        task_thin_forecast_vintages()
+        task_archive_raw()
     
-    print(f"📊 Pipeline Summary: Ingested {obs_count} observations and {fcst_count} forecasts.")
+        # 3. Station map (skipped when stations and postal codes are unchanged)
+        map_changed = task_map_stations(regions)
     
-    # 3. Transform
-    task_transform_data()
+        # 4. Transform (a changed map invalidates every incremental mart hour;
+        #    skipped when no raw rows arrived and the dbt project is unchanged)
+        transformed = task_transform_data(full_refresh=map_changed)
+        interpolated = task_interpolate()
+        filled = task_fill_gaps()
+        task_update_rollups()
     
-    print("✅ Weather Pipeline Flow Completed")
+        # 5. Serving snapshot (the query service swaps to it on its next check)
+        #    and the feature export (only the changed days are rewritten)
+        if transformed or interpolated or filled:
+            task_publish_snapshot()
+            task_export_features()
+        else:
+            print("Marts unchanged, keeping the current serving snapshot and feature export.")
+    
+        print("✅ Weather Pipeline Flow Completed")
+    finally:
+        # Free the database file between scheduled runs
+        db.release()
+        # Run report + Prometheus textfile, also for failed runs
+        metrics.export()
+
 
 if __name__ == "__main__":
     # For local development/testing
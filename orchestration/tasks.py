@@ -1,67 +1,132 @@
+"""
+Prefect tasks of the pipeline flow.
+
+Stage modules are imported inside each task, not at load time, so a worker
+only pays for the libraries of the tasks it actually runs (dbt-only runs
+never load pandas/geopandas, ingestion never loads sklearn or dbt).
+"""
 import logging
+from typing import List, Optional
 from prefect import task
 
-from ingestion.stations import StationDiscovery
-from ingestion.observations import ObservationsIngestion
-from ingestion.forecasts import ForecastsIngestion
-from ingestion.postal_codes import main as ingest_postal_codes
-from common.init_db import init_database
+from common.metrics import instrumented
 
 @task(name="Initialize Database", log_prints=True)
+@instrumented("init_db")
 def task_init_db():
     """Ensure database schema exists."""
+    from common.init_db import init_database
     init_database()
 
 @task(name="Ingest Postal Codes", log_prints=True)
-def task_ingest_postal_codes():
+@instrumented("postal_codes")
+def task_ingest_postal_codes(regions: Optional[List[str]] = None):
     """Run postal code ingestion."""
-    ingest_postal_codes()
+    from ingestion.postal_codes import main as ingest_postal_codes
+    ingest_postal_codes(regions=regions)
 
 @task(name="Ingest Stations", log_prints=True)
-def task_ingest_stations():
-    """Run station discovery."""
-    discovery = StationDiscovery()
-    discovery.run()
+@instrumented("stations")
+def task_ingest_stations(regions: Optional[List[str]] = None):
+    """Run station discovery (on its own, slower cadence)."""
+    from ingestion.stations import StationDiscovery
+    discovery = StationDiscovery(regions=regions)
+    return discovery.run()
 
 @task(name="Ingest Observations", log_prints=True)
-def task_ingest_observations():
+@instrumented("observations")
+def task_ingest_observations(regions: Optional[List[str]] = None):
     """Run observations ingestion."""
-    ingest = ObservationsIngestion()
+    from ingestion.observations import ObservationsIngestion
+    ingest = ObservationsIngestion(regions=regions)
     return ingest.run()
 
 @task(name="Ingest Forecasts", log_prints=True)
-def task_ingest_forecasts():
+@instrumented("forecasts")
+def task_ingest_forecasts(regions: Optional[List[str]] = None):
     """Run forecasts ingestion."""
-    ingest = ForecastsIngestion()
+    from ingestion.forecasts import ForecastsIngestion
+    ingest = ForecastsIngestion(regions=regions)
     return ingest.run()
 
+@task(name="Ingest Observations & Forecasts (Sharded)", log_prints=True)
+@instrumented("ingest_sharded")
+def task_ingest_sharded(regions: Optional[List[str]] = None):
+    """Fetch with worker processes into the spool while one loader writes to DuckDB."""
+    from ingestion.spool import run_sharded
+    return run_sharded(regions=regions)
+
+@task(name="Map Stations to Postal Codes", log_prints=True)
+@instrumented("station_mapping")
+def task_map_stations(regions: Optional[List[str]] = None):
+    """Rebuild the station <-> postal code map of every region whose inputs changed."""
+    from processing.station_mapping import StationLocationMapping
+    return StationLocationMapping(regions=regions).run()
+
+@task(name="Thin Forecast Vintages", log_prints=True)
+@instrumented("thin_forecast_vintages")
+def task_thin_forecast_vintages():
+    """Apply the forecast vintage retention policy."""
+    from common import db
+    from common.maintenance import thin_forecast_vintages
+
+    with db.session("thin_forecast_vintages", checkpoint=True) as conn:
+        return thin_forecast_vintages(conn)
+
+@task(name="Archive Raw History", log_prints=True)
+@instrumented("archive")
+def task_archive_raw():
+    """Move closed months of raw data to the Parquet archive and compact it."""
+    from common import db
+    from common.archive import archive_closed_periods, compact_archive
+
+    with db.session("archive") as conn:  # archive_closed_periods checkpoints
+        moved = archive_closed_periods(conn)
+        compact_archive(conn)
+        return moved
+
 @task(name="Run dbt Transformations", log_prints=True)
-def task_transform_data():
-    """Run dbt pipeline via shell."""
-    import subprocess
-    import sys
-    
-    logger = logging.getLogger("dbt")
-    
-    print("Installing dbt dependencies...")
-    subprocess.run(
-        [sys.executable, "-m", "dbt.cli.main", "deps", "--profiles-dir", "."],
-        cwd="./transform",
-        check=True
-    )
-
-    print("Running dbt build...")
-    result = subprocess.run(
-        [sys.executable, "-m", "dbt.cli.main", "build", "--profiles-dir", "."],
-        cwd="./transform",
-        capture_output=True,
-        text=True
-    )
-    
-    if result.stdout:
-        print(result.stdout)
-    if result.stderr:
-        print(result.stderr)
-        
-    if result.returncode != 0:
-        raise Exception(f"dbt run failed with exit code {result.returncode}")
+@instrumented("dbt_build")
+def task_transform_data(full_refresh: bool = False):
+    """
+    Run dbt in-process (orchestration/dbt_runner.py), building only models
+    downstream of raw sources that changed. Marts build incrementally unless
+    `full_refresh`. Returns False when nothing needed building.
+    """
+    from orchestration.dbt_runner import run_dbt
+    return run_dbt(full_refresh=full_refresh)
+
+@task(name="Interpolate Station Values", log_prints=True)
+@instrumented("interpolation")
+def task_interpolate():
+    """Fill the rows dbt just rebuilt with inverse-distance weighted station values."""
+    from processing.interpolation import SpatialInterpolation
+    return SpatialInterpolation().run()
+
+@task(name="Fill Mart Gaps", log_prints=True)
+@instrumented("gap_fill")
+def task_fill_gaps():
+    """Fill temporal gaps in the rows dbt just rebuilt."""
+    from processing.gap_fill import GapFill
+    return GapFill().run()
+
+@task(name="Update Rollups", log_prints=True)
+@instrumented("rollups")
+def task_update_rollups():
+    """Re-aggregate the daily / weekly rollups of the days the build touched."""
+    from processing.rollups import Rollups
+    return Rollups().run()
+
+@task(name="Publish Serving Snapshot", log_prints=True)
+@instrumented("publish_snapshot")
+def task_publish_snapshot():
+    """Hand the finished marts to the query service."""
+    from serving.snapshot import publish_snapshot
+    return publish_snapshot()
+
+@task(name="Export Training Features", log_prints=True)
+@instrumented("export_features")
+def task_export_features():
+    """Update the Parquet / tensor feature export for training jobs."""
+    from serving.export import FeatureExport
+    return FeatureExport().run()
@@ -0,0 +1 @@
+"""Python compute stages that run alongside the dbt models"""
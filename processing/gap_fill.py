@@ -0,0 +1,283 @@
+"""
+Gap-filling stage for the hourly postal code marts.
+
+dbt writes the best-spatial value per postal code and hour with
+`fill_method` NULL. This stage loads the unprocessed rows as dense
+(postal_code x hour x metric) arrays, one region and `gap_fill_block_hours`
+block at a time (plus enough context on both sides to anchor fills across the
+block edges) so memory is bounded by a block of the largest region, and, for
+every postal code of the block at once:
+
+- interpolates linearly in time across interior gaps of up to
+  `gap_fill_max_interpolate_hours` missing hours;
+- forward-fills any remaining gap for up to `gap_fill_max_ffill_hours` hours.
+
+The filled values are written back in place with the fill code of each metric
+(`fill_codes`, packed 2 bits per metric) and of the row (`fill_method`, the
+highest of them). Only observed values anchor later fills: a metric that was
+filled is skipped as context, while the observed metrics of the same row still
+count.
+Every row a build rewrote passes through here exactly once, so the days they
+fall on are recorded in `mart_day_changes` (with the time of the fill) for the
+stages that maintain copies of the marts (processing/rollups.py).
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from common import db
+from common.config import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("temperature", "precipitation", "relative_humidity", "wind_speed")
+
+# mart -> hour column
+MARTS: Dict[str, str] = {
+    "mart_hourly_observations_pcode": "observation_hour",
+    "mart_hourly_forecasts_pcode": "forecast_hour",
+}
+
+# Per-metric fill codes; a row's fill_method is its highest code across metrics
+OBSERVED, FFILL, INTERPOLATED, UNFILLED = 0, 1, 2, 3
+FILL_METHODS = np.array(["observed", "ffill", "interpolated", "unfilled"], dtype=object)
+# Bit offset of each metric's code in fill_codes
+CODE_SHIFTS = np.arange(len(METRICS), dtype=np.uint8) * 2
+
+
+def pack_codes(codes: np.ndarray) -> np.ndarray:
+    """(... x metric) fill codes -> uint8 fill_codes."""
+    return np.bitwise_or.reduce(np.asarray(codes, dtype=np.uint8) << CODE_SHIFTS, axis=-1)
+
+
+def unpack_codes(packed: np.ndarray) -> np.ndarray:
+    """uint8 fill_codes -> (... x metric) fill codes."""
+    return (np.asarray(packed, dtype=np.uint8)[..., None] >> CODE_SHIFTS) & 3
+
+
+def changes_table() -> str:
+    return f"{settings.mart_schema}.mart_day_changes"
+
+
+def create_changes_table(conn):
+    """(mart, day) -> when the rows of that day were last rewritten and filled."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {changes_table()} (
+            mart VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            changed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (mart, day)
+        )
+    """)
+
+
+def fill_gaps(values: np.ndarray, hours: np.ndarray, max_ffill: float, max_interpolate: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fill NaNs along the time axis of `values` (series x time [x metric]).
+
+    `hours` gives the time of each column in hours, so gaps are measured in
+    time even when the hour axis itself skips hours. Returns the filled array
+    and a uint8 array of fill codes of the same shape.
+    """
+    n = values.shape[1]
+    valid = ~np.isnan(values)
+    shape = (1, n) + (1,) * (values.ndim - 2)
+    positions = np.arange(n).reshape(shape)
+
+    # Index of the last valid value at or before / first valid at or after each position
+    prev = np.maximum.accumulate(np.where(valid, positions, -1), axis=1)
+    nxt = np.flip(np.minimum.accumulate(np.flip(np.where(valid, positions, n), axis=1), axis=1), axis=1)
+    has_prev, has_next = prev >= 0, nxt < n
+    prev, nxt = np.clip(prev, 0, n - 1), np.clip(nxt, 0, n - 1)
+
+    t = hours.reshape(shape)
+    t_prev, t_next = hours[prev], hours[nxt]
+    v_prev = np.take_along_axis(values, prev, axis=1)
+    v_next = np.take_along_axis(values, nxt, axis=1)
+
+    missing = ~valid
+    interior = missing & has_prev & has_next
+    interpolate = interior & (t_next - t_prev - 1 <= max_interpolate)
+    ffill = missing & ~interpolate & has_prev & (t - t_prev <= max_ffill)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = (t - t_prev) / (t_next - t_prev)
+    filled = np.where(interpolate, v_prev + (v_next - v_prev) * weight, values)
+    filled = np.where(ffill, v_prev, filled)
+
+    codes = np.full(values.shape, OBSERVED, dtype=np.uint8)
+    codes[ffill] = FFILL
+    codes[interpolate] = INTERPOLATED
+    codes[missing & ~ffill & ~interpolate] = UNFILLED
+    return filled, codes
+
+
+class GapFill:
+    """Fills unprocessed rows of the hourly marts."""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or settings.duckdb_path
+        self.max_ffill = settings.gap_fill_max_ffill_hours
+        self.max_interpolate = settings.gap_fill_max_interpolate_hours
+        self.block_hours = settings.gap_fill_block_hours
+        logger.info(f"Initialized GapFill | db: {self.db_path}")
+
+    def fill_mart(self, conn, mart: str, hour_column: str) -> int:
+        table = f"{settings.mart_schema}.{mart}"
+        regions = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT region FROM {table} WHERE fill_method IS NULL ORDER BY region"
+        ).fetchall()]
+        if not regions:
+            logger.info(f"{mart}: nothing to fill")
+            return 0
+        return sum(self.fill_region(conn, mart, hour_column, region) for region in regions)
+
+    def fill_region(self, conn, mart: str, hour_column: str, region: str) -> int:
+        """Fill the pending rows of a region in blocks of `gap_fill_block_hours`. Returns the rows processed."""
+        table = f"{settings.mart_schema}.{mart}"
+        first, last = conn.execute(f"""
+            SELECT min({hour_column}), max({hour_column}) FROM {table}
+            WHERE fill_method IS NULL AND region IS NOT DISTINCT FROM ?
+        """, [region]).fetchone()
+        if first is None:
+            return 0
+        # Rows this far on either side of a block anchor fills across its edges
+        context = timedelta(hours=max(self.max_ffill, self.max_interpolate) + 1)
+        block = timedelta(hours=self.block_hours)
+        starts = [first + i * block for i in range((last - first) // block + 1)]
+
+        counts = np.zeros(len(FILL_METHODS), dtype=np.int64)
+        rows = self.load(conn, table, hour_column, region, starts[0] - context, starts[0] + block + context)
+        for i, block_start in enumerate(starts):
+            # Read before this block is written, so the next block's leading
+            # context still holds the unfilled values, as in a single pass
+            following = None
+            if i + 1 < len(starts):
+                following = self.load(conn, table, hour_column, region, starts[i + 1] - context, starts[i + 1] + block + context)
+            counts += self.fill_block(conn, mart, hour_column, region, rows, block_start, block_start + block)
+            rows = following
+
+        summary = {FILL_METHODS[c]: int(n) for c, n in enumerate(counts) if n}
+        logger.info(f"✅ {mart} [{region}]: processed {counts.sum()} rows in {len(starts)} blocks {summary}")
+        return int(counts.sum())
+
+    def load(self, conn, table: str, hour_column: str, region: str, start: datetime, end: datetime) -> pa.Table:
+        return pa.table(conn.execute(f"""
+            SELECT postal_code, {hour_column} AS hour, {", ".join(METRICS)}, fill_method, fill_codes
+            FROM {table}
+            WHERE region IS NOT DISTINCT FROM ? AND {hour_column} >= ? AND {hour_column} < ?
+        """, [region, start, end]).arrow())
+
+    def fill_block(self, conn, mart: str, hour_column: str, region: str, rows: pa.Table,
+                   block_start: datetime, block_end: datetime) -> np.ndarray:
+        """Fill and write the pending rows of `rows` within [block_start, block_end). Returns rows per fill code."""
+        table = f"{settings.mart_schema}.{mart}"
+        micros = rows.column("hour").cast(pa.timestamp("us")).cast(pa.int64()).to_numpy()
+        pending = rows.column("fill_method").is_null().to_numpy(zero_copy_only=False)
+        in_block = pending & (micros >= _micros(block_start)) & (micros < _micros(block_end))
+        if not in_block.any():
+            return np.zeros(len(FILL_METHODS), dtype=np.int64)
+        # Only observed context values anchor fills, never earlier fills. Rows
+        # filled before fill_codes existed only count when fully observed.
+        observed = pc.equal(rows.column("fill_method"), "observed").fill_null(False).to_numpy(zero_copy_only=False)
+        legacy = np.where(pending | observed, 0, pack_codes(np.full(len(METRICS), FFILL)))
+        packed = rows.column("fill_codes")
+        packed = np.where(packed.is_valid().to_numpy(zero_copy_only=False),
+                          packed.fill_null(0).to_numpy(zero_copy_only=False), legacy)
+        known = unpack_codes(packed)
+        anchors = (known != FFILL) & (known != INTERPOLATED)
+
+        # Dense axes: postal codes by dictionary index, hours by offset from the first hour
+        codes_arr = pc.dictionary_encode(rows.column("postal_code")).combine_chunks()
+        postal_codes = codes_arr.dictionary
+        p_idx = codes_arr.indices.to_numpy()
+        start = micros.min()
+        h_idx = (micros - start) // 3_600_000_000
+        hours = np.arange(h_idx.max() + 1, dtype=np.float64)
+
+        values = np.full((len(postal_codes), len(hours), len(METRICS)), np.nan)
+        for m, metric in enumerate(METRICS):
+            column = rows.column(metric).cast(pa.float64()).to_numpy(zero_copy_only=False)  # NULL -> NaN
+            anchor = anchors[:, m]
+            values[p_idx[anchor], h_idx[anchor], m] = column[anchor]
+
+        filled, codes = fill_gaps(values, hours, self.max_ffill, self.max_interpolate)
+
+        # Rows with every metric observed only need their fill codes set
+        p_out, h_out = p_idx[in_block], h_idx[in_block]
+        metric_codes = codes[p_out, h_out]
+        row_codes = metric_codes.max(axis=1)
+        changed = row_codes != OBSERVED
+        p_chg, h_chg = p_out[changed], h_out[changed]
+        columns = {
+            "postal_code": postal_codes.take(pa.array(p_chg)),
+            "hour": pa.array(start + h_chg * 3_600_000_000, type=pa.timestamp("us")),
+        }
+        for m, metric in enumerate(METRICS):
+            columns[metric] = pa.array(filled[p_chg, h_chg, m], from_pandas=True)  # NaN -> NULL
+        columns["fill_method"] = pa.array(FILL_METHODS[row_codes[changed]], type=pa.string())
+        columns["fill_codes"] = pa.array(pack_codes(metric_codes[changed]), type=pa.uint8())
+        result = pa.table(columns)
+
+        window = {"region": region, "start": block_start, "end": block_end}
+        pending_rows = (
+            f"fill_method IS NULL AND region IS NOT DISTINCT FROM $region "
+            f"AND {hour_column} >= $start AND {hour_column} < $end"
+        )
+        conn.begin()
+        try:
+            # Before the pending rows are marked below
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {changes_table()} (mart, day, changed_at)
+                SELECT DISTINCT $mart, {hour_column}::DATE, $now
+                FROM {table}
+                WHERE {pending_rows}
+            """, {**window, "mart": mart, "now": datetime.now(timezone.utc).replace(tzinfo=None)})
+            conn.register("filled", result)
+            conn.execute(f"""
+                UPDATE {table} AS m
+                SET {", ".join(f"{metric} = f.{metric}" for metric in METRICS)},
+                    fill_method = f.fill_method, fill_codes = f.fill_codes
+                FROM filled f
+                WHERE m.postal_code = f.postal_code AND m.{hour_column} = f.hour
+            """)
+            conn.unregister("filled")
+            conn.execute(f"UPDATE {table} SET fill_method = 'observed', fill_codes = 0 WHERE {pending_rows}", window)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return np.bincount(row_codes, minlength=len(FILL_METHODS))
+
+    def run(self) -> int:
+        with db.session("gap_fill", self.db_path, checkpoint=True) as conn:
+            create_changes_table(conn)
+            total = 0
+            for mart, hour_column in MARTS.items():
+                exists = conn.execute("""
+                    SELECT count(*) FROM information_schema.columns
+                    WHERE table_schema = ? AND table_name = ? AND column_name = 'fill_method'
+                """, [settings.mart_schema, mart]).fetchone()[0]
+                if not exists:
+                    logger.warning(f"{mart} not built yet, skipping gap fill")
+                    continue
+                # Marts built before fill_codes until dbt appends it
+                conn.execute(f"ALTER TABLE {settings.mart_schema}.{mart} ADD COLUMN IF NOT EXISTS fill_codes UTINYINT")
+                total += self.fill_mart(conn, mart, hour_column)
+            return total
+
+
+def _micros(ts: datetime) -> int:
+    return pa.scalar(ts, type=pa.timestamp("us")).value
+
+
+def main():
+    GapFill().run()
+
+
+if __name__ == "__main__":
+    main()
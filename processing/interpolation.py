@@ -0,0 +1,240 @@
+"""
+Spatial interpolation stage for the hourly postal code marts.
+
+With `spatial_method = "idw"`, dbt writes the marts as a postal code x hour
+spine with NULL values. This stage fills the unprocessed rows with an
+inverse-distance weighted mean of the mapped stations:
+
+- a sparse (postal code x station) weight matrix W is built per region from
+  raw.station_location_map, w = 1 / max(dist, idw_min_distance_m) ** idw_power,
+  and kept in memory while the region's map is unchanged;
+- station values for a block of `interpolation_block_hours` are read from the
+  raw tables (plus the archived months the block overlaps, deduplicated within
+  the block), cleaned like the int_station_* models, and loaded as a dense
+  (station x hour*metric) array V; the postal code values are
+  (W @ V) / (W @ reported): weights are renormalized over the stations that
+  reported each metric in each hour.
+
+Postal codes without a reporting station stay NULL for processing/gap_fill.py.
+"""
+import logging
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from scipy import sparse
+
+from common import db
+from common.archive import DATASETS, archived_files
+from common.config import settings
+from common.fingerprints import compute_fingerprint, get_fingerprint
+from processing.gap_fill import MARTS, METRICS
+
+logger = logging.getLogger(__name__)
+
+# Fingerprint stage of the station map, per region (processing/station_mapping.py)
+STAGE = "station_location_map"
+
+# mart -> raw dataset of its station values (common.archive.DATASETS)
+SOURCES: Dict[str, str] = {
+    "mart_hourly_observations_pcode": "weather_observations",
+    "mart_hourly_forecasts_pcode": "weather_forecasts_latest",
+}
+
+# Row filter of the int_station_* models (NULLs pass through)
+CLEANING_RULES = """
+    (temperature BETWEEN -50 AND 60 OR temperature IS NULL)
+    AND (relative_humidity BETWEEN 0 AND 100 OR relative_humidity IS NULL)
+"""
+
+HOUR_US = 3_600_000_000
+
+# region -> (map fingerprint, postal codes, stations, weights) of the last build in this process
+_weights_cache: Dict[Optional[str], Tuple[str, pa.Array, pa.Array, sparse.csr_matrix]] = {}
+
+
+def idw_weights(postal_idx: np.ndarray, station_idx: np.ndarray, dist_m: np.ndarray,
+                shape: Tuple[int, int], power: float, min_distance_m: float) -> sparse.csr_matrix:
+    """Sparse (postal code x station) inverse-distance weights."""
+    weights = 1.0 / np.maximum(dist_m, min_distance_m) ** power
+    return sparse.csr_matrix((weights, (postal_idx, station_idx)), shape=shape)
+
+
+def interpolate(weights: sparse.csr_matrix, values: np.ndarray) -> np.ndarray:
+    """
+    Weighted mean of `values` (station x column, NaN = not reported) for every
+    row of `weights`, renormalized over the stations that reported. Rows
+    without any reporting station are NaN.
+    """
+    reported = ~np.isnan(values)
+    total = weights @ np.where(reported, values, 0.0)
+    norm = weights @ reported.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norm > 0, total / norm, np.nan)
+
+
+class SpatialInterpolation:
+    """Fills unprocessed rows of the hourly marts with IDW station values."""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or settings.duckdb_path
+        self.power = settings.idw_power
+        self.min_distance_m = settings.idw_min_distance_m
+        self.block_hours = settings.interpolation_block_hours
+        logger.info(f"Initialized SpatialInterpolation | db: {self.db_path}")
+
+    def weights(self, conn, region: Optional[str]) -> Tuple[pa.Array, pa.Array, sparse.csr_matrix]:
+        """(postal codes, stations, weight matrix) of a region, rebuilt only when its map changed."""
+        fingerprint = compute_fingerprint(
+            get_fingerprint(conn, f"{STAGE}:{region}"), str(self.power), str(self.min_distance_m)
+        )
+        cached = _weights_cache.get(region)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1:]
+
+        pairs = pa.table(conn.execute("""
+            SELECT postal_code, wmo_station_id, dist
+            FROM raw.station_location_map
+            WHERE region IS NOT DISTINCT FROM ?
+        """, [region]).arrow())
+        postal = pc.dictionary_encode(pairs.column("postal_code")).combine_chunks()
+        stations = pc.dictionary_encode(pairs.column("wmo_station_id")).combine_chunks()
+        weights = idw_weights(
+            postal.indices.to_numpy(), stations.indices.to_numpy(),
+            pairs.column("dist").to_numpy(),
+            (len(postal.dictionary), len(stations.dictionary)),
+            self.power, self.min_distance_m,
+        )
+        _weights_cache[region] = (fingerprint, postal.dictionary, stations.dictionary, weights)
+        logger.info(f"[{region}] Weight matrix: {weights.shape[0]} postal codes x {weights.shape[1]} stations, {weights.nnz} weights")
+        return postal.dictionary, stations.dictionary, weights
+
+    def station_values(self, conn, source: str, stations: pa.Array, start, hours: int) -> np.ndarray:
+        """Dense (station x hour x metric) array of a block, NaN where nothing was reported."""
+        ds = DATASETS[source]
+        end = start + timedelta(hours=hours)
+        columns = f"station_id, wmo_station_id, {ds.time_column}, {', '.join(METRICS)}, {ds.order_by}"
+        block = f"{ds.time_column} >= $start AND {ds.time_column} < $end AND list_contains($stations, wmo_station_id)"
+        rows = f"SELECT {columns} FROM {ds.table} WHERE {block}"
+        files = archived_files(source, start, end)
+        if files:
+            # The hot table holds each key once; archived copies of a key only
+            # show up in blocks that reach back into archived months
+            rows = f"""
+                SELECT * FROM (
+                    {rows}
+                    UNION ALL
+                    SELECT {columns}
+                    FROM read_parquet([{", ".join(f"'{f}'" for f in files)}], hive_partitioning = true,
+                                      hive_types = {{'station_id': varchar}}, union_by_name = true)
+                    WHERE {block}
+                )
+                QUALIFY row_number() OVER (PARTITION BY station_id, {", ".join(ds.key)} ORDER BY {ds.order_by} DESC) = 1
+            """
+        rows = pa.table(conn.execute(f"""
+            SELECT wmo_station_id, date_trunc('hour', {ds.time_column}) AS hour,
+                   {", ".join(f"avg({m}) AS {m}" for m in METRICS)}
+            FROM ({rows})
+            WHERE {CLEANING_RULES}
+            GROUP BY ALL
+        """, {"start": start, "end": end, "stations": stations.to_pylist()}).arrow())
+
+        values = np.full((len(stations), hours, len(METRICS)), np.nan)
+        if rows.num_rows:
+            s_idx = pc.index_in(rows.column("wmo_station_id"), value_set=stations).to_numpy()
+            micros = rows.column("hour").cast(pa.timestamp("us")).cast(pa.int64()).to_numpy()
+            h_idx = (micros - _micros(start)) // HOUR_US
+            for m, metric in enumerate(METRICS):
+                values[s_idx, h_idx, m] = rows.column(metric).cast(pa.float64()).to_numpy(zero_copy_only=False)
+        return values
+
+    def fill_mart(self, conn, mart: str, hour_column: str) -> int:
+        table = f"{settings.mart_schema}.{mart}"
+        pending = conn.execute(f"""
+            SELECT region, min({hour_column}), max({hour_column})
+            FROM {table}
+            WHERE fill_method IS NULL
+            GROUP BY region
+            ORDER BY region
+        """).fetchall()
+        if not pending:
+            logger.info(f"{mart}: nothing to interpolate")
+            return 0
+
+        total = 0
+        for region, first, last in pending:
+            postal_codes, stations, weights = self.weights(conn, region)
+            if not len(stations):
+                logger.warning(f"{mart} [{region}]: no mapped stations, leaving values for gap filling")
+                continue
+            span = (_micros(last) - _micros(first)) // HOUR_US + 1
+            for offset in range(0, span, self.block_hours):
+                start = first + timedelta(hours=offset)
+                hours = min(self.block_hours, span - offset)
+                values = self.station_values(conn, SOURCES[mart], stations, start, hours)
+                # One sparse multiply for every hour and metric of the block
+                filled = interpolate(weights, values.reshape(len(stations), -1)).reshape(len(postal_codes), hours, len(METRICS))
+                total += self.write(conn, table, hour_column, postal_codes, start, filled)
+        logger.info(f"✅ {mart}: interpolated {total} rows")
+        return total
+
+    def write(self, conn, table: str, hour_column: str, postal_codes: pa.Array, start, filled: np.ndarray) -> int:
+        """Update the pending mart rows of a block. Returns the rows with any value."""
+        p_idx, h_idx = np.nonzero(~np.isnan(filled).all(axis=2))
+        if not len(p_idx):
+            return 0
+        columns = {
+            "postal_code": postal_codes.take(pa.array(p_idx)),
+            "hour": pa.array(_micros(start) + h_idx * HOUR_US, type=pa.timestamp("us")),
+        }
+        for m, metric in enumerate(METRICS):
+            columns[metric] = pa.array(filled[p_idx, h_idx, m], from_pandas=True)  # NaN -> NULL
+        result = pa.table(columns)
+
+        conn.begin()
+        try:
+            conn.register("interpolated", result)
+            conn.execute(f"""
+                UPDATE {table} AS m
+                SET {", ".join(f"{metric} = i.{metric}" for metric in METRICS)}
+                FROM interpolated i
+                WHERE m.postal_code = i.postal_code AND m.{hour_column} = i.hour
+                  AND m.fill_method IS NULL
+            """)
+            conn.unregister("interpolated")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result.num_rows
+
+    def run(self) -> int:
+        if settings.spatial_method != "idw":
+            logger.info(f"spatial_method is '{settings.spatial_method}', values are picked in dbt")
+            return 0
+        with db.session("interpolation", self.db_path, checkpoint=True) as conn:
+            total = 0
+            for mart, hour_column in MARTS.items():
+                exists = conn.execute("""
+                    SELECT count(*) FROM information_schema.columns
+                    WHERE table_schema = ? AND table_name = ? AND column_name = 'region'
+                """, [settings.mart_schema, mart]).fetchone()[0]
+                if not exists:
+                    logger.warning(f"{mart} not built yet, skipping interpolation")
+                    continue
+                total += self.fill_mart(conn, mart, hour_column)
+            return total
+
+
+def _micros(ts) -> int:
+    return pa.scalar(ts, type=pa.timestamp("us")).value
+
+
+def main():
+    SpatialInterpolation().run()
+
+
+if __name__ == "__main__":
+    main()
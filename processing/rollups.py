@@ -0,0 +1,302 @@
+"""
+Daily and weekly rollups of the hourly postal code marts.
+
+For each mart, two tables in `mart_schema` hold per postal code aggregates:
+
+    rollup_daily_<dataset>   (postal_code, region, day, ...)
+    rollup_weekly_<dataset>  (postal_code, region, week, ...)   week = Monday
+
+with the row count (`hours`, `observed_hours`) and, per metric, min, max,
+mean and the number of hours with a value, plus `precipitation_sum`.
+
+They are maintained incrementally after gap filling, which records every day
+whose mart rows a build rewrote in `mart_day_changes` (whatever the reason:
+new rows, a changed station map or SPATIAL_METHOD, a full refresh). Each
+rollup row keeps the `changed_at` of its day, so the days logged after the
+daily rollup's latest `changed_at` are re-aggregated from the mart, and only
+the weeks containing them from the daily rollup. A full refresh of the marts
+drops the rollups (orchestration/dbt_runner.py); missing rollups are rebuilt
+from every day of the mart.
+
+`summarize()` answers a range request from the coarsest tables that cover
+it: whole weeks from the weekly rollup, whole days from the daily one and
+only the partial days at the edges from the hourly mart.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+
+from common import db
+from common.config import settings
+from common.init_db import has_column
+from processing.gap_fill import MARTS, METRICS, changes_table, create_changes_table
+
+logger = logging.getLogger(__name__)
+
+# mart -> dataset name used in the rollup table names
+DATASETS = {
+    "mart_hourly_observations_pcode": "observations",
+    "mart_hourly_forecasts_pcode": "forecasts",
+}
+
+GRAINS = ("hour", "day", "week")
+
+
+def rollup_table(dataset: str, grain: str) -> str:
+    return f"{settings.mart_schema}.rollup_{'daily' if grain == 'day' else 'weekly'}_{dataset}"
+
+
+def _mart_name(dataset: str) -> str:
+    return next(m for m, d in DATASETS.items() if d == dataset)
+
+
+def _mart(dataset: str) -> Tuple[str, str]:
+    mart = _mart_name(dataset)
+    return f"{settings.mart_schema}.{mart}", MARTS[mart]
+
+
+def _columns(bucket: str) -> str:
+    metrics = ",\n".join(
+        f"{m}_min DOUBLE, {m}_max DOUBLE, {m}_mean DOUBLE, {m}_hours INTEGER" for m in METRICS
+    )
+    return f"""
+        postal_code VARCHAR NOT NULL,
+        region VARCHAR,
+        {bucket} DATE NOT NULL,
+        hours INTEGER,
+        observed_hours INTEGER,
+        {metrics},
+        precipitation_sum DOUBLE,
+        ingested_through TIMESTAMP,
+        changed_at TIMESTAMP
+    """
+
+
+def _from_hours(hour_column: str) -> str:
+    """Aggregates of hourly mart rows, in rollup columns (without the bucket)."""
+    metrics = ",\n".join(
+        f"min({m}) AS {m}_min, max({m}) AS {m}_max, avg({m}) AS {m}_mean, count({m}) AS {m}_hours"
+        for m in METRICS
+    )
+    return f"""
+        any_value(region) AS region,
+        count(*) AS hours,
+        count(*) FILTER (WHERE fill_method = 'observed') AS observed_hours,
+        {metrics},
+        sum(precipitation) AS precipitation_sum,
+        max(ingested_through) AS ingested_through
+    """
+
+
+def _from_rollup() -> str:
+    """Aggregates of finer rollup rows, in rollup columns (without the bucket)."""
+    metrics = ",\n".join(
+        f"min({m}_min) AS {m}_min, max({m}_max) AS {m}_max, "
+        f"sum({m}_mean * {m}_hours) / nullif(sum({m}_hours), 0) AS {m}_mean, sum({m}_hours)::BIGINT AS {m}_hours"
+        for m in METRICS
+    )
+    return f"""
+        any_value(region) AS region,
+        sum(hours)::BIGINT AS hours,
+        sum(observed_hours)::BIGINT AS observed_hours,
+        {metrics},
+        sum(precipitation_sum) AS precipitation_sum,
+        max(ingested_through) AS ingested_through
+    """
+
+
+class Rollups:
+    """Keeps the daily and weekly rollups of the hourly marts up to date."""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or settings.duckdb_path
+        logger.info(f"Initialized Rollups | db: {self.db_path}")
+
+    def update(self, conn, dataset: str) -> int:
+        """Re-aggregate the days (and weeks) changed since the last update. Returns the days rebuilt."""
+        mart, hour_column = _mart(dataset)
+        daily, weekly = rollup_table(dataset, "day"), rollup_table(dataset, "week")
+        params = {"mart": _mart_name(dataset)}
+
+        if not has_column(conn, settings.mart_schema, daily.split(".")[1], "changed_at"):
+            # Missing (first run, full refresh) or built before the change log: every day
+            conn.execute(f"DROP TABLE IF EXISTS {daily}")
+            conn.execute(f"DROP TABLE IF EXISTS {weekly}")
+            conn.execute(f"CREATE TABLE {daily} ({_columns('day')})")
+            conn.execute(f"CREATE TABLE {weekly} ({_columns('week')})")
+            conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE rollup_days AS
+                SELECT DISTINCT {hour_column}::DATE AS day,
+                       (SELECT max(changed_at) FROM {changes_table()} WHERE mart = $mart) AS changed_at
+                FROM {mart}
+            """, params)
+        else:
+            conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE rollup_days AS
+                SELECT day, changed_at
+                FROM {changes_table()}
+                WHERE mart = $mart
+                  AND changed_at > (SELECT coalesce(max(changed_at), '1900-01-01'::TIMESTAMP) FROM {daily})
+            """, params)
+        days, first, last = conn.execute("SELECT count(*), min(day), max(day) FROM rollup_days").fetchone()
+        if not days:
+            logger.info(f"{dataset}: rollups up to date")
+            return 0
+
+        conn.begin()
+        try:
+            conn.execute(f"DELETE FROM {daily} WHERE day IN (SELECT day FROM rollup_days)")
+            conn.execute(f"""
+                INSERT INTO {daily} BY NAME
+                SELECT postal_code, d.day, {_from_hours(hour_column)}, any_value(d.changed_at) AS changed_at
+                FROM {mart} m
+                JOIN rollup_days d ON m.{hour_column}::DATE = d.day
+                WHERE m.{hour_column} >= $first AND m.{hour_column} < $last + INTERVAL 1 DAY
+                GROUP BY postal_code, d.day
+                ORDER BY d.day, postal_code
+            """, {"first": first, "last": last})
+            conn.execute(f"""
+                DELETE FROM {weekly}
+                WHERE week IN (SELECT DISTINCT date_trunc('week', day)::DATE FROM rollup_days)
+            """)
+            conn.execute(f"""
+                INSERT INTO {weekly} BY NAME
+                SELECT postal_code, date_trunc('week', day)::DATE AS week, {_from_rollup()},
+                       max(changed_at) AS changed_at
+                FROM {daily}
+                WHERE date_trunc('week', day)::DATE IN (SELECT DISTINCT date_trunc('week', day)::DATE FROM rollup_days)
+                GROUP BY postal_code, week
+                ORDER BY week, postal_code
+            """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"✅ {dataset}: rebuilt rollups of {days} days ({first} to {last})")
+        return days
+
+    def run(self) -> int:
+        with db.session("rollups", self.db_path, checkpoint=True) as conn:
+            create_changes_table(conn)
+            total = 0
+            for mart, dataset in DATASETS.items():
+                exists = conn.execute("""
+                    SELECT count(*) FROM information_schema.columns
+                    WHERE table_schema = ? AND table_name = ? AND column_name = 'ingested_through'
+                """, [settings.mart_schema, mart]).fetchone()[0]
+                if not exists:
+                    logger.warning(f"{mart} not built yet, skipping rollups")
+                    continue
+                total += self.update(conn, dataset)
+            return total
+
+
+def drop_rollups(conn):
+    """Drop every rollup table; the next update rebuilds them from the marts."""
+    for dataset in DATASETS.values():
+        for grain in ("day", "week"):
+            conn.execute(f"DROP TABLE IF EXISTS {rollup_table(dataset, grain)}")
+
+
+def _floor_day(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(ts: datetime) -> datetime:
+    day = _floor_day(ts)
+    return day if day == ts else day + timedelta(days=1)
+
+
+def _floor_week(day: datetime) -> datetime:
+    return day - timedelta(days=day.weekday())
+
+
+def _ceil_week(day: datetime) -> datetime:
+    week = _floor_week(day)
+    return week if week == day else week + timedelta(days=7)
+
+
+def plan_ranges(start: datetime, end: datetime) -> List[Tuple[str, datetime, datetime]]:
+    """Cover [start, end) with (grain, start, end) pieces of the coarsest grain that fits."""
+    day_start, day_end = _ceil_day(start), _floor_day(end)
+    if day_start >= day_end:
+        return [("hour", start, end)] if start < end else []
+    week_start, week_end = _ceil_week(day_start), _floor_week(day_end)
+
+    pieces = [("hour", start, day_start)]
+    if week_start < week_end:
+        pieces += [("day", day_start, week_start), ("week", week_start, week_end), ("day", week_end, day_end)]
+    else:
+        pieces.append(("day", day_start, day_end))
+    pieces.append(("hour", day_end, end))
+    return [(grain, a, b) for grain, a, b in pieces if a < b]
+
+
+def summarize(conn, dataset: str, start: datetime, end: datetime,
+              postal_codes: Optional[Iterable[str]] = None) -> pa.Table:
+    """
+    Per postal code aggregates over [start, end) (naive UTC), read from the
+    weekly and daily rollups where whole weeks / days are covered and from the
+    hourly mart for the rest. Columns as in the rollup tables, without the bucket.
+    """
+    mart, hour_column = _mart(dataset)
+    codes = list(postal_codes) if postal_codes is not None else None
+    where_codes = "AND list_contains($codes, postal_code)" if codes is not None else ""
+
+    parts, params = [], {}
+    for i, (grain, a, b) in enumerate(plan_ranges(start, end)):
+        params[f"start{i}"], params[f"end{i}"] = a, b
+        if grain == "hour":
+            parts.append(f"""
+                SELECT postal_code, {_from_hours(hour_column)}
+                FROM {mart}
+                WHERE {hour_column} >= $start{i} AND {hour_column} < $end{i} {where_codes}
+                GROUP BY postal_code
+            """)
+        else:
+            bucket = "day" if grain == "day" else "week"
+            parts.append(f"""
+                SELECT * EXCLUDE ({bucket})
+                FROM {rollup_table(dataset, grain)}
+                WHERE {bucket} >= $start{i}::DATE AND {bucket} < $end{i}::DATE {where_codes}
+            """)
+    if not parts:
+        raise ValueError(f"Empty range {start} to {end}")
+    if codes is not None:
+        params["codes"] = codes
+
+    return pa.table(conn.execute(f"""
+        SELECT postal_code, {_from_rollup()}
+        FROM ({" UNION ALL BY NAME ".join(parts)})
+        GROUP BY postal_code
+        ORDER BY postal_code
+    """, params).arrow())
+
+
+def series(conn, dataset: str, grain: str, start: datetime, end: datetime,
+           postal_codes: Optional[Iterable[str]] = None) -> pa.Table:
+    """Rows of one grain ("hour" = the mart, "day", "week") with buckets starting in [start, end)."""
+    if grain not in GRAINS:
+        raise ValueError(f"Unknown grain '{grain}'. Use one of {GRAINS}")
+    if grain == "hour":
+        table, bucket = _mart(dataset)
+    else:
+        table, bucket = rollup_table(dataset, grain), grain
+    codes = list(postal_codes) if postal_codes is not None else None
+    return pa.table(conn.execute(f"""
+        SELECT * FROM {table}
+        WHERE {bucket} >= $start AND {bucket} < $end
+          {"AND list_contains($codes, postal_code)" if codes is not None else ""}
+        ORDER BY postal_code, {bucket}
+    """, {"start": start, "end": end, **({"codes": codes} if codes is not None else {})}).arrow())
+
+
+def main():
+    logging.basicConfig(level=settings.log_level)
+    Rollups().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Station <-> postal code mapping stage.
+
+Builds a haversine BallTree over active station points and queries every
+postal code centroid for its k nearest stations within the search radius in
+one vectorized pass, region by region: each region's postal codes only see
+that region's stations, within its own `station_map_radius_m`. The result
+lands in raw.station_location_map, which the dbt model int_station_location_map
+reads. A region's map is only rebuilt when its station set or postal code
+centroids change.
+"""
+import logging
+from typing import Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+
+from common import db
+from common.config import settings
+from common.fingerprints import compute_fingerprint, get_fingerprint, set_fingerprint
+from common.regions import Region, active_regions
+
+logger = logging.getLogger(__name__)
+
+STAGE = "station_location_map"
+EARTH_RADIUS_M = 6371000.0
+
+
+def nearest_stations(station_latlon: np.ndarray, postal_latlon: np.ndarray, k: int, radius_m: float):
+    """
+    Return (postal_idx, station_idx, dist_m, rank) arrays for the k nearest
+    stations of every postal code within `radius_m`. Inputs are degrees.
+    """
+    from sklearn.neighbors import BallTree  # slow to import; only needed when a map is rebuilt
+
+    k = min(k, len(station_latlon))
+    tree = BallTree(np.radians(station_latlon), metric="haversine")
+    dist, idx = tree.query(np.radians(postal_latlon), k=k)  # sorted by distance
+    dist_m = dist * EARTH_RADIUS_M
+
+    within = dist_m <= radius_m
+    postal_idx = np.broadcast_to(np.arange(len(postal_latlon))[:, None], idx.shape)[within]
+    rank = np.broadcast_to(np.arange(1, k + 1)[None, :], idx.shape)[within]
+    return postal_idx, idx[within], dist_m[within], rank
+
+
+class StationLocationMapping:
+    """Maintains raw.station_location_map, one region at a time."""
+
+    def __init__(self, db_path: str = None, regions: Optional[Iterable[str]] = None):
+        self.db_path = db_path or settings.duckdb_path
+        self.regions = active_regions(regions)
+        logger.info(f"Initialized StationLocationMapping | db: {self.db_path} | regions: {[r.name for r in self.regions]}")
+
+    def run(self, force: bool = False) -> bool:
+        """Rebuild the map of every region whose inputs changed. Returns True when any was rebuilt."""
+        with db.session(STAGE, self.db_path) as conn:
+            # Stations with temperature data, computed once for all regions from
+            # the per-station counts the ingestions keep, not the raw tables
+            conn.execute("""
+                CREATE OR REPLACE TEMP TABLE valid_stations_with_temp AS
+                SELECT DISTINCT s.wmo_station_id
+                FROM raw.ingestion_watermarks w
+                JOIN raw.weather_stations s ON s.id = w.station_id
+                WHERE w.temperature_rows > 0 AND s.wmo_station_id IS NOT NULL
+            """)
+            changed = False
+            for region in self.regions:
+                changed |= self.map_region(conn, region, force)
+            return changed
+
+    def map_region(self, conn, region: Region, force: bool = False) -> bool:
+        """Rebuild the map of one region if its inputs changed. Returns True when rebuilt."""
+        # Same station set as stg_stations, restricted to the region's stations with temperature data
+        stations = conn.execute("""
+            SELECT s.wmo_station_id, arg_min(s.lat, s.id) AS lat, arg_min(s.lon, s.id) AS lon
+            FROM raw.weather_stations s
+            INNER JOIN valid_stations_with_temp v ON s.wmo_station_id = v.wmo_station_id
+            WHERE s.last_record >= ? AND s.lat IS NOT NULL AND s.lon IS NOT NULL
+              AND s.id IN (SELECT station_id FROM raw.region_stations WHERE region = ?)
+            GROUP BY s.wmo_station_id
+            ORDER BY s.wmo_station_id
+        """, [settings.station_active_since, region.name]).fetchnumpy()
+        postal_codes = conn.execute("""
+            SELECT plz AS postal_code,
+                   ST_Y(ST_Centroid(geometry)) AS lat,
+                   ST_X(ST_Centroid(geometry)) AS lon
+            FROM raw.postal_codes
+            WHERE geometry IS NOT NULL AND region = ?
+            ORDER BY plz
+        """, [region.name]).fetchnumpy()
+
+        station_latlon = np.column_stack([stations["lat"], stations["lon"]]).astype(np.float64)
+        postal_latlon = np.column_stack([postal_codes["lat"], postal_codes["lon"]]).astype(np.float64)
+
+        stage = region.stage(STAGE)
+        fingerprint = compute_fingerprint(
+            stations["wmo_station_id"], station_latlon,
+            postal_codes["postal_code"], postal_latlon,
+            str(settings.station_map_k), str(region.station_map_radius_m),
+        )
+        if not force and get_fingerprint(conn, stage) == fingerprint:
+            logger.info(f"[{region.name}] Stations and postal codes unchanged, keeping station map")
+            return False
+
+        if len(station_latlon) and len(postal_latlon):
+            postal_idx, station_idx, dist_m, rank = nearest_stations(
+                station_latlon, postal_latlon, settings.station_map_k, region.station_map_radius_m
+            )
+        else:
+            postal_idx = station_idx = rank = np.array([], dtype=np.int64)
+            dist_m = np.array([], dtype=np.float64)
+
+        mapping = pa.table({
+            "postal_code": pa.array(postal_codes["postal_code"], type=pa.string()).take(pa.array(postal_idx)),
+            "wmo_station_id": pa.array(stations["wmo_station_id"], type=pa.string()).take(pa.array(station_idx)),
+            "dist": pa.array(dist_m, type=pa.float64()),
+            "station_rank": pa.array(rank, type=pa.int32()),
+        })
+
+        conn.begin()
+        try:
+            conn.register("mapping", mapping)
+            # Also takes over postal codes another (no longer active) region mapped
+            conn.execute("""
+                DELETE FROM raw.station_location_map
+                WHERE region = ? OR postal_code IN (SELECT plz FROM raw.postal_codes WHERE region = ?)
+            """, [region.name, region.name])
+            conn.execute("""
+                INSERT INTO raw.station_location_map BY NAME
+                SELECT *, ? AS region FROM mapping
+            """, [region.name])
+            conn.unregister("mapping")
+            set_fingerprint(conn, stage, fingerprint, mapping.num_rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        logger.info(
+            f"✅ [{region.name}] Station map rebuilt: {mapping.num_rows} pairs for "
+            f"{len(postal_latlon)} postal codes and {len(station_latlon)} stations"
+        )
+        return True
+
+
+def main():
+    StationLocationMapping().run(force=True)
+
+
+if __name__ == "__main__":
+    main()
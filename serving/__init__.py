@@ -0,0 +1 @@
+"""Read-side access to the marts for downstream consumers"""
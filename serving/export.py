@@ -0,0 +1,307 @@
+"""
+Feature export of the hourly marts for training jobs.
+
+Trainers read files, not the pipeline database. After each build the marts
+are published under `export_dir/<dataset>/` in two forms:
+
+- parquet/day=YYYY-MM-DD/part-0.parquet: one Hive partition per day, sorted
+  by postal code and hour (readable with pyarrow.dataset or read_parquet);
+- tensor/YYYY-MM-<axis>.npy: a dense float32 (postal code x hour x feature)
+  array per month, with YYYY-MM-<axis>.fill.npy holding the int8 fill method
+  code of each (postal code, hour) and YYYY-MM-<axis>.metric_fill.npy that of
+  each (postal code, hour, feature), -1 where there is no row (or, per
+  feature, no per-metric code). <axis> is the first 16 hex digits of the
+  postal code axis fingerprint (see below). All load with
+  np.load(..., mmap_mode="r"), so nothing is copied into memory.
+
+The index files postal_codes-<axis>.json (tensor row order) and
+manifest.json (features, fill method codes, month files and their first hour)
+describe the tensors; open_tensor() reads them without touching DuckDB.
+
+Exports are incremental: manifest.json keeps a content hash per day and the
+latest `mart_day_changes` time it has seen. Only the days logged after that
+are hashed, and only those whose hash changed are rewritten, along with the
+tensor months that contain them. Every file is written to a temp name and
+renamed into place, manifest last, so a reader sees either the previous or
+the new version of a file. Tensor and postal code files are named after the
+postal code axis: when it changes, the new set is written next to the old one
+and the manifest switches to it, and the files of older axes are removed
+afterwards (the previous axis is kept for readers still holding the previous
+manifest).
+"""
+import calendar
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from common import db
+from common.config import settings
+from common.fingerprints import compute_fingerprint
+from processing.gap_fill import FILL_METHODS, METRICS, changes_table, create_changes_table, unpack_codes
+from serving.snapshot import SNAPSHOT_TABLES
+
+logger = logging.getLogger(__name__)
+
+HOUR_US = 3_600_000_000
+
+
+def _write_json(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _write_npy(path: str, array: np.ndarray):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _month_start(month: str) -> datetime:
+    return datetime.strptime(month, "%Y-%m")
+
+
+def _month_hours(month: str) -> int:
+    start = _month_start(month)
+    return calendar.monthrange(start.year, start.month)[1] * 24
+
+
+class FeatureExport:
+    """Publishes the hourly marts as Parquet days and memory-mappable tensors."""
+
+    def __init__(self, db_path: str = None, export_dir: str = None):
+        self.db_path = db_path or settings.duckdb_path
+        self.export_dir = export_dir or settings.export_dir
+        logger.info(f"Initialized FeatureExport | db: {self.db_path} | export: {self.export_dir}")
+
+    def changed_days(self, conn, mart: str, since: Optional[str]) -> Tuple[Optional[list], Optional[datetime]]:
+        """
+        (days logged in mart_day_changes after `since`, latest change time).
+        The days are None without a `since` (first export): every day is checked.
+        """
+        changed_through = conn.execute(
+            f"SELECT max(changed_at) FROM {changes_table()} WHERE mart = ?", [mart]
+        ).fetchone()[0]
+        if since is None:
+            return None, changed_through
+        days = [r[0] for r in conn.execute(
+            f"SELECT day FROM {changes_table()} WHERE mart = ? AND changed_at > ? ORDER BY day",
+            [mart, datetime.fromisoformat(since)],
+        ).fetchall()]
+        return days, changed_through
+
+    def day_hashes(self, conn, table: str, hour_column: str, days: Optional[list] = None) -> Dict[str, str]:
+        """Content hash of the given days of a mart (every day when None)."""
+        window, params = "", []
+        if days is not None:
+            if not days:
+                return {}
+            window = f"WHERE {hour_column} >= ? AND {hour_column} < ? AND {hour_column}::DATE IN (SELECT unnest(?))"
+            params = [min(days), max(days) + timedelta(days=1), days]
+        rows = conn.execute(f"""
+            SELECT strftime({hour_column}, '%Y-%m-%d') AS day, count(*),
+                   bit_xor(hash(postal_code, {hour_column}, {", ".join(METRICS)}, fill_method, fill_codes))
+            FROM {table}
+            {window}
+            GROUP BY day
+        """, params).fetchall()
+        return {day: f"{count}:{digest}" for day, count, digest in rows}
+
+    def write_day(self, conn, table: str, hour_column: str, root: str, day: str) -> int:
+        start = datetime.strptime(day, "%Y-%m-%d")
+        rows = pa.table(conn.execute(f"""
+            SELECT postal_code, region, {hour_column} AS hour, {", ".join(METRICS)}, fill_method, fill_codes
+            FROM {table}
+            WHERE {hour_column} >= ? AND {hour_column} < ?
+            ORDER BY postal_code, hour
+        """, [start, start + timedelta(days=1)]).arrow())
+        path = os.path.join(root, "parquet", f"day={day}", "part-0.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(rows, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return rows.num_rows
+
+    def write_month(self, conn, table: str, hour_column: str, root: str, month: str,
+                    postal_codes: pa.Array, tag: str):
+        """Rebuild the value and fill code tensors of one month for postal code axis `tag`."""
+        start = _month_start(month)
+        hours = _month_hours(month)
+        rows = pa.table(conn.execute(f"""
+            SELECT postal_code, {hour_column} AS hour, {", ".join(METRICS)}, fill_method, fill_codes
+            FROM {table}
+            WHERE {hour_column} >= ? AND {hour_column} < ?
+        """, [start, start + timedelta(hours=hours)]).arrow())
+
+        values = np.full((len(postal_codes), hours, len(METRICS)), np.nan, dtype=np.float32)
+        fill = np.full((len(postal_codes), hours), -1, dtype=np.int8)
+        metric_fill = np.full((len(postal_codes), hours, len(METRICS)), -1, dtype=np.int8)
+        if rows.num_rows:
+            p_idx = pc.index_in(rows.column("postal_code"), value_set=postal_codes).to_numpy()
+            micros = rows.column("hour").cast(pa.timestamp("us")).cast(pa.int64()).to_numpy()
+            h_idx = (micros - pa.scalar(start, type=pa.timestamp("us")).value) // HOUR_US
+            for m, metric in enumerate(METRICS):
+                values[p_idx, h_idx, m] = rows.column(metric).cast(pa.float32()).to_numpy(zero_copy_only=False)  # NULL -> NaN
+            codes = pc.index_in(rows.column("fill_method"), value_set=pa.array(FILL_METHODS.tolist()))
+            fill[p_idx, h_idx] = pc.fill_null(codes, -1).to_numpy()
+            coded = rows.column("fill_codes").is_valid().to_numpy(zero_copy_only=False)
+            packed = rows.column("fill_codes").filter(coded).to_numpy(zero_copy_only=False)
+            metric_fill[p_idx[coded], h_idx[coded]] = unpack_codes(packed)
+
+        _write_npy(os.path.join(root, "tensor", f"{month}-{tag}.npy"), values)
+        _write_npy(os.path.join(root, "tensor", f"{month}-{tag}.fill.npy"), fill)
+        _write_npy(os.path.join(root, "tensor", f"{month}-{tag}.metric_fill.npy"), metric_fill)
+
+    def export_dataset(self, conn, dataset: str, mart: str, hour_column: str) -> int:
+        """Bring one dataset's export up to date. Returns the number of days rewritten."""
+        table = f"{settings.mart_schema}.{mart}"
+        root = os.path.join(self.export_dir, dataset)
+        manifest_path = os.path.join(root, "manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        # Manifests from before the change log, axis-named files or per-metric fill codes start over
+        current_format = "postal_codes_file" in manifest and all(
+            "metric_fill" in entry for entry in manifest.get("months", {}).values()
+        )
+        since = manifest.get("changed_through") if current_format else None
+        candidates, changed_through = self.changed_days(conn, mart, since)
+        hashes = self.day_hashes(conn, table, hour_column, candidates)
+        exported = manifest.get("days", {})
+        checked = set(exported) if candidates is None else {f"{day:%Y-%m-%d}" for day in candidates}
+        # Days dropped from either end of the mart are never logged
+        first, last = conn.execute(f"SELECT min({hour_column})::DATE, max({hour_column})::DATE FROM {table}").fetchone()
+
+        changed = sorted(day for day, digest in hashes.items() if exported.get(day) != digest)
+        removed = sorted(
+            day for day in exported
+            if (day in checked and day not in hashes) or first is None or not f"{first}" <= day <= f"{last}"
+        )
+        days = {**{day: digest for day, digest in exported.items() if day not in removed}, **hashes}
+        if not changed and not removed and since is not None:
+            if changed_through and since != changed_through.isoformat():
+                # Nothing to rewrite, but the logged days need not be hashed again
+                manifest["changed_through"] = changed_through.isoformat()
+                _write_json(manifest_path, manifest)
+            logger.info(f"{dataset}: export up to date ({len(days)} days)")
+            return 0
+
+        postal_codes = pa.array([r[0] for r in conn.execute(
+            f"SELECT DISTINCT postal_code FROM {table} ORDER BY 1"
+        ).fetchall()], type=pa.string())
+        axis = compute_fingerprint(*postal_codes.to_pylist())
+        tag = axis[:16]
+
+        rows = sum(self.write_day(conn, table, hour_column, root, day) for day in changed)
+        for day in removed:
+            shutil.rmtree(os.path.join(root, "parquet", f"day={day}"), ignore_errors=True)
+
+        months = sorted({day[:7] for day in days})
+        postal_codes_file = f"postal_codes-{tag}.json"
+        if manifest.get("postal_codes_file") != postal_codes_file:
+            # New axis: a complete set of files next to the ones the current manifest names
+            _write_json(os.path.join(root, postal_codes_file), postal_codes.to_pylist())
+            rebuild = months
+        elif not current_format:
+            rebuild = months
+        else:
+            rebuild = sorted({day[:7] for day in changed + removed} & set(months))
+        for month in rebuild:
+            self.write_month(conn, table, hour_column, root, month, postal_codes, tag)
+
+        current = {
+            "mart": mart,
+            "features": list(METRICS),
+            "fill_methods": FILL_METHODS.tolist(),
+            "postal_codes": axis,
+            "postal_codes_file": postal_codes_file,
+            "months": {
+                month: {"file": f"tensor/{month}-{tag}.npy", "fill": f"tensor/{month}-{tag}.fill.npy",
+                        "metric_fill": f"tensor/{month}-{tag}.metric_fill.npy",
+                        "first_hour": f"{_month_start(month):%Y-%m-%dT%H:%M:%S}", "hours": _month_hours(month)}
+                for month in months
+            },
+            "days": dict(sorted(days.items())),
+            "changed_through": changed_through and changed_through.isoformat(),
+            "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        _write_json(manifest_path, current)
+        # Keep the previous manifest's files for readers that still hold it
+        self.remove_stale(root, [current, manifest])
+        logger.info(
+            f"✅ {dataset}: exported {len(changed)} days ({rows} rows), removed {len(removed)}, "
+            f"rebuilt {len(rebuild)} tensor months"
+        )
+        return len(changed) + len(removed)
+
+    def remove_stale(self, root: str, manifests: list):
+        """Remove the index and tensor files that none of `manifests` names."""
+        keep = set()
+        for manifest in manifests:
+            keep.add(manifest.get("postal_codes_file", "postal_codes.json"))
+            for entry in manifest.get("months", {}).values():
+                keep.update((entry["file"], entry["fill"], entry.get("metric_fill")))
+        files = [name for name in os.listdir(root) if name.startswith("postal_codes") and name.endswith(".json")]
+        tensor_dir = os.path.join(root, "tensor")
+        if os.path.isdir(tensor_dir):
+            files += [f"tensor/{name}" for name in os.listdir(tensor_dir) if name.endswith(".npy")]
+        for name in files:
+            if name not in keep:
+                os.remove(os.path.join(root, name))
+
+    def run(self) -> Dict[str, int]:
+        with db.session("export", self.db_path) as conn:
+            create_changes_table(conn)
+            summary = {}
+            for dataset, (mart, hour_column) in SNAPSHOT_TABLES.items():
+                exists = conn.execute("""
+                    SELECT count(*) FROM information_schema.tables
+                    WHERE table_schema = ? AND table_name = ?
+                """, [settings.mart_schema, mart]).fetchone()[0]
+                if not exists:
+                    logger.warning(f"{mart} not built yet, skipping export")
+                    continue
+                summary[dataset] = self.export_dataset(conn, dataset, mart, hour_column)
+            return summary
+
+
+def open_tensor(dataset: str, month: str, export_dir: str = None,
+                per_metric: bool = False) -> Tuple[np.ndarray, np.ndarray, list, np.ndarray]:
+    """
+    Memory-map one exported month: (values, fill codes, postal codes, hours).
+    values[p, h, f] is feature manifest["features"][f] of postal_codes[p] at
+    hours[h]; fill codes index manifest["fill_methods"], per (p, h) or with
+    `per_metric` per (p, h, f). No DB connection.
+    """
+    root = os.path.join(export_dir or settings.export_dir, dataset)
+    with open(os.path.join(root, "manifest.json")) as f:
+        manifest = json.load(f)
+    entry = manifest["months"][month]
+    with open(os.path.join(root, manifest["postal_codes_file"])) as f:
+        postal_codes = json.load(f)
+    values = np.load(os.path.join(root, entry["file"]), mmap_mode="r")
+    fill = np.load(os.path.join(root, entry["metric_fill" if per_metric else "fill"]), mmap_mode="r")
+    hours = np.datetime64(entry["first_hour"], "h") + np.arange(entry["hours"])
+    return values, fill, postal_codes, hours
+
+
+def main():
+    logging.basicConfig(level=settings.log_level)
+    FeatureExport().run()
+
+
+if __name__ == "__main__":
+    main()
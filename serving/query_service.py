@@ -0,0 +1,292 @@
+"""
+Postal code weather query service.
+
+A small HTTP/JSON service over the serving snapshot (see serving/snapshot.py):
+
+    GET /observations?plz=10115&start=2026-10-01T00:00&end=2026-10-02T00:00
+    GET /observations?hour=2026-10-01T12:00        (every postal code)
+    GET /forecasts?...                             (same parameters)
+    GET /stats                                     (latency percentiles, cache)
+
+Queries run on a pool of read-only cursors. Results are cached in-process,
+already serialized to JSON, as (dataset, postal code, day) blocks in an LRU
+keyed by the snapshot generation and dropped whenever a new snapshot is
+published, so a repeat read only joins cached bytes.
+
+Usage:
+    python -m serving.query_service
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+import numpy as np
+
+from common.config import settings
+from serving.snapshot import SNAPSHOT_TABLES
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("postal_code", "hour", "temperature", "precipitation", "relative_humidity", "wind_speed", "fill_method")
+
+
+class BlockCache:
+    """Thread-safe LRU of query result blocks."""
+
+    def __init__(self, max_blocks: int):
+        self.max_blocks = max_blocks
+        self._blocks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            self._blocks[key] = block
+            self._blocks.move_to_end(key)
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+class ConnectionPool:
+    """Fixed set of read-only cursors on one snapshot file."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        # A private in-memory instance per pool: duckdb.connect(path) would hand
+        # back a cached instance still bound to the previous snapshot file
+        self._conn = duckdb.connect(":memory:")
+        self._conn.execute(f"ATTACH '{path}' AS snapshot (READ_ONLY)")
+        self._idle: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._conn.cursor())
+
+    def execute(self, query: str, params: list) -> list:
+        cursor = self._idle.get()
+        try:
+            return cursor.execute(query, params).fetchall()
+        finally:
+            self._idle.put(cursor)
+
+
+class LatencyRecorder:
+    """Ring buffer of recent request latencies."""
+
+    def __init__(self, size: int = 10000):
+        self._samples: deque = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        samples = np.fromiter(list(self._samples), dtype=np.float64)
+        if not len(samples):
+            return {"p50_ms": None, "p99_ms": None}
+        p50, p99 = np.percentile(samples, [50, 99]) * 1000
+        return {"p50_ms": round(p50, 3), "p99_ms": round(p99, 3)}
+
+
+class QueryService:
+    """Answers postal code / hour queries from the latest serving snapshot."""
+
+    def __init__(self, snapshot_path: str = None, pool_size: int = None, cache_blocks: int = None):
+        self.snapshot_path = snapshot_path or settings.serving_snapshot_path
+        self.pool_size = pool_size or settings.serving_pool_size
+        self.cache = BlockCache(cache_blocks or settings.serving_cache_blocks)
+        self.latency = LatencyRecorder()
+        self._pool: Optional[ConnectionPool] = None
+        self._snapshot_id: Optional[Tuple[int, float]] = None
+        self._swap_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Switch to a newly published snapshot, if any. Returns True on a switch."""
+        try:
+            st = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return False
+        snapshot_id = (st.st_ino, st.st_mtime)
+        if snapshot_id == self._snapshot_id:
+            return False
+
+        # The previous pool is released once in-flight queries drop their reference
+        with self._swap_lock:
+            self._pool = ConnectionPool(self.snapshot_path, self.pool_size)
+            self._snapshot_id = snapshot_id
+            self.cache.clear()
+        logger.info(f"✅ Serving snapshot {self.snapshot_path} (built {datetime.fromtimestamp(st.st_mtime):%Y-%m-%d %H:%M:%S})")
+        return True
+
+    def _query(self, sql: str, params: list) -> List[tuple]:
+        pool = self._pool
+        if pool is None:
+            raise LookupError("No serving snapshot published yet")
+        return pool.execute(sql, params)
+
+    def _day_block(self, table: str, plz: str, day: date) -> List[Tuple[datetime, bytes]]:
+        """(hour, serialized row) of one postal code and day."""
+        key = (self._snapshot_id, table, plz, day)
+        block = self.cache.get(key)
+        if block is None:
+            start = datetime.combine(day, datetime.min.time())
+            rows = self._query(
+                f"SELECT {', '.join(COLUMNS)} FROM snapshot.{table} "
+                "WHERE postal_code = ? AND hour >= ? AND hour < ? ORDER BY hour",
+                [plz, start, start + timedelta(days=1)],
+            )
+            block = [(r[1], _row_json(r)) for r in rows]
+            self.cache.put(key, block)
+        return block
+
+    def postal_code_range(self, table: str, plz: str, start: datetime, end: datetime) -> bytes:
+        """JSON rows of one postal code with start <= hour <= end, assembled from day blocks."""
+        rows = []
+        day = start.date()
+        while day <= end.date():
+            rows.extend(row for hour, row in self._day_block(table, plz, day) if start <= hour <= end)
+            day += timedelta(days=1)
+        return _json_array(rows)
+
+    def hour_slice(self, table: str, hour: datetime) -> bytes:
+        """JSON rows of every postal code at one hour."""
+        key = (self._snapshot_id, table, None, hour)
+        block = self.cache.get(key)
+        if block is None:
+            rows = self._query(
+                f"SELECT {', '.join(COLUMNS)} FROM snapshot.{table} WHERE hour = ? ORDER BY postal_code",
+                [hour],
+            )
+            block = _json_array([_row_json(r) for r in rows])
+            self.cache.put(key, block)
+        return block
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.latency.count,
+            **self.latency.percentiles(),
+            "cache_blocks": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "snapshot": self.snapshot_path,
+            "snapshot_built_at": (
+                datetime.fromtimestamp(self._snapshot_id[1]).isoformat() if self._snapshot_id else None
+            ),
+        }
+
+
+def _parse_hour(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _row_json(row: tuple) -> bytes:
+    return json.dumps(dict(zip(COLUMNS, row)), default=lambda v: v.isoformat()).encode()
+
+
+def _json_array(rows: List[bytes]) -> bytes:
+    return b"[" + b", ".join(rows) + b"]"
+
+
+def make_handler(service: QueryService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            started = time.perf_counter()
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            table = url.path.strip("/")
+            try:
+                if url.path == "/stats":
+                    self._send(200, json.dumps(service.stats()).encode())
+                    return
+                if table not in SNAPSHOT_TABLES:
+                    self._send(404, b'{"error": "unknown endpoint"}')
+                    return
+                if "plz" in params:
+                    start = _parse_hour(params["start"])
+                    end = _parse_hour(params.get("end", params["start"]))
+                    body = service.postal_code_range(table, params["plz"], start, end)
+                elif "hour" in params:
+                    body = service.hour_slice(table, _parse_hour(params["hour"]))
+                else:
+                    self._send(400, b'{"error": "expected plz and start[/end], or hour"}')
+                    return
+                self._send(200, body)
+            except (KeyError, ValueError) as e:
+                self._send(400, json.dumps({"error": f"bad parameter: {e}"}).encode())
+            except LookupError as e:
+                self._send(503, json.dumps({"error": str(e)}).encode())
+            except Exception as e:
+                logger.exception(f"Query failed: {self.path}")
+                self._send(500, json.dumps({"error": str(e)}).encode())
+            finally:
+                service.latency.record(time.perf_counter() - started)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def _watch_snapshots(service: QueryService, interval_s: float):
+    while True:
+        time.sleep(interval_s)
+        try:
+            service.refresh()
+        except Exception as e:
+            logger.warning(f"Snapshot refresh failed: {e}")
+
+
+def main():
+    logging.basicConfig(level=settings.log_level)
+    service = QueryService()
+    threading.Thread(
+        target=_watch_snapshots, args=(service, settings.serving_refresh_s), daemon=True
+    ).start()
+
+    server = ThreadingHTTPServer((settings.serving_host, settings.serving_port), make_handler(service))
+    logger.info(f"✅ Query service listening on {settings.serving_host}:{settings.serving_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
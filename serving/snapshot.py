@@ -0,0 +1,156 @@
+"""
+Serving snapshot of the hourly marts.
+
+The query service never opens the pipeline database, whose file lock belongs
+to the ingestion writer. Instead, each pipeline run publishes the marts into a
+separate DuckDB file and atomically renames it over `serving_snapshot_path`.
+The rename is the "build finished" signal the service watches for.
+
+The first publish copies the marts, sorted by postal code and hour so point
+lookups only touch a few row groups. Later publishes copy the previous
+snapshot file and replace only the days logged in `mart_day_changes` since the
+snapshot's `published` watermark, each written sorted by postal code and hour.
+"""
+import logging
+import os
+import shutil
+
+from common import db
+from common.config import settings
+from processing.gap_fill import changes_table, create_changes_table
+
+logger = logging.getLogger(__name__)
+
+# snapshot table -> (mart, hour column)
+SNAPSHOT_TABLES = {
+    "observations": ("mart_hourly_observations_pcode", "observation_hour"),
+    "forecasts": ("mart_hourly_forecasts_pcode", "forecast_hour"),
+}
+
+
+def _has_watermarks(conn) -> bool:
+    return conn.execute("""
+        SELECT count(*) FROM duckdb_tables()
+        WHERE database_name = 'snapshot' AND table_name = 'published'
+    """).fetchone()[0] > 0
+
+
+def _create_tables(conn):
+    conn.execute("""
+        CREATE TABLE snapshot.published (
+            mart VARCHAR PRIMARY KEY,
+            changed_through TIMESTAMP
+        )
+    """)
+    for table in SNAPSHOT_TABLES:
+        conn.execute(f"""
+            CREATE TABLE snapshot.{table} (
+                postal_code VARCHAR NOT NULL,
+                hour TIMESTAMP NOT NULL,
+                temperature DOUBLE,
+                precipitation DOUBLE,
+                relative_humidity DOUBLE,
+                wind_speed DOUBLE,
+                fill_method VARCHAR
+            )
+        """)
+
+
+def _publish_table(conn, table: str, mart: str, hour_column: str, full: bool) -> int:
+    """Replace the days of `table` changed since its watermark (all of them when `full`). Returns the days written."""
+    params = {"mart": mart}
+    changed_through = conn.execute(
+        f"SELECT max(changed_at) FROM {changes_table()} WHERE mart = $mart", params
+    ).fetchone()[0]
+    source = f"{settings.mart_schema}.{mart}"
+    if full:
+        conn.execute(f"""
+            INSERT INTO snapshot.{table}
+            SELECT postal_code, {hour_column}, temperature, precipitation,
+                   relative_humidity, wind_speed, fill_method
+            FROM {source}
+            ORDER BY postal_code, {hour_column}
+        """)
+        conn.execute(
+            "INSERT OR REPLACE INTO snapshot.published VALUES ($mart, $changed_through)",
+            {**params, "changed_through": changed_through},
+        )
+        return conn.execute(f"SELECT count(DISTINCT hour::DATE) FROM snapshot.{table}").fetchone()[0]
+
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE snapshot_days AS
+        SELECT day FROM {changes_table()}
+        WHERE mart = $mart
+          AND changed_at > coalesce(
+              (SELECT changed_through FROM snapshot.published WHERE mart = $mart), '1900-01-01'::TIMESTAMP)
+    """, params)
+    days, first, last = conn.execute("SELECT count(*), min(day), max(day) FROM snapshot_days").fetchone()
+    if days:
+        window = {"first": first, "last": last}
+        conn.execute(f"""
+            DELETE FROM snapshot.{table}
+            WHERE hour >= $first AND hour < $last + INTERVAL 1 DAY
+              AND hour::DATE IN (SELECT day FROM snapshot_days)
+        """, window)
+        conn.execute(f"""
+            INSERT INTO snapshot.{table}
+            SELECT postal_code, {hour_column}, temperature, precipitation,
+                   relative_humidity, wind_speed, fill_method
+            FROM {source}
+            WHERE {hour_column} >= $first AND {hour_column} < $last + INTERVAL 1 DAY
+              AND {hour_column}::DATE IN (SELECT day FROM snapshot_days)
+            ORDER BY postal_code, {hour_column}
+        """, window)
+    # Hours a full refresh dropped from the front of the mart are never logged
+    conn.execute(f"DELETE FROM snapshot.{table} WHERE hour < (SELECT min({hour_column}) FROM {source})")
+    conn.execute(
+        "INSERT OR REPLACE INTO snapshot.published VALUES ($mart, $changed_through)",
+        {**params, "changed_through": changed_through},
+    )
+    return days
+
+
+def publish_snapshot(db_path: str = None, snapshot_path: str = None) -> str:
+    """Update a copy of the current snapshot with the changed mart days and swap it into place."""
+    db_path = db_path or settings.duckdb_path
+    snapshot_path = snapshot_path or settings.serving_snapshot_path
+    tmp = snapshot_path + ".tmp"
+    for f in (tmp, tmp + ".wal"):
+        if os.path.exists(f):
+            os.remove(f)
+    if os.path.exists(snapshot_path):
+        # A block copy of the file: much cheaper than re-reading and sorting the marts
+        shutil.copyfile(snapshot_path, tmp)
+
+    with db.session("snapshot", db_path) as conn:
+        create_changes_table(conn)
+        # The instance is shared: drop an attachment left by a failed publish
+        conn.execute("DETACH DATABASE IF EXISTS snapshot")
+        conn.execute(f"ATTACH '{tmp}' AS snapshot")
+        try:
+            full = not _has_watermarks(conn)
+            if full:
+                # First publish, or a snapshot from before the watermarks: start over
+                conn.execute("DETACH snapshot")
+                os.remove(tmp)
+                conn.execute(f"ATTACH '{tmp}' AS snapshot")
+                _create_tables(conn)
+            # No transaction needed: a failed publish never renames the copy into place
+            written = {
+                table: _publish_table(conn, table, mart, hour_column, full)
+                for table, (mart, hour_column) in SNAPSHOT_TABLES.items()
+            }
+        finally:
+            conn.execute("DETACH DATABASE IF EXISTS snapshot")
+
+    os.replace(tmp, snapshot_path)
+    logger.info(f"✅ Published serving snapshot {snapshot_path} (days rewritten: {written})")
+    return snapshot_path
+
+
+def main():
+    publish_snapshot()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import duckdb
+import pytest
+
+from common.config import settings
+from processing.gap_fill import (
+    FFILL, INTERPOLATED, METRICS, OBSERVED, UNFILLED, GapFill, create_changes_table, pack_codes, unpack_codes,
+)
+
+MART = "mart_hourly_observations_pcode"
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.mart_schema}")
+    conn.execute(f"""
+        CREATE TABLE {settings.mart_schema}.{MART} (
+            postal_code VARCHAR, region VARCHAR, observation_hour TIMESTAMP,
+            temperature FLOAT, precipitation FLOAT, relative_humidity FLOAT, wind_speed FLOAT,
+            fill_method VARCHAR, fill_codes UTINYINT
+        )
+    """)
+    create_changes_table(conn)
+    yield conn
+    conn.close()
+
+
+def load(conn, temperatures, first_hour=0):
+    """Rows as dbt writes them: pending, precipitation never reported."""
+    for i, temperature in enumerate(temperatures):
+        conn.execute(f"""
+            INSERT INTO {settings.mart_schema}.{MART}
+            VALUES ('10115', 'berlin', ?, ?, NULL, 50, 2, NULL, NULL)
+        """, [START + timedelta(hours=first_hour + i), temperature])
+
+
+def test_pack_codes_round_trip():
+    codes = [OBSERVED, UNFILLED, INTERPOLATED, FFILL]
+    assert unpack_codes(pack_codes(codes)).tolist() == codes
+
+
+def test_observed_metrics_of_filled_rows_anchor_later_runs(conn):
+    gap_fill = GapFill(db_path=":memory:")
+    load(conn, [10, 11, 12, 13])
+    assert gap_fill.fill_mart(conn, MART, "observation_hour") == 4
+
+    load(conn, [None, None, 16], first_hour=4)
+    assert gap_fill.fill_mart(conn, MART, "observation_hour") == 3
+
+    rows = conn.execute(f"""
+        SELECT temperature, precipitation, fill_method, fill_codes
+        FROM {settings.mart_schema}.{MART} ORDER BY observation_hour
+    """).fetchall()
+    assert [r[0] for r in rows] == [10, 11, 12, 13, 14, 15, 16]
+    assert all(r[1] is None and r[2] == "unfilled" for r in rows)
+    temperature = METRICS.index("temperature")
+    assert [int(unpack_codes(r[3])[temperature]) for r in rows] == [OBSERVED] * 4 + [INTERPOLATED] * 2 + [OBSERVED]
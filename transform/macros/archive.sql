@@ -0,0 +1,76 @@
+{#
+    Parquet archive written by common/archive.py:
+        <archive_dir>/<dataset>/year=YYYY/month=M/station_id=X/*.parquet
+
+    Whether a dataset has archived files is checked when the model is compiled,
+    so views pick up a newly created archive on the next `dbt build`.
+
+    Incremental builds set ARCHIVE_START (orchestration/dbt_runner.py) to the
+    first month they recompute, so the staging views are created reading only
+    the archive from there on; a full refresh reads all of it.
+#}
+
+{% macro archive_glob(dataset) -%}
+    {{ var('archive_dir', env_var('ARCHIVE_DIR', '/app/data/archive')) }}/{{ dataset }}/*/*/*/*.parquet
+{%- endmacro %}
+
+
+{% macro has_archive(dataset) %}
+    {% if not execute %}
+        {{ return(false) }}
+    {% endif %}
+    {% set result = run_query("select count(*) from glob('" ~ archive_glob(dataset) ~ "')") %}
+    {{ return(result.columns[0].values()[0] > 0) }}
+{% endmacro %}
+
+
+{% macro read_archive(dataset) -%}
+    (
+        select * exclude (year, month)
+        from read_parquet(
+            '{{ archive_glob(dataset) }}',
+            hive_partitioning = true,
+            hive_types = {'year': integer, 'month': integer, 'station_id': varchar},
+            union_by_name = true
+        )
+        {%- set archive_start = var('archive_start', none) or env_var('ARCHIVE_START', '') %}
+        {%- if archive_start %}
+        -- Partition pruning: only months on or after `archive_start` are read
+        where make_date(year, month, 1) >= date_trunc('month', date '{{ archive_start }}')
+        {%- endif %}
+    )
+{%- endmacro %}
+
+
+{#
+    Hot rows of `dataset` unioned with its archive. The archive holds each key
+    once (common/archive.py merges the partitions it appends to), so only
+    archived rows at or after the earliest hot row can collide with a hot row
+    (late rows, an archive run interrupted before commit). Only those are
+    deduplicated, keeping the `newest` copy; older archived rows pass through.
+#}
+{% macro union_archive(dataset, columns, time_column, key, newest) %}
+with hot as (
+    select {{ columns }} from {{ source('weather', dataset) }}
+),
+hot_start as (
+    select coalesce(min({{ time_column }}), 'infinity'::timestamp) as ts from hot
+),
+archived as (
+    select {{ columns }} from {{ read_archive(dataset) }}
+)
+(
+    select * from archived
+    where {{ time_column }} < (select ts from hot_start)
+)
+union all
+(
+    select * from (
+        select * from hot
+        union all
+        select * from archived
+        where {{ time_column }} >= (select ts from hot_start)
+    )
+    qualify row_number() over (partition by {{ key }} order by {{ newest }} desc) = 1
+)
+{% endmacro %}
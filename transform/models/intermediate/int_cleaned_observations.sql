@@ -1,23 +1,21 @@
 with source as (
-    select * from {{ ref('stg_observations') }}
+    select * from {{ ref('int_station_observations') }}
 ),
 station_map as (
     select * from {{ ref('int_station_location_map') }}
 )
 
+-- Cleaned station rows matched to every postal code they serve
+-- (stations not in the target area have no postal code and drop out)
 select distinct
     s.wmo_station_id,
     m.postal_code,
     s.timestamp,
-    date_trunc('hour', s.timestamp) as observation_hour,
+    s.observation_hour,
     s.temperature,
     s.precipitation,
     s.relative_humidity,
-    s.wind_speed
+    s.wind_speed,
+    s.ingested_at
 from source s
-left join station_map m on s.wmo_station_id = m.wmo_station_id
-where 
-    -- Some simple cleaning rules (allow NULLs to pass through)
-    (s.temperature between -50 and 60 or s.temperature is null)
-    and (s.relative_humidity between 0 and 100 or s.relative_humidity is null)
-    and m.postal_code is not null -- Filter out stations not in target area
+inner join station_map m on s.wmo_station_id = m.wmo_station_id
@@ -0,0 +1,17 @@
+-- Cleaned observations per station, before they are matched to postal codes.
+-- processing/interpolation.py applies the same cleaning rules (CLEANING_RULES)
+-- to the raw rows of each block it interpolates.
+select
+    wmo_station_id,
+    timestamp,
+    date_trunc('hour', timestamp) as observation_hour,
+    temperature,
+    precipitation,
+    relative_humidity,
+    wind_speed,
+    ingested_at
+from {{ ref('stg_observations') }}
+where 
+    -- Some simple cleaning rules (allow NULLs to pass through)
+    (temperature between -50 and 60 or temperature is null)
+    and (relative_humidity between 0 and 100 or relative_humidity is null)
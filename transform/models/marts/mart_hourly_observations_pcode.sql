@@ -1,27 +1,62 @@
-with time_spine as (
+{{
+    config(
+        materialized='incremental',
+        unique_key=['postal_code', 'observation_hour'],
+        incremental_strategy='delete+insert',
+        on_schema_change='append_new_columns'
+    )
+}}
+
+-- Incremental runs rebuild only hours touched by rows ingested since the last
+-- build, widened by `mart_lookback_hours` for late data. Rebuilt rows get
+-- fill_method NULL; processing/gap_fill.py then fills temporal gaps in place.
+-- With SPATIAL_METHOD=idw (default) the rows are only the postal code x hour
+-- spine: processing/interpolation.py writes the inverse-distance weighted
+-- station values after the build. With `nearest` the best-ranked station
+-- that reported is picked here.
+-- Use `dbt build --full-refresh` to rebuild everything (e.g. after postal code
+-- or station map changes).
+with source_watermark as (
+    select max(ingested_at) as ingested_through
+    from {{ ref('int_cleaned_observations') }}
+),
+build_window as (
+{% if is_incremental() %}
+    select min(observation_hour) - interval ({{ var('mart_lookback_hours') }}) hour as window_start
+    from {{ ref('int_cleaned_observations') }}
+    where ingested_at > (select coalesce(max(ingested_through), '1900-01-01'::timestamp) from {{ this }})
+{% else %}
+    select '1900-01-01'::timestamp as window_start
+{% endif %}
+),
+time_spine as (
     select distinct date_trunc('hour', timestamp) as observation_hour
     from {{ ref('int_cleaned_observations') }}
+    where observation_hour >= (select window_start from build_window)
 ),
 pc_spine as (
-    select p.postal_code, t.observation_hour
-    from (select distinct postal_code from {{ ref('stg_postal_codes') }}) p
+    select p.postal_code, p.region, t.observation_hour
+    from (select distinct postal_code, region from {{ ref('stg_postal_codes') }}) p
     cross join time_spine t
 ),
+{% if env_var('SPATIAL_METHOD', 'idw') == 'nearest' %}
+-- Station values joined to their postal codes directly (not through the
+-- spine), so the join grows with the rows observed rather than with
+-- postal codes x hours x mapped stations
 ranked_data as (
     select
-        p.postal_code,
-        p.observation_hour,
+        c.postal_code,
+        c.observation_hour,
         c.temperature,
         c.precipitation,
         c.relative_humidity,
         c.wind_speed,
         m.station_rank
-    from pc_spine p
-    inner join {{ ref('int_station_location_map') }} m on p.postal_code = m.postal_code
-    left join {{ ref('int_cleaned_observations') }} c 
-        on m.wmo_station_id = c.wmo_station_id 
-        and p.postal_code = c.postal_code
-        and p.observation_hour = c.observation_hour
+    from {{ ref('int_cleaned_observations') }} c
+    inner join {{ ref('int_station_location_map') }} m
+        on c.wmo_station_id = m.wmo_station_id
+        and c.postal_code = m.postal_code
+    where c.observation_hour >= (select window_start from build_window)
 ),
 best_spatial as (
     select *
@@ -32,6 +67,7 @@ best_spatial as (
 merged_with_spine as (
     select
         p.postal_code,
+        p.region,
         p.observation_hour,
         b.temperature,
         b.precipitation,
@@ -42,16 +78,35 @@ merged_with_spine as (
         on p.postal_code = b.postal_code 
         and p.observation_hour = b.observation_hour
 )
+{% else %}
+merged_with_spine as (
+    select
+        p.postal_code,
+        p.region,
+        p.observation_hour,
+        cast(null as float) as temperature,
+        cast(null as float) as precipitation,
+        cast(null as utinyint) as relative_humidity,
+        cast(null as float) as wind_speed
+    from pc_spine p
+)
+{% endif %}
 
 select
     postal_code,
+    region,
     observation_hour,
-    
-    -- Final metrics with temporal fallback (LAG)
-    coalesce(temperature, lag(temperature) over (partition by postal_code order by observation_hour)) as temperature,
-    coalesce(precipitation, lag(precipitation) over (partition by postal_code order by observation_hour)) as precipitation,
-    coalesce(relative_humidity, lag(relative_humidity) over (partition by postal_code order by observation_hour)) as relative_humidity,
-    coalesce(wind_speed, lag(wind_speed) over (partition by postal_code order by observation_hour)) as wind_speed
+    temperature,
+    precipitation,
+    relative_humidity,
+    wind_speed,
+
+    -- Set by processing/gap_fill.py (observed / interpolated / ffill / unfilled)
+    cast(null as varchar) as fill_method,
+    -- Per-metric fill codes, 2 bits per metric (processing/gap_fill.py)
+    cast(null as utinyint) as fill_codes,
+
+    (select ingested_through from source_watermark) as ingested_through
 
 from merged_with_spine
-order by 1, 2
+order by region, postal_code, observation_hour
@@ -1,4 +1,8 @@
-select
+-- raw.weather_forecasts_latest holds the latest vintage of each station and
+-- target hour; older vintages stay in raw.weather_forecasts. Closed months of
+-- both are moved to the Parquet archive, where the newest vintage wins (only
+-- the archived months that can overlap the hot table are deduplicated).
+{% set columns %}
     forecast_timestamp,
     station_id,
     wmo_station_id,
@@ -8,7 +12,13 @@ select
     wind_speed,
     wind_direction,
     condition,
+    issued_at,
     ingested_at
-from {{ source('weather', 'weather_forecasts') }}
--- Only keep the latest forecast for each station at each timestamp
-qualify row_number() over (partition by wmo_station_id, forecast_timestamp order by ingested_at desc) = 1
+{% endset %}
+
+{% if has_archive('weather_forecasts_latest') %}
+{{ union_archive('weather_forecasts_latest', columns, 'forecast_timestamp', 'station_id, forecast_timestamp', 'issued_at') }}
+{% else %}
+select {{ columns }}
+from {{ source('weather', 'weather_forecasts_latest') }}
+{% endif %}
@@ -1,4 +1,10 @@
-select
+-- raw.weather_observations is keyed on (station_id, timestamp) and upserted at
+-- ingestion under one canonical station_id per wmo_station_id (raw.canonical_stations,
+-- assigned once and never moved), so no dedup is needed
+-- for hot rows. Closed months live in the Parquet archive; a key present in both
+-- (late rows, or an archive run interrupted before commit) keeps its newest copy,
+-- and only the archived months that can overlap the hot table are deduplicated.
+{% set columns %}
     timestamp,
     station_id,
     wmo_station_id,
@@ -8,6 +14,11 @@ select
     wind_speed,
     wind_direction,
     ingested_at
+{% endset %}
+
+{% if has_archive('weather_observations') %}
+{{ union_archive('weather_observations', columns, 'timestamp', 'station_id, timestamp', 'ingested_at') }}
+{% else %}
+select {{ columns }}
 from {{ source('weather', 'weather_observations') }}
--- Only keep the latest observation for each station at each timestamp
-qualify row_number() over (partition by wmo_station_id, timestamp order by ingested_at desc) = 1
+{% endif %}
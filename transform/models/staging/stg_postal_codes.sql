@@ -1,4 +1,5 @@
 select
     plz as postal_code,
+    region,
     geometry
 from {{ source('weather', 'postal_codes') }}